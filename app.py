@@ -4,18 +4,45 @@ Desarrollado para análisis de baremos y facturación
 """
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
 from io import BytesIO
 import os
 import sys
+import time
 from datetime import datetime
+from typing import Dict
 
 # Agregar directorio src al path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 from processor import LiquidacionProcessor
+from cache import ExcelCache, file_digest
+from excel_export import write_workbook
+from history import DEFAULT_HISTORY_PATH, HistoryStore
+from incremental import rules_digest
+from jobs import CANCELLED as JOB_CANCELLED, DONE as JOB_DONE, FAILED as JOB_FAILED, JobManager, ProgressProfiler
 from visualizer import LiquidacionVisualizer
 
+# Archivos de referencia y caché de resultados compartida por todas las sesiones
+REFERENCE_FILES = ["data/BaremoOrden.xlsx", "data/Homologado.xlsx"]
+RESULT_CACHE_TTL = 6 * 60 * 60  # segundos
+RESULT_CACHE_MAX_ENTRIES = 20
+
+# Histórico de liquidaciones (SQLite) para las tendencias de varios meses
+HISTORY_PATH = DEFAULT_HISTORY_PATH
+
+# Trabajos en segundo plano: liquidaciones simultáneas en el servidor y refresco del avance
+JOB_WORKERS = 2
+JOB_POLL_SECONDS = 0.5
+JOB_EVENTS_SHOWN = 15
+
+# Formato de encabezados de los Excel descargados
+HEADER_FORMAT = {
+    'bold': True,
+    'text_wrap': True,
+    'valign': 'top',
+    'fg_color': '#D7E4BC',
+    'border': 1
+}
+
 # Configuración de la página
 st.set_page_config(
     page_title="Sistema de Liquidación de Técnicos",
@@ -106,6 +133,164 @@ def initialize_session_state():
         st.session_state.processing_complete = False
     if 'show_help' not in st.session_state:
         st.session_state.show_help = False
+    if 'job_id' not in st.session_state:
+        st.session_state.job_id = None
+
+@st.cache_resource
+def get_processor() -> LiquidacionProcessor:
+    """Procesador único del servidor: reglas compiladas y caché de Excel compartidas."""
+    return LiquidacionProcessor(cache=ExcelCache())
+
+def reference_digest() -> str:
+    """Hash combinado de los archivos de referencia (cambia si se edita el baremo u homologado)."""
+    return "-".join(file_digest(path) for path in REFERENCE_FILES)
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def get_reference_tables(references: str) -> Dict[str, pd.DataFrame]:
+    """Baremo y homologado leídos una vez por servidor (la clave cambia si se editan los archivos).
+    
+    Sus índices quedan compilados en el procesador compartido, y las copias de
+    with_profiler los reutilizan porque reciben estas mismas tablas.
+    """
+    return get_processor().load_references(*REFERENCE_FILES)
+
+@st.cache_resource(ttl=RESULT_CACHE_TTL, max_entries=RESULT_CACHE_MAX_ENTRIES, show_spinner=False)
+def run_liquidacion(cierres_digest: str, consumo_digest: str, references: str, rules_version: str,
+                    _cierres_bytes: bytes, _consumo_bytes: bytes, _progress=None):
+    """Procesa un par de archivos; el resultado se reutiliza entre sesiones.
+    
+    La clave son los hashes (los bytes, con prefijo _, no se vuelven a hashear):
+    mismos archivos, mismas referencias y mismas reglas devuelven el resultado guardado.
+    Es cache_resource y no cache_data: todas las sesiones reciben los mismos
+    DataFrames sin copiarlos, así que el resultado es de solo lectura.
+    `_progress` recibe las etapas del procesamiento (ProgressProfiler del trabajo).
+    """
+    tables = get_reference_tables(references)
+    processor = get_processor().with_profiler(_progress)
+    data = processor.load_data(BytesIO(_cierres_bytes), BytesIO(_consumo_bytes), tables["baremo"], tables["homologado"])
+    final_df, segment_dfs = processor.process_all_segments(data)
+    return data, final_df, segment_dfs
+
+@st.cache_resource
+def get_job_manager() -> JobManager:
+    """Pool de trabajos del servidor: el procesamiento no bloquea la sesión ni a las demás."""
+    return JobManager(max_workers=JOB_WORKERS)
+
+def liquidacion_job(job, cierres_digest: str, consumo_digest: str, references: str, rules_version: str,
+                    cierres_bytes: bytes, consumo_bytes: bytes):
+    """Cuerpo del trabajo en segundo plano: la liquidación cacheada, con avance por etapa."""
+    return run_liquidacion(cierres_digest, consumo_digest, references, rules_version,
+                           cierres_bytes, consumo_bytes, _progress=ProgressProfiler(job))
+
+@st.cache_resource
+def get_history_store() -> HistoryStore:
+    """Histórico compartido; cada consulta abre su propia conexión."""
+    return HistoryStore(HISTORY_PATH)
+
+def show_history_section(visualizer: LiquidacionVisualizer, final_df: pd.DataFrame):
+    """Guarda la liquidación actual en el histórico y grafica la evolución mensual."""
+    store = get_history_store()
+    
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        origen = st.text_input("Origen de la liquidación", value=st.session_state.get("result_origen", ""),
+                               help="Identifica la liquidación junto con el mes (p. ej. la regional)")
+    with col2:
+        st.write("")
+        if st.button("💾 Guardar en Histórico", use_container_width=True):
+            liquidacion_id = store.append(final_df, origen=origen)
+            st.success(f"✅ Liquidación guardada (id {liquidacion_id})")
+    
+    periods = store.periods()
+    if periods.empty:
+        st.info("El histórico está vacío. Guarda una liquidación para ver tendencias de varios meses.")
+        return
+    
+    with st.expander(f"📚 Liquidaciones guardadas ({len(periods)})"):
+        st.dataframe(periods, use_container_width=True)
+    
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        tecnicos = st.multiselect("Técnicos", options=store.distinct("NOMBRE_TECNICO"), default=[])
+    with col2:
+        ciudades = st.multiselect("Ciudades", options=store.distinct("CIUDAD"), default=[])
+    with col3:
+        agrupar = st.selectbox("Agrupar por", ["(Total)", "NOMBRE_TECNICO", "CIUDAD", "SEGMENTO"])
+    metrica = st.radio("Métrica", ["BAREMOS", "FACTURA", "ORDENES"], horizontal=True)
+    
+    by = None if agrupar == "(Total)" else agrupar
+    trend = store.monthly_trend(by=by, tecnico=tecnicos or None, ciudad=ciudades or None)
+    st.plotly_chart(visualizer.create_history_trend(trend, by=by, value=metrica), use_container_width=True)
+
+def job_running() -> bool:
+    job = get_job_manager().get(st.session_state.job_id)
+    return job is not None and not job.done
+
+def show_job_status(job):
+    """Muestra el avance del trabajo de la sesión y recoge su resultado al terminar.
+    
+    Mientras corre se vuelve a ejecutar el script cada JOB_POLL_SECONDS; solo
+    espera el hilo de esta sesión, el procesamiento sigue en el pool.
+    """
+    if job.done:
+        # La sesión se queda con el resultado; el gestor deja de retener el trabajo
+        st.session_state.job_id = None
+        get_job_manager().collect(job.id)
+    
+    if job.status == JOB_DONE:
+        data, final_df, segment_dfs = job.result
+        job.result = None
+        if final_df.empty:
+            st.error("❌ No se generaron datos después del procesamiento. Verifica los archivos de entrada.")
+            st.stop()
+        
+        # Guardar en sesión
+        st.session_state.processed_data = data
+        st.session_state.final_df = final_df
+        st.session_state.segment_dfs = segment_dfs
+        st.session_state.processing_complete = True
+        
+        st.markdown(f"""
+        <div class="success-message">
+            <strong>✅ Procesamiento Completado Exitosamente!</strong><br>
+            Los datos han sido procesados en {job.elapsed:.1f}s y están listos para análisis.
+        </div>
+        """, unsafe_allow_html=True)
+        unmapped = data.get("sin_homologar")
+        if unmapped is not None and not unmapped.empty:
+            st.warning(f"⚠️ {len(unmapped)} materiales del consumo ({int(unmapped['FILAS'].sum()):,} movimientos) "
+                       "no están en el homologado y no se liquidaron. Ver Datos Base > Materiales sin Homologar.")
+        return
+    
+    if job.status == JOB_FAILED:
+        st.error(f"❌ **Error durante el procesamiento:** {job.error}")
+        with st.expander("🔍 Detalles del Error"):
+            st.code(job.traceback or job.error)
+        st.stop()
+    
+    if job.status == JOB_CANCELLED:
+        st.warning("⏹️ Procesamiento cancelado.")
+        return
+    
+    # En cola o ejecutando
+    st.subheader(f"🔄 Procesando liquidación: {job.description}")
+    st.progress(job.progress)
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        st.write(f"{job.message} ({job.elapsed:.0f}s)")
+    with col2:
+        if st.button("⏹️ Cancelar", use_container_width=True):
+            job.cancel()
+            st.rerun()
+    
+    with st.expander("📜 Etapas"):
+        finished = [e for e in job.events_since(0) if e["phase"] == "fin" and not e["stage"].startswith("regla:")]
+        for event in finished[-JOB_EVENTS_SHOWN:]:
+            rows = f" · {event['rows']:,} filas" if event["rows"] is not None else ""
+            st.text(f"{event['stage']}: {event['seconds']:.2f}s{rows}")
+    
+    time.sleep(JOB_POLL_SECONDS)
+    st.rerun()
 
 def validate_files():
     """Valida que los archivos de referencia existan."""
@@ -127,36 +312,9 @@ def create_download_button(df: pd.DataFrame, filename: str, button_text: str):
         st.warning("No hay datos para descargar.")
         return
     
-    # Crear buffer en memoria
+    # Crear buffer en memoria (escritura fila a fila, sin medir todas las celdas)
     buffer = BytesIO()
-    
-    with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Datos')
-        
-        # Formatear el Excel
-        workbook = writer.book
-        worksheet = writer.sheets['Datos']
-        
-        # Formato para headers
-        header_format = workbook.add_format({
-            'bold': True,
-            'text_wrap': True,
-            'valign': 'top',
-            'fg_color': '#D7E4BC',
-            'border': 1
-        })
-        
-        # Aplicar formato a headers
-        for col_num, value in enumerate(df.columns.values):
-            worksheet.write(0, col_num, value, header_format)
-        
-        # Ajustar ancho de columnas
-        for i, col in enumerate(df.columns):
-            max_length = max(
-                df[col].astype(str).map(len).max(),
-                len(str(col))
-            ) + 2
-            worksheet.set_column(i, i, min(max_length, 50))
+    write_workbook(buffer, [("Datos", df)], header_format=HEADER_FORMAT)
     
     buffer.seek(0)
     
@@ -205,7 +363,11 @@ def show_help_section():
         """)
 
 def reset_processing():
-    """Reinicia el estado de procesamiento."""
+    """Reinicia el estado de procesamiento (cancela el trabajo en curso, si hay)."""
+    job = get_job_manager().get(st.session_state.job_id)
+    if job is not None and not job.done:
+        job.cancel()
+    st.session_state.job_id = None
     st.session_state.processed_data = None
     st.session_state.final_df = None
     st.session_state.segment_dfs = []
@@ -275,7 +437,7 @@ def main():
         process_button = st.button(
             "🚀 Procesar Liquidación",
             type="primary",
-            disabled=not (cierres_file and consumo_file),
+            disabled=not (cierres_file and consumo_file) or job_running(),
             use_container_width=True
         )
         
@@ -296,52 +458,20 @@ def main():
     
     # Contenido principal
     if process_button and cierres_file and consumo_file:
-        with st.spinner("🔄 Procesando liquidación... Esto puede tomar unos momentos."):
-            try:
-                # Inicializar procesador
-                processor = LiquidacionProcessor()
-                
-                # Procesar datos
-                progress_bar = st.progress(0)
-                status_placeholder = st.empty()
-                
-                status_placeholder.write("📊 Cargando y validando datos...")
-                progress_bar.progress(20)
-                
-                data = processor.load_data(cierres_file, consumo_file)
-                progress_bar.progress(50)
-                
-                status_placeholder.write("⚡ Aplicando reglas de segmentación...")
-                final_df, segment_dfs = processor.process_all_segments(data)
-                progress_bar.progress(80)
-                
-                if final_df.empty:
-                    progress_bar.progress(100)
-                    status_placeholder.empty()
-                    st.error("❌ No se generaron datos después del procesamiento. Verifica los archivos de entrada.")
-                    st.stop()
-                
-                # Guardar en sesión
-                st.session_state.processed_data = data
-                st.session_state.final_df = final_df
-                st.session_state.segment_dfs = segment_dfs
-                st.session_state.processing_complete = True
-                
-                progress_bar.progress(100)
-                status_placeholder.empty()
-                
-                st.markdown("""
-                <div class="success-message">
-                    <strong>✅ Procesamiento Completado Exitosamente!</strong><br>
-                    Los datos han sido procesados y están listos para análisis.
-                </div>
-                """, unsafe_allow_html=True)
-                
-            except Exception as e:
-                st.error(f"❌ **Error durante el procesamiento:** {str(e)}")
-                with st.expander("🔍 Detalles del Error"):
-                    st.code(str(e))
-                st.stop()
+        reset_processing()
+        processor = get_processor()
+        st.session_state.result_origen = os.path.splitext(cierres_file.name)[0]
+        st.session_state.job_id = get_job_manager().submit(
+            liquidacion_job,
+            file_digest(cierres_file), file_digest(consumo_file), reference_digest(),
+            rules_digest(processor.segment_rules), cierres_file.getvalue(), consumo_file.getvalue(),
+            description=f"{cierres_file.name} / {consumo_file.name}",
+            segments=list(processor.segment_rules)
+        ).id
+    
+    job = get_job_manager().get(st.session_state.job_id)
+    if job is not None:
+        show_job_status(job)
     
     # Mostrar resultados si el procesamiento está completo
     if st.session_state.processing_complete and st.session_state.final_df is not None:
@@ -350,7 +480,8 @@ def main():
         visualizer = LiquidacionVisualizer()
         
         # Tabs para organizar el contenido
-        tab1, tab2, tab3, tab4 = st.tabs(["📈 Dashboard", "📊 Análisis Detallado", "🏆 Rankings", "📋 Datos"])
+        tab1, tab2, tab3, tab4, tab5 = st.tabs(["📈 Dashboard", "📊 Análisis Detallado", "🏆 Rankings", "📋 Datos",
+                                                "📅 Histórico"])
         
         with tab1:
             st.header("📈 Dashboard Ejecutivo")
@@ -499,14 +630,15 @@ def main():
                 if st.session_state.processed_data:
                     base_data_view = st.selectbox(
                         "Seleccionar Datos Base",
-                        ["Cierres Procesados", "Consumo Pivot", "Baremo", "Homologado"]
+                        ["Cierres Procesados", "Consumo Pivot", "Baremo", "Homologado", "Materiales sin Homologar"]
                     )
                     
                     data_map = {
                         "Cierres Procesados": "cierres",
                         "Consumo Pivot": "consumo", 
                         "Baremo": "baremo",
-                        "Homologado": "homologado"
+                        "Homologado": "homologado",
+                        "Materiales sin Homologar": "sin_homologar"
                     }
                     
                     try:
@@ -523,6 +655,13 @@ def main():
                         st.error(f"No se encontraron los datos base para: {base_data_view}")
                 else:
                     st.warning("No hay datos base disponibles. Procesa primero los archivos.")
+        
+        with tab5:
+            st.header("📅 Histórico de Liquidaciones")
+            try:
+                show_history_section(visualizer, final_df)
+            except Exception as e:
+                st.error(f"Error en el histórico: {e}")
     
     elif not st.session_state.processing_complete:
         # Pantalla de bienvenida
@@ -0,0 +1,94 @@
+"""
+Control de equivalencia entre el camino en memoria y el fuera de memoria
+Genera datos sintéticos con PET_ATIS vacíos (que hacen que pandas lea los números
+como float), procesa con load_data + process_all_segments y con process_out_of_core,
+en cada modo de partición, y falla (código 1) si la liquidación, los cierres o
+el consumo no coinciden
+
+Uso:
+    python benchmarks/check_outofcore.py [--orders 3000] [--blank 5] [--memory-budget-mb 1]
+    python benchmarks/check_outofcore.py --partition-by DEPARTAMENTO
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, HERE)
+
+
+def write_dirty_dataset(out_dir: str, orders: int, blank: int, seed: int) -> dict:
+    """Cierres y consumo sintéticos en Excel con `blank` PET_ATIS vacíos en cada tabla."""
+    import numpy as np
+    from synthetic import generate
+
+    rng = np.random.default_rng(seed)
+    paths = {}
+    for name, df in generate(orders, seed=seed).items():
+        df["PET_ATIS"] = df["PET_ATIS"].astype(float)
+        df.loc[rng.choice(df.index.to_numpy(), min(blank, len(df)), replace=False), "PET_ATIS"] = np.nan
+        paths[name] = os.path.join(out_dir, f"{name}.xlsx")
+        df.to_excel(paths[name], index=False)
+    return paths
+
+
+def _comparable(df):
+    """Categorías como texto: cada camino puede llegar a un orden de categorías distinto."""
+    import pandas as pd
+
+    df = df.copy()
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].astype(str)
+    return df
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=3000)
+    parser.add_argument("--blank", type=int, default=5, help="PET_ATIS vacíos en cierres y en consumo")
+    parser.add_argument("--memory-budget-mb", type=int, default=1, help="Presupuesto chico para forzar varias unidades")
+    parser.add_argument("--partition-by", choices=["hash", "DEPARTAMENTO"], nargs="+",
+                        default=["hash", "DEPARTAMENTO"], help="Modos de partición a comprobar (por defecto todos)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+    from processor import CONSUMO_PIVOT_INDEX, LiquidacionProcessor
+
+    baremo = os.path.join(ROOT, "data", "BaremoOrden.xlsx")
+    homologado = os.path.join(ROOT, "data", "Homologado.xlsx")
+    with tempfile.TemporaryDirectory(prefix="check_outofcore_") as tmp:
+        paths = write_dirty_dataset(tmp, args.orders, args.blank, args.seed)
+        processor = LiquidacionProcessor()
+        data = processor.load_data(paths["cierres"], paths["consumo"], baremo, homologado)
+        expected, _ = processor.process_all_segments(data)
+        consumo = data["consumo"].sort_values(CONSUMO_PIVOT_INDEX, kind="stable").reset_index(drop=True)
+        print(f"{args.orders:,} órdenes, {args.blank} PET_ATIS vacíos, FACTURA total {expected['FACTURA'].sum():,.2f}")
+
+        failed = False
+        for partition_by in args.partition_by:
+            result = LiquidacionProcessor().process_out_of_core(
+                paths["cierres"], paths["consumo"], baremo, homologado, memory_budget_mb=args.memory_budget_mb,
+                partition_by=partition_by, spill_dir=os.path.join(tmp, f"spill_{partition_by}"),
+                chunksize=max(1, args.orders // 4))
+            checks = [("liquidación", expected, result.load_final()),
+                      ("cierres", data["cierres"], result.load_cierres()),
+                      ("consumo", consumo, result.load_consumo(CONSUMO_PIVOT_INDEX))]
+            print(f"partition_by={partition_by}: {len(result.files.get('final', []))} unidades fuera de memoria")
+            for name, left, right in checks:
+                try:
+                    pd.testing.assert_frame_equal(_comparable(left), _comparable(right), check_dtype=False)
+                    print(f"  ✅ {name}: {len(left):,} filas iguales")
+                except AssertionError as e:
+                    failed = True
+                    print(f"  ❌ {name} difiere entre memoria y fuera de memoria:\n{e}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Control de tiempo de arranque del núcleo de procesamiento
+Falla (código 1) si importar processor tarda más que el presupuesto o carga
+módulos de visualización
+
+Uso:
+    python benchmarks/import_budget.py [--budget 1.5] [--runs 5]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# Módulos que el camino de procesamiento no debe cargar nunca
+FORBIDDEN = ("streamlit", "plotly", "matplotlib", "seaborn")
+
+_PROBE = """
+import sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+loaded = sorted({{m.split('.')[0] for m in sys.modules}} & set({forbidden!r}))
+print(elapsed, ','.join(loaded))
+"""
+
+
+def measure(module: str, runs: int):
+    """Mejor tiempo de importación en frío (un intérprete nuevo por corrida)."""
+    best = None
+    loaded = set()
+    for _ in range(runs):
+        code = _PROBE.format(src=SRC, module=module, forbidden=FORBIDDEN)
+        out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+        elapsed, mods = out.strip().split(" ", 1) if " " in out.strip() else (out.strip(), "")
+        best = float(elapsed) if best is None else min(best, float(elapsed))
+        loaded |= {m for m in mods.split(",") if m}
+    return best, loaded
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=float(os.environ.get("IMPORT_BUDGET", "1.5")),
+                        help="Segundos máximos para importar processor (por defecto 1.5)")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    failed = False
+    for module, budget in [("processor", args.budget), ("visualizer", args.budget)]:
+        elapsed, loaded = measure(module, args.runs)
+        status = "OK"
+        if loaded:
+            status = f"ERROR: cargó {sorted(loaded)}"
+            failed = True
+        elif elapsed > budget:
+            status = f"ERROR: supera el presupuesto de {budget:.2f}s"
+            failed = True
+        print(f"import {module:<12} {elapsed:6.3f}s  {status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,110 @@
+"""
+Benchmark de los backends de reglas (NumPy y numexpr)
+Evalúa las reglas de cada segmento sobre segmentos de N filas con los dos
+backends, comprueba que den lo mismo (valores y tipos) y muestra el tiempo de cada uno
+
+Uso:
+    python benchmarks/rule_backends.py                        # segmentos de 1M filas
+    python benchmarks/rule_backends.py --rows 250000 --repeat 5 --threads 1 4 8
+"""
+
+import argparse
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, HERE)
+
+
+def build_segments(rows: int, orders: int, seed: int) -> dict:
+    """Órdenes cruzadas de cada segmento, repetidas hasta tener `rows` filas."""
+    import numpy as np
+    from processor import LiquidacionProcessor
+    from synthetic import generate
+
+    processor = LiquidacionProcessor(rule_backend="numpy")
+    data = generate(orders, seed=seed)
+    baremo = processor.read_excel(os.path.join(ROOT, "data", "BaremoOrden.xlsx"))
+    homologado = processor.read_excel(os.path.join(ROOT, "data", "Homologado.xlsx"))
+    cierres = processor._process_cierres(processor.clean_columns(data["cierres"]))
+    consumo = processor._process_consumo(processor.clean_columns(data["consumo"]), homologado)
+    merged = processor._merge_data(cierres, consumo, baremo)
+
+    segments = {}
+    for seg_name in processor.segment_rules:
+        seg_df = processor.filter_segment(merged, seg_name)
+        if not seg_df.empty:
+            segments[seg_name] = seg_df.iloc[np.resize(np.arange(len(seg_df)), rows)].reset_index(drop=True)
+    return segments
+
+
+def best_time(fn, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="Filas de cada segmento")
+    parser.add_argument("--orders", type=int, default=200_000, help="Órdenes sintéticas de las que se toman las filas")
+    parser.add_argument("--repeat", type=int, default=3, help="Repeticiones (se informa la mejor)")
+    parser.add_argument("--threads", type=int, nargs="+", default=None,
+                        help="Hilos de numexpr a medir (por defecto los que usa numexpr)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    import numpy as np
+    from processor import EQUIPO_COLS, LiquidacionProcessor
+    from rules import HAS_NUMEXPR
+
+    if not HAS_NUMEXPR:
+        print("❌ numexpr no está instalado (pip install numexpr): solo está disponible el backend NumPy")
+        return 1
+    import numexpr
+
+    segments = build_segments(args.rows, args.orders, args.seed)
+    threads = args.threads or [numexpr.get_num_threads()]
+    graphs = {backend: LiquidacionProcessor(rule_backend=backend) for backend in ("numpy", "numexpr")}
+
+    header = f"{'Segmento':<18} {'Reglas':>6} {'NumPy s':>9}" + "".join(f" {f'numexpr {t}h':>12}" for t in threads)
+    print(f"Segmentos de {args.rows:,} filas, mejor de {args.repeat}")
+    print(header + f" {'Mejora':>8}")
+    print("-" * (len(header) + 9))
+    for seg_name, seg_df in segments.items():
+        rules = graphs["numpy"].segment_rules[seg_name]
+        numpy_graph = graphs["numpy"]._get_rule_graph(rules, seg_name)
+        fused_graph = graphs["numexpr"]._get_rule_graph(rules, seg_name)
+
+        # Mismo resultado y mismo tipo con los dos backends, también con conteos float (sin downcast_counts)
+        float_counts = seg_df.astype({c: float for c in EQUIPO_COLS if c in seg_df.columns})
+        for variant, df in (("", seg_df), (" con conteos float", float_counts)):
+            expected = numpy_graph.evaluate(df.copy())
+            result = fused_graph.evaluate(df.copy())
+            for rule in rules:
+                left, right = expected[rule["col"]], result[rule["col"]]
+                if left.dtype != right.dtype:
+                    print(f"❌ {seg_name}{variant}: {rule['col']} es {left.dtype} con NumPy y {right.dtype} con numexpr")
+                    return 1
+                if not np.array_equal(left.to_numpy(dtype=float), right.to_numpy(dtype=float), equal_nan=True):
+                    print(f"❌ {seg_name}{variant}: {rule['col']} difiere entre backends")
+                    return 1
+
+        base = best_time(lambda: numpy_graph.evaluate(seg_df.copy()), args.repeat)
+        fused = []
+        for t in threads:
+            numexpr.set_num_threads(t)
+            fused.append(best_time(lambda: fused_graph.evaluate(seg_df.copy()), args.repeat))
+        print(f"{seg_name:<18} {len(rules):>6} {base:>9.3f}" + "".join(f" {s:>12.3f}" for s in fused)
+              + f" {base / min(fused):>7.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
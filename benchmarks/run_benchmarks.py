@@ -0,0 +1,217 @@
+"""
+Benchmark del pipeline de liquidación sobre datos sintéticos
+Mide cada etapa (lectura, _process_cierres, _process_consumo, _merge_data, cada
+process_segment y exportación) con su throughput y el pico de memoria (RSS)
+
+Uso:
+    python benchmarks/run_benchmarks.py                       # 10k y 100k órdenes
+    python benchmarks/run_benchmarks.py --sizes 10000 100000 1000000 --skip-export
+    python benchmarks/run_benchmarks.py --output resultados.json --compare base.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, HERE)
+
+
+def peak_rss_mb() -> float:
+    """Pico de memoria residente del proceso en MB (ru_maxrss está en KB en Linux)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+class StageTimer:
+    """Acumula tiempo, filas de entrada/salida y pico de memoria por etapa."""
+
+    def __init__(self):
+        self.stages = []
+
+    def run(self, name: str, fn, rows_in: int = 0, rows_out: int = None):
+        start = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - start
+        if rows_out is None:
+            rows_out = len(result) if hasattr(result, "shape") else 0
+        self.stages.append({
+            "etapa": name, "segundos": elapsed, "filas_entrada": int(rows_in), "filas_salida": int(rows_out),
+            "filas_por_segundo": (rows_in or rows_out) / elapsed if elapsed > 0 else 0.0,
+            "pico_rss_mb": peak_rss_mb(),
+        })
+        return result
+
+
+def read_input(processor, path: str):
+    """Lee un archivo de entrada (Excel, CSV o Parquet) con columnas limpias."""
+    import pandas as pd
+
+    lower = path.lower()
+    if lower.endswith((".csv", ".csv.gz")):
+        return processor.clean_columns(pd.read_csv(path))
+    if lower.endswith(".parquet"):
+        return processor.clean_columns(pd.read_parquet(path))
+    return processor.read_excel(path)
+
+
+def bench_size(n_orders: int, paths: dict, args) -> dict:
+    """Mide todas las etapas del pipeline sobre un juego de archivos ya generado."""
+    from processor import LiquidacionProcessor
+
+    workdir = os.path.dirname(paths["cierres"])
+    base_rss = peak_rss_mb()
+
+    processor = LiquidacionProcessor(rule_workers=args.rule_workers, rule_backend=args.rule_backend)
+    timer = StageTimer()
+    cierres_raw = timer.run("leer_cierres", lambda: read_input(processor, paths["cierres"]))
+    consumo_raw = timer.run("leer_consumo", lambda: read_input(processor, paths["consumo"]))
+    n_movimientos = len(consumo_raw)
+    baremo = processor.read_excel(os.path.join(ROOT, "data", "BaremoOrden.xlsx"))
+    homologado = processor.read_excel(os.path.join(ROOT, "data", "Homologado.xlsx"))
+
+    cierres = timer.run("_process_cierres", lambda: processor._process_cierres(cierres_raw), len(cierres_raw))
+    # El bloque crudo entra como argumento: la lambda no depende del nombre que se borra después
+    consumo = timer.run("_process_consumo", lambda df=consumo_raw: processor._process_consumo(df, homologado),
+                        len(consumo_raw))
+    del consumo_raw
+    merged = timer.run("_merge_data", lambda: processor._merge_data(cierres, consumo, baremo), len(cierres))
+    load_total = sum(s["segundos"] for s in timer.stages)
+
+    segments = []
+    for seg_name, rules in processor.segment_rules.items():
+        seg_rows = len(processor.filter_segment(merged, seg_name))
+        df_segment = timer.run(f"segmento:{seg_name}",
+                               lambda: processor.process_segment(merged, seg_name, rules, baremo), seg_rows)
+        if not df_segment.empty:
+            segments.append((seg_name, df_segment))
+
+    final_df = timer.run("consolidar", lambda: processor.consolidate_segments([df for _, df in segments]),
+                         sum(len(df) for _, df in segments))
+
+    if not args.skip_export:
+        out = os.path.join(workdir, f"Liquidacion_{n_orders}.xlsx")
+        try:
+            timer.run("export", lambda: processor.export_to_excel(
+                final_df, segments, {"Cierres": merged, "Consumo Pivot": consumo}, filename=out),
+                len(final_df), len(final_df))
+        except Exception as e:
+            timer.stages.append({"etapa": "export", "error": f"{type(e).__name__}: {e}"})
+
+    return {
+        "ordenes": n_orders, "movimientos": n_movimientos,
+        "filas_liquidacion": int(len(final_df)), "factura_total": float(final_df["FACTURA"].sum()),
+        "load_data_segundos": load_total, "rss_base_mb": base_rss, "pico_rss_mb": peak_rss_mb(),
+        "etapas": timer.stages,
+    }
+
+
+def run_isolated(n_orders: int, args) -> dict:
+    """Genera los datos y mide el tamaño en un intérprete nuevo para que el pico de RSS no se mezcle."""
+    from synthetic import write_dataset
+
+    workdir = args.data_dir or tempfile.mkdtemp(prefix="bench_liquidacion_")
+    paths = write_dataset(workdir, n_orders, args.format, fibra_ratio=args.fibra, alta_ratio=args.alta,
+                          seed=args.seed)
+    cmd = [sys.executable, os.path.abspath(__file__), "--single", str(n_orders),
+           "--cierres", paths["cierres"], "--consumo", paths["consumo"],
+           "--rule-workers", str(args.rule_workers), "--rule-backend", args.rule_backend]
+    if args.skip_export:
+        cmd.append("--skip-export")
+    out = subprocess.run(cmd, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def print_result(result: dict):
+    print(f"\n📊 {result['ordenes']:,} órdenes → {result['filas_liquidacion']:,} filas liquidadas "
+          f"(pico RSS {result['pico_rss_mb']:,.0f} MB)")
+    print(f"{'Etapa':<28} {'Segundos':>9} {'Filas entrada':>14} {'Filas salida':>13} {'Filas/s':>12} {'RSS MB':>8}")
+    for s in result["etapas"]:
+        if "error" in s:
+            print(f"{s['etapa']:<28} ERROR: {s['error']}")
+            continue
+        print(f"{s['etapa']:<28} {s['segundos']:>9.3f} {s['filas_entrada']:>14,} {s['filas_salida']:>13,} "
+              f"{s['filas_por_segundo']:>12,.0f} {s['pico_rss_mb']:>8,.0f}")
+    print(f"{'load_data (total)':<28} {result['load_data_segundos']:>9.3f}")
+
+
+def compare(results: list, baseline_path: str, tolerance: float) -> list:
+    """Etapas que empeoraron más que `tolerance` (fracción) respecto a una corrida guardada."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {r["ordenes"]: r for r in json.load(f)["resultados"]}
+    regressions = []
+    for result in results:
+        base = baseline.get(result["ordenes"])
+        if base is None:
+            continue
+        base_stages = {s["etapa"]: s for s in base["etapas"] if "segundos" in s}
+        for s in result["etapas"]:
+            b = base_stages.get(s["etapa"])
+            if b and "segundos" in s and s["segundos"] > b["segundos"] * (1 + tolerance) and s["segundos"] > 0.05:
+                regressions.append(f"{result['ordenes']:,} órdenes / {s['etapa']}: "
+                                   f"{b['segundos']:.3f}s → {s['segundos']:.3f}s")
+        if result["pico_rss_mb"] > base["pico_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{result['ordenes']:,} órdenes / pico RSS: "
+                               f"{base['pico_rss_mb']:,.0f} → {result['pico_rss_mb']:,.0f} MB")
+    return regressions
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--format", default="auto", choices=["auto", "xlsx", "csv", "parquet"])
+    parser.add_argument("--fibra", type=float, default=0.7, help="Proporción de órdenes FIBRA")
+    parser.add_argument("--alta", type=float, default=0.5, help="Proporción de órdenes ALTA")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rule-workers", type=int, default=1)
+    parser.add_argument("--rule-backend", choices=["auto", "numpy", "numexpr"], default="numpy",
+                        help="Motor de las reglas (ver benchmarks/rule_backends.py)")
+    parser.add_argument("--data-dir", default=None, help="Carpeta donde dejar los archivos generados")
+    parser.add_argument("--skip-export", action="store_true", help="No medir la exportación a Excel")
+    parser.add_argument("--output", default=None, help="Guardar resultados en JSON")
+    parser.add_argument("--compare", default=None, help="JSON de una corrida anterior para detectar regresiones")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Empeoramiento permitido (0.2 = 20%%)")
+    parser.add_argument("--single", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--cierres", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--consumo", default=None, help=argparse.SUPPRESS)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+
+    if args.single is not None:
+        paths = {"cierres": args.cierres, "consumo": args.consumo}
+        print(json.dumps(bench_size(args.single, paths, args)))
+        return 0
+
+    results = []
+    for n in args.sizes:
+        result = run_isolated(n, args)
+        print_result(result)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"resultados": results}, f, indent=2)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print("\n⚠ Regresiones detectadas:")
+            for r in regressions:
+                print(f"   • {r}")
+            return 1
+        print("\n✅ Sin regresiones respecto a la corrida de referencia")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
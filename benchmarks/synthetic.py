@@ -0,0 +1,151 @@
+"""
+Generador de datos sintéticos de cierres y consumo
+Produce archivos con las columnas que esperan _process_cierres y _process_consumo,
+usando las combinaciones reales de BaremoOrden.xlsx y los materiales de Homologado.xlsx
+"""
+
+import os
+from typing import Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Límite de filas de una hoja de Excel
+EXCEL_MAX_ROWS = 1_048_576
+
+CIUDADES = {
+    "BOGOTA": "CUNDINAMARCA", "SOACHA": "CUNDINAMARCA", "MEDELLIN": "ANTIOQUIA", "BELLO": "ANTIOQUIA",
+    "CALI": "VALLE", "PALMIRA": "VALLE", "BARRANQUILLA": "ATLANTICO", "CARTAGENA": "BOLIVAR",
+    "BUCARAMANGA": "SANTANDER", "PEREIRA": "RISARALDA", "MANIZALES": "CALDAS", "PASTO": "NARIÑO",
+}
+
+
+def _reference_tables() -> Tuple[pd.DataFrame, pd.DataFrame]:
+    baremo = pd.read_excel(os.path.join(ROOT, "data", "BaremoOrden.xlsx"))
+    homologado = pd.read_excel(os.path.join(ROOT, "data", "Homologado.xlsx"))
+    for df in (baremo, homologado):
+        df.columns = df.columns.str.strip().str.upper()
+    return baremo, homologado
+
+
+def generate(n_orders: int, fibra_ratio: float = 0.7, alta_ratio: float = 0.5,
+             materials_per_order: float = 4.0, seed: int = 0,
+             period: str = "2025-01") -> Dict[str, pd.DataFrame]:
+    """Genera cierres (una fila por orden) y consumo (una fila por movimiento de material).
+
+    fibra_ratio y alta_ratio controlan la mezcla FIBRA/COBRE y ALTA/POSVENTA.
+    """
+    rng = np.random.default_rng(seed)
+    baremo, homologado = _reference_tables()
+
+    # Tipo y subtipo de orden tomados de las combinaciones que existen en el baremo
+    keys = baremo[["MEDIO DE ACCESO", "TIPOORDENFINAL", "SUBTIPOORDENFINAL"]].drop_duplicates()
+    medio = np.where(rng.random(n_orders) < fibra_ratio, "FIBRA", "COBRE")
+    tipo = np.where(rng.random(n_orders) < alta_ratio, "ALTA", "POSVENTA")
+    subtipo = np.empty(n_orders, dtype=object)
+    for (m, t), group in keys.groupby(["MEDIO DE ACCESO", "TIPOORDENFINAL"]):
+        mask = (medio == m) & (tipo == t)
+        subtipo[mask] = rng.choice(group["SUBTIPOORDENFINAL"].to_numpy(), mask.sum())
+    # Combinaciones sin baremo (p. ej. COBRE/ALTA si no existiera) usan cualquier subtipo del medio
+    missing = pd.isna(subtipo)
+    if missing.any():
+        subtipo[missing] = rng.choice(keys["SUBTIPOORDENFINAL"].to_numpy(), missing.sum())
+
+    ciudades = np.array(list(CIUDADES))
+    ciudad = rng.choice(ciudades, n_orders)
+    n_tecnicos = max(10, n_orders // 40)
+    start = pd.Timestamp(f"{period}-01")
+    minutes = rng.integers(0, 28 * 24 * 60, n_orders)
+    pet_atis = rng.permutation(np.arange(10_000_000, 10_000_000 + n_orders))
+
+    cierres = pd.DataFrame({
+        "TIPO_DE_ORDEN": tipo,
+        "SUBTIPO_DE_ORDEN": subtipo,
+        "PET_ATIS": pet_atis,
+        "CIUDAD": ciudad,
+        "DEPARTAMENTO": pd.Series(ciudad).map(CIUDADES).to_numpy(),
+        "XA_ACTUACION": rng.integers(100_000, 999_999, n_orders),
+        "XA_ACCESS_TECHNOLOGY": medio,
+        "EXTERNAL_ID": rng.integers(1_000, 9_999, n_orders),
+        "FECHA_DE_CIERRE_FINAL": start + pd.to_timedelta(minutes, unit="m"),
+        "NOMBRE_TECNICO": np.char.add("TECNICO ", rng.integers(1, n_tecnicos + 1, n_orders).astype(str)),
+        "A_SMART_TV_CABLEADO": rng.choice(np.array(["Si", "No", None], dtype=object), n_orders, p=[0.2, 0.6, 0.2]),
+    })
+
+    # Movimientos de material: ~90% de las órdenes consumen algo
+    materials = homologado.drop_duplicates(["DESCRIPCION", "DESC_TIPO_EQUIPO"]).reset_index(drop=True)
+    with_consumo = np.flatnonzero(rng.random(n_orders) < 0.9)
+    per_order = rng.poisson(materials_per_order - 1, len(with_consumo)) + 1
+    order_idx = np.repeat(with_consumo, per_order)
+    n_mov = len(order_idx)
+    mat_idx = rng.integers(0, len(materials), n_mov)
+    cable = materials["HOMOLOGADO"].to_numpy()[mat_idx] == "CABLE_UTP_W"
+
+    consumo = pd.DataFrame({
+        "ACTUACION": cierres["XA_ACTUACION"].to_numpy()[order_idx],
+        "PET_ATIS": pet_atis[order_idx],
+        "CODIGO": rng.integers(1_000_000, 9_999_999, n_mov),
+        "DESCRIPCION": materials["DESCRIPCION"].to_numpy()[mat_idx],
+        "SERIAL": np.char.add("SN", rng.integers(0, 10**9, n_mov).astype(str)),
+        "FECHA_DE_CIERRE_FINAL": cierres["FECHA_DE_CIERRE_FINAL"].to_numpy()[order_idx],
+        "EXTERNAL_ID": cierres["EXTERNAL_ID"].to_numpy()[order_idx],
+        "CANTIDAD": np.where(cable, rng.integers(5, 60, n_mov), rng.integers(1, 3, n_mov)),
+        "FAMILIA": "MATERIAL",
+        "TIPO_DE_ORDEN": np.where(rng.random(n_mov) < 0.03, "AVERIA", tipo[order_idx]),
+        "DEPARTAMENTO": cierres["DEPARTAMENTO"].to_numpy()[order_idx],
+        "SUBTIPO_DE_ORDEN": subtipo[order_idx],
+        "TIPO": "EQUIPO",
+        "MODELO": "GENERICO",
+        "TIPO_INGRESO_SAP": "CONSUMO",
+        "DESC_TIPO_EQUIPO": materials["DESC_TIPO_EQUIPO"].to_numpy()[mat_idx],
+        "XA_ACCESS_TECHNOLOGY": medio[order_idx],
+        "TIPO_TRANSACCION": rng.choice(np.array(["install", "customer", "deinstall"]), n_mov, p=[0.85, 0.1, 0.05]),
+    })
+    return {"cierres": cierres, "consumo": consumo}
+
+
+def write_dataset(out_dir: str, n_orders: int, fmt: str = "auto", **kwargs) -> Dict[str, str]:
+    """Genera y escribe un juego de archivos; devuelve las rutas de cierres y consumo.
+
+    fmt: xlsx, csv, parquet o auto (xlsx si cabe en una hoja, si no parquet).
+    """
+    data = generate(n_orders, **kwargs)
+    if fmt == "auto":
+        fits = max(len(df) for df in data.values()) < EXCEL_MAX_ROWS
+        fmt = "xlsx" if fits else "parquet"
+
+    os.makedirs(out_dir, exist_ok=True)
+    paths = {}
+    for name, df in data.items():
+        if fmt == "xlsx":
+            path = os.path.join(out_dir, f"{name}_{n_orders}.xlsx")
+            df.to_excel(path, index=False)
+        elif fmt == "csv":
+            path = os.path.join(out_dir, f"{name}_{n_orders}.csv.gz")
+            df.to_csv(path, index=False)
+        elif fmt == "parquet":
+            path = os.path.join(out_dir, f"{name}_{n_orders}.parquet")
+            df.to_parquet(path, index=False)
+        else:
+            raise ValueError(f"❌ Formato no soportado: {fmt}")
+        paths[name] = path
+    return paths
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Genera archivos sintéticos de cierres y consumo.")
+    parser.add_argument("orders", type=int, nargs="+", help="Número de órdenes (p. ej. 10000 100000 1000000)")
+    parser.add_argument("--out", default="benchmarks/data")
+    parser.add_argument("--format", default="auto", choices=["auto", "xlsx", "csv", "parquet"])
+    parser.add_argument("--fibra", type=float, default=0.7, help="Proporción de órdenes FIBRA")
+    parser.add_argument("--alta", type=float, default=0.5, help="Proporción de órdenes ALTA")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    for n in args.orders:
+        paths = write_dataset(args.out, n, args.format, fibra_ratio=args.fibra, alta_ratio=args.alta, seed=args.seed)
+        print(f"✅ {n:,} órdenes: {paths['cierres']}, {paths['consumo']}")
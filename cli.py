@@ -0,0 +1,245 @@
+"""
+Línea de comandos para procesar liquidaciones sin interfaz gráfica
+Procesa varios pares cierres/consumo en paralelo (pensado para cron)
+
+Ejemplos:
+    python cli.py --pair Cierres_Norte.xlsx Consumo_Norte.xlsx --pair Cierres_Sur.xlsx Consumo_Sur.xlsx
+    python cli.py --pairs-file pares.csv --workers 4 --output-dir salida/
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List
+
+# Agregar directorio src al path
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'src'))
+from processor import CONSUMO_PIVOT_INDEX, LiquidacionProcessor
+from cache import ExcelCache
+from history import HistoryStore
+from incremental import IncrementalStore
+from outofcore import DEFAULT_MEMORY_BUDGET_MB, PARTITION_BY
+from profiling import StageProfiler
+from rules import RULE_BACKENDS
+
+STAGES = ["load_data", "process", "export"]
+
+
+def read_pairs(args) -> List[Dict[str, str]]:
+    """Arma la lista de trabajos a partir de --pair y --pairs-file."""
+    pairs = [{"cierres": c, "consumo": k} for c, k in args.pair or []]
+    if args.pairs_file:
+        with open(args.pairs_file, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                pairs.append({k.strip().lower(): (v or "").strip() for k, v in row.items()})
+
+    for pair in pairs:
+        if not pair.get("cierres") or not pair.get("consumo"):
+            raise ValueError(f"❌ Par incompleto: {pair}")
+        if not pair.get("nombre"):
+            pair["nombre"] = os.path.splitext(os.path.basename(pair["cierres"]))[0]
+
+    nombres = [p["nombre"] for p in pairs]
+    duplicados = {n for n in nombres if nombres.count(n) > 1}
+    if duplicados:
+        raise ValueError(f"❌ Nombres de salida repetidos: {sorted(duplicados)}")
+    return pairs
+
+
+def run_pair(pair: Dict[str, str], options: Dict) -> Dict:
+    """Procesa un par cierres/consumo y devuelve sus tiempos por etapa."""
+    result = {"nombre": pair["nombre"], "cierres": pair["cierres"], "consumo": pair["consumo"],
+              "tiempos": {}, "ok": False}
+    try:
+        cache = ExcelCache(options["cache_dir"]) if options["cache_dir"] else None
+        profiler = StageProfiler() if options["trace_dir"] else None
+        processor = LiquidacionProcessor(cache=cache, segment_workers=options["segment_workers"],
+                                         consumo_chunksize=options["consumo_chunksize"], profiler=profiler,
+                                         rule_backend=options["rule_backend"])
+
+        start = time.perf_counter()
+        if options["out_of_core"]:
+            spill_dir = os.path.join(options["spill_dir"], pair["nombre"]) if options["spill_dir"] else None
+            partitioned = processor.process_out_of_core(
+                pair["cierres"], pair["consumo"], baremo_path=options["baremo"],
+                homologado_path=options["homologado"], memory_budget_mb=options["memory_budget_mb"],
+                partition_by=options["partition_by"], spill_dir=spill_dir,
+                chunksize=options["consumo_chunksize"] or 100_000)
+        else:
+            data = processor.load_data(pair["cierres"], pair["consumo"],
+                                       baremo_path=options["baremo"], homologado_path=options["homologado"])
+        result["tiempos"]["load_data"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if options["out_of_core"]:
+            # Los resultados por unidad se juntan en el orden del camino en memoria para exportarlos
+            final_df = partitioned.load_final()
+            segment_dfs = processor.split_segments(final_df)
+            data = {"cierres": partitioned.load_cierres(), "consumo": partitioned.load_consumo(CONSUMO_PIVOT_INDEX),
+                    "sin_homologar": partitioned.unmapped}
+            partitioned.cleanup()
+        elif options["state_dir"]:
+            store = IncrementalStore(os.path.join(options["state_dir"], pair["nombre"]))
+            final_df, segment_dfs = processor.process_incremental(data, store, full=options["full"])
+        else:
+            final_df, segment_dfs = processor.process_all_segments(data)
+        result["tiempos"]["process"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        unmapped = data["sin_homologar"]
+        if not unmapped.empty:
+            result["sin_homologar"] = {"materiales": int(len(unmapped)), "filas": int(unmapped["FILAS"].sum()),
+                                       "detalle": unmapped.head(20).to_dict("records")}
+        if final_df.empty:
+            result["error"] = "No se generaron datos después del procesamiento"
+        else:
+            additional = {"Cierres": data["cierres"], "Consumo Pivot": data["consumo"]}
+            if options["output_format"] == "xlsx":
+                filename = os.path.join(options["output_dir"], f"Liquidacion_{pair['nombre']}.xlsx")
+                processor.export_to_excel(final_df, segment_dfs, additional, filename=filename)
+                result["salida"] = filename
+            else:
+                output_dir = os.path.join(options["output_dir"], f"Liquidacion_{pair['nombre']}")
+                result["salida"] = processor.export_columnar(final_df, segment_dfs, additional, output_dir,
+                                                             fmt=options["output_format"])
+            if options["history"]:
+                result["historico"] = HistoryStore(options["history"]).append(final_df, origen=pair["nombre"])
+            result["ok"] = True
+        result["tiempos"]["export"] = time.perf_counter() - start
+
+        if options["memory_report"]:
+            if "baremo" not in data:
+                data["baremo"] = processor.read_excel(options["baremo"])
+            result["memoria"] = processor.memory_report(data, final_df).to_dict("records")
+
+        if profiler is not None:
+            trace = os.path.join(options["trace_dir"], f"traza_{pair['nombre']}.json")
+            result["traza"] = profiler.write_trace(trace)
+            result["etapas"] = profiler.report().to_dict("records")
+
+        result["filas"] = int(len(final_df))
+        result["factura"] = float(final_df["FACTURA"].sum()) if not final_df.empty else 0.0
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+        result["detalle"] = traceback.format_exc()
+    return result
+
+
+def print_report(results: List[Dict]):
+    """Imprime una tabla con los tiempos de cada par."""
+    header = f"{'Par':<30} {'Estado':<8} " + " ".join(f"{s:>10}" for s in STAGES) + f" {'Filas':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        estado = "OK" if r["ok"] else "ERROR"
+        tiempos = " ".join(f"{r['tiempos'][s]:>9.2f}s" if s in r["tiempos"] else f"{'-':>10}" for s in STAGES)
+        print(f"{r['nombre'][:30]:<30} {estado:<8} {tiempos} {r.get('filas', 0):>10,}")
+        if not r["ok"]:
+            print(f"   ⚠ {r.get('error')}")
+        for m in r.get("memoria", []):
+            print(f"   {m['tabla']:<12} {m['filas']:>10,} filas {m['antes_mb']:>9.1f} MB -> {m['despues_mb']:>9.1f} MB"
+                  f" ({m['ahorro_pct']:.0f}% menos)")
+        if r.get("sin_homologar"):
+            print(f"   ⚠ {r['sin_homologar']['materiales']} materiales sin homologar "
+                  f"({r['sin_homologar']['filas']:,} movimientos)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Procesa liquidaciones de técnicos sin interfaz gráfica.")
+    parser.add_argument("--pair", nargs=2, action="append", metavar=("CIERRES", "CONSUMO"),
+                        help="Par de archivos cierres/consumo (se puede repetir)")
+    parser.add_argument("--pairs-file", help="CSV con columnas cierres,consumo[,nombre]")
+    parser.add_argument("--output-dir", default=".", help="Carpeta de salida de los Excel")
+    parser.add_argument("--output-format", choices=["xlsx", "parquet", "csv.gz", "arrow"], default="xlsx",
+                        help="Formato de salida; los columnares van en una carpeta por par con manifest.json")
+    parser.add_argument("--baremo", default="data/BaremoOrden.xlsx")
+    parser.add_argument("--homologado", default="data/Homologado.xlsx")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Número máximo de pares procesados a la vez")
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument("--segment-workers", type=int, default=1,
+                        help="Segmentos procesados en paralelo dentro de cada par")
+    parser.add_argument("--rule-backend", choices=RULE_BACKENDS, default="numpy",
+                        help="Motor de las reglas; numexpr (si está instalado) evalúa cada regla en varios hilos")
+    parser.add_argument("--consumo-chunksize", type=int, default=None,
+                        help="Leer el consumo por bloques de este número de filas")
+    parser.add_argument("--cache-dir", default=None, help="Activa la caché de Excel parseados")
+    parser.add_argument("--state-dir", default=None,
+                        help="Activa el modo incremental guardando el estado de cada par aquí")
+    parser.add_argument("--full", action="store_true", help="Ignora el estado incremental y reprocesa todo")
+    parser.add_argument("--report", default=None, help="Archivo JSON con el resumen de la corrida")
+    parser.add_argument("--history", default=None,
+                        help="Base SQLite del histórico donde se guarda cada liquidación (periodo = mes de cierre)")
+    parser.add_argument("--out-of-core", action="store_true",
+                        help="Procesa por particiones de órdenes guardando los intermedios en disco")
+    parser.add_argument("--memory-budget-mb", type=int, default=DEFAULT_MEMORY_BUDGET_MB,
+                        help="Memoria para procesar cada unidad de particiones en --out-of-core")
+    parser.add_argument("--partition-by", choices=PARTITION_BY, default="hash",
+                        help="Reparto de las órdenes en --out-of-core: hash de PET_ATIS o DEPARTAMENTO")
+    parser.add_argument("--spill-dir", default=None,
+                        help="Carpeta para los intermedios de --out-of-core (por defecto una temporal)")
+    parser.add_argument("--memory-report", action="store_true",
+                        help="Muestra la memoria de cada tabla con los conteos en 64 bits y reducidos")
+    parser.add_argument("--trace-dir", default=None,
+                        help="Instrumenta cada etapa y regla y guarda una traza Chrome Trace por par")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        pairs = read_pairs(args)
+    except (OSError, ValueError) as e:
+        print(e, file=sys.stderr)
+        return 2
+    if args.out_of_core and args.state_dir:
+        print("❌ --out-of-core no se puede combinar con --state-dir", file=sys.stderr)
+        return 2
+    if not pairs:
+        print("❌ No se indicaron pares de archivos (--pair o --pairs-file)", file=sys.stderr)
+        return 2
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    if args.trace_dir:
+        os.makedirs(args.trace_dir, exist_ok=True)
+    options = {
+        "output_dir": args.output_dir, "baremo": args.baremo, "homologado": args.homologado,
+        "segment_workers": args.segment_workers, "consumo_chunksize": args.consumo_chunksize,
+        "cache_dir": args.cache_dir, "state_dir": args.state_dir, "full": args.full,
+        "trace_dir": args.trace_dir, "output_format": args.output_format,
+        "history": args.history, "out_of_core": args.out_of_core, "memory_budget_mb": args.memory_budget_mb,
+        "partition_by": args.partition_by, "spill_dir": args.spill_dir,
+        "memory_report": args.memory_report, "rule_backend": args.rule_backend,
+    }
+
+    start = time.perf_counter()
+    workers = max(1, min(args.workers, len(pairs)))
+    if workers == 1:
+        results = [run_pair(pair, options) for pair in pairs]
+    else:
+        pool = ProcessPoolExecutor if args.executor == "process" else ThreadPoolExecutor
+        with pool(max_workers=workers) as executor:
+            futures = {executor.submit(run_pair, pair, options): i for i, pair in enumerate(pairs)}
+            results = [None] * len(pairs)
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+    total = time.perf_counter() - start
+
+    print_report(results)
+    ok = sum(r["ok"] for r in results)
+    print(f"\n✅ {ok}/{len(results)} pares procesados en {total:.2f}s")
+
+    if args.report:
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump({"total_segundos": total, "pares": results}, f, indent=2, ensure_ascii=False)
+
+    return 0 if ok == len(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
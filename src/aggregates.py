@@ -0,0 +1,173 @@
+"""
+Agregados de una liquidación para el dashboard
+Calcula una sola vez por resultado los resúmenes por técnico, ciudad, segmento, concepto y día
+"""
+
+import threading
+import weakref
+from collections import OrderedDict
+from functools import cached_property
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+# Resultados distintos con agregados en memoria a la vez
+MAX_CACHED_RESULTS = 8
+
+# Nombres de las estadísticas por grupo (los del resumen de performance)
+STATS_COLUMNS = {
+    ("BAREMOS", "sum"): "Total_Baremos", ("BAREMOS", "mean"): "Promedio_Baremos",
+    ("BAREMOS", "count"): "Num_Ordenes", ("FACTURA", "sum"): "Total_Factura",
+    ("CIUDAD", "nunique"): "Ciudades_Atendidas",
+}
+
+# Compartida por los hilos de todas las sesiones de Streamlit: se usa siempre con _lock
+_cache: "OrderedDict[int, LiquidacionAggregates]" = OrderedDict()
+_lock = threading.Lock()
+# Claves de DataFrames liberados mientras otro hilo tenía el lock (se borran en la siguiente consulta)
+_released: List[int] = []
+
+
+def get_aggregates(df: pd.DataFrame) -> "LiquidacionAggregates":
+    """Agregados del DataFrame, reutilizados mientras sea el mismo objeto.
+
+    En Streamlit final_df vive en session_state, así que cada rerun recibe el
+    mismo objeto y no se vuelve a agrupar nada. La caché solo guarda una
+    referencia débil al DataFrame: cuando la sesión lo suelta, su entrada se
+    borra y no retiene la liquidación.
+    """
+    key = id(df)
+    with _lock:
+        while _released:
+            _discard(_released.pop())
+        cached = _cache.get(key)
+        if cached is not None and cached.df is df:
+            _cache.move_to_end(key)
+            return cached
+        aggregates = _cache[key] = LiquidacionAggregates(df)
+        weakref.finalize(df, _release, key, weakref.ref(aggregates))
+        while len(_cache) > MAX_CACHED_RESULTS:
+            _cache.popitem(last=False)
+    return aggregates
+
+
+def _discard(key: int):
+    cached = _cache.get(key)
+    if cached is not None and cached.df is None:
+        del _cache[key]
+
+
+def _release(key: int, aggregates: "weakref.ref"):
+    """Al liberarse un DataFrame borra sus agregados (o los deja pendientes si el lock está tomado)."""
+    if aggregates() is None:
+        return
+    if _lock.acquire(blocking=False):
+        try:
+            _discard(key)
+        finally:
+            _lock.release()
+    else:
+        _released.append(key)
+
+
+class LiquidacionAggregates:
+    """Resúmenes perezosos de una liquidación; cada uno se calcula al primer uso."""
+
+    def __init__(self, df: pd.DataFrame):
+        self._df = weakref.ref(df)
+        self.has_factura = "FACTURA" in df.columns
+
+    @property
+    def df(self) -> Optional[pd.DataFrame]:
+        """La liquidación, o None si ya se liberó."""
+        return self._df()
+
+    @cached_property
+    def segmento(self) -> pd.Series:
+        """MEDIO_DE_ACCESO_TIPO_DE_ORDEN de cada fila (precalculado por el procesador)."""
+        df = self.df
+        if "SEGMENTO" in df.columns:
+            return df["SEGMENTO"]
+        return (df["MEDIO_DE_ACCESO"].astype(str) + "_" + df["TIPO_DE_ORDEN"].astype(str)).rename("SEGMENTO")
+
+    @cached_property
+    def dia(self) -> pd.Series:
+        """Fecha de cierre truncada al día (precalculada por el procesador)."""
+        df = self.df
+        if "DIA_CIERRE" in df.columns:
+            return df["DIA_CIERRE"]
+        return pd.to_datetime(df["FECHA_DE_CIERRE_FINAL"]).dt.normalize().rename("DIA_CIERRE")
+
+    @cached_property
+    def summary_metrics(self) -> Dict[str, float]:
+        df = self.df
+        return {
+            "total_ordenes": len(df),
+            "total_baremos": df["BAREMOS"].sum(),
+            "total_factura": df["FACTURA"].sum() if self.has_factura else 0.0,
+            "promedio_baremos": df["BAREMOS"].mean(),
+            "tecnicos_unicos": df["NOMBRE_TECNICO"].nunique() if "NOMBRE_TECNICO" in df.columns else 0
+        }
+
+    def _stats(self, by) -> pd.DataFrame:
+        """Total, promedio y número de filas de BAREMOS, total de FACTURA y ciudades por grupo.
+
+        Sin FACTURA, Total_Factura cuenta filas como hacía el dashboard.
+        """
+        df = self.df
+        agg = {"BAREMOS": ["sum", "mean", "count"]}
+        if self.has_factura:
+            agg["FACTURA"] = "sum"
+        if "CIUDAD" in df.columns:
+            agg["CIUDAD"] = "nunique"
+        stats = df.groupby(by, observed=True).agg(agg)
+        stats.columns = [STATS_COLUMNS[c] for c in stats.columns]
+        if not self.has_factura:
+            stats.insert(3, "Total_Factura", stats["Num_Ordenes"])
+        return stats.reset_index()
+
+    @cached_property
+    def technician_ranking(self) -> pd.DataFrame:
+        """Una fila por técnico, ordenada de mayor a menor Total_Baremos."""
+        return self._stats("NOMBRE_TECNICO").sort_values("Total_Baremos", ascending=False, kind="stable")
+
+    @cached_property
+    def by_city(self) -> pd.DataFrame:
+        """BAREMOS por ciudad, de mayor a menor."""
+        city = self.df.groupby("CIUDAD", observed=True)["BAREMOS"].sum().reset_index()
+        return city.sort_values("BAREMOS", ascending=False, kind="stable")
+
+    @cached_property
+    def by_segment(self) -> pd.DataFrame:
+        """Estadísticas por segmento (MEDIO_DE_ACCESO_TIPO_DE_ORDEN)."""
+        return self._stats(self.segmento)
+
+    @cached_property
+    def by_day(self) -> pd.DataFrame:
+        """BAREMOS y número de filas por fecha de cierre."""
+        daily = self.df.groupby(self.dia.rename("FECHA_DE_CIERRE_FINAL")).agg({
+            "BAREMOS": "sum",
+            "PET_ATIS": "count"
+        })
+        return daily.reset_index()
+
+    @cached_property
+    def by_concept(self) -> pd.DataFrame:
+        """CANTIDAD y BAREMOS por atributo."""
+        return self.df.groupby("ATRIBUTO", observed=True).agg({
+            "CANTIDAD": "sum",
+            "BAREMOS": "sum"
+        }).reset_index()
+
+    @cached_property
+    def city_segment(self) -> pd.DataFrame:
+        """Matriz ciudad × segmento con la suma de BAREMOS."""
+        df = self.df
+        return pd.DataFrame({"CIUDAD": df["CIUDAD"], "SEGMENTO": self.segmento, "BAREMOS": df["BAREMOS"]}).pivot_table(
+            index="CIUDAD",
+            columns="SEGMENTO",
+            values="BAREMOS",
+            aggfunc="sum",
+            fill_value=0,
+            observed=True
+        )
@@ -0,0 +1,61 @@
+"""
+Índice precalculado de la tabla de baremo
+Resuelve PUNTOS y VALOR CLASE por posición en lugar de hacer merges por texto
+"""
+
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+# Claves de la combinación tipo/subtipo/medio en el baremo y en las órdenes
+BAREMO_KEYS = ["TIPOORDENFINAL", "SUBTIPOORDENFINAL", "MEDIO DE ACCESO"]
+ORDEN_BAREMO_KEYS = ["TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "MEDIO_DE_ACCESO"]
+
+
+class BaremoIndex:
+    """Baremo indexado por códigos enteros de combinación y concepto.
+
+    `positions[combo, concepto]` es la fila del baremo para esa pareja, o -1 si
+    no existe. La tabla guardada lleva una fila vacía al final, de modo que
+    `rows(-1)` devuelve NaN igual que un merge con how="left".
+    """
+
+    def __init__(self, baremo: pd.DataFrame):
+        duplicated = baremo.duplicated(BAREMO_KEYS + ["CONCEPTO"])
+        if duplicated.any():
+            dup = baremo.loc[duplicated, BAREMO_KEYS + ["CONCEPTO"]].head(5).to_dict("records")
+            raise ValueError(f"❌ Baremo con conceptos repetidos para la misma combinación: {dup}")
+
+        combo_codes, self.combos = pd.MultiIndex.from_frame(baremo[BAREMO_KEYS]).factorize()
+        self.combos.names = ORDEN_BAREMO_KEYS
+        concept_codes, concepts = pd.factorize(baremo["CONCEPTO"], sort=True)
+        self.concepts = pd.Index(concepts, name="CONCEPTO")
+
+        self.positions = np.full((len(self.combos) + 1, len(self.concepts) + 1), -1, dtype=np.int64)
+        valid = (combo_codes >= 0) & (concept_codes >= 0)
+        self.positions[combo_codes[valid], concept_codes[valid]] = np.flatnonzero(valid)
+
+        self.table = baremo.reset_index(drop=True).reindex(range(len(baremo) + 1))
+        self.puntos = self.table["PUNTOS"].to_numpy(dtype=float)
+        self.valor_clase = self.table["VALOR CLASE"].to_numpy(dtype=float)
+
+    def combo_codes(self, orders: pd.DataFrame) -> np.ndarray:
+        """Código de combinación de cada orden (-1 si no está en el baremo)."""
+        return self.combos.get_indexer(pd.MultiIndex.from_frame(orders[ORDEN_BAREMO_KEYS]))
+
+    def concept_codes(self, concepts: Sequence[str]) -> np.ndarray:
+        """Código de cada concepto (-1 si no está en el baremo)."""
+        return self.concepts.get_indexer(pd.Index(concepts))
+
+    def lookup(self, combo_codes: np.ndarray, concept_codes: np.ndarray) -> np.ndarray:
+        """Fila del baremo de cada pareja (combinación, concepto); -1 si no existe."""
+        return self.positions[combo_codes, concept_codes]
+
+    def concept_flags(self, combo_codes: np.ndarray) -> np.ndarray:
+        """Matriz orden × concepto (uint8) con 1 donde el baremo tiene el concepto para la orden."""
+        return (self.positions[combo_codes, :-1] >= 0).astype(np.uint8)
+
+    def rows(self, positions: np.ndarray) -> pd.DataFrame:
+        """Filas del baremo en las posiciones dadas; -1 da una fila vacía."""
+        return self.table.iloc[positions].reset_index(drop=True)
@@ -0,0 +1,133 @@
+"""
+Caché en disco de archivos Excel ya leídos
+Guarda los DataFrames con columnas limpias en formato Feather, indexados por el hash del contenido
+"""
+
+import hashlib
+import importlib.util
+import os
+import uuid
+from io import BytesIO
+from typing import Callable, Optional
+
+import pandas as pd
+
+# Cambiar al modificar la limpieza de columnas para invalidar entradas viejas
+CACHE_VERSION = "1"
+
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+
+def file_digest(source) -> str:
+    """Hash SHA-256 del contenido de una ruta o de un archivo subido (file-like)."""
+    h = hashlib.sha256()
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    else:
+        h.update(_read_bytes(source))
+    return h.hexdigest()
+
+
+def _read_bytes(source) -> bytes:
+    """Lee el contenido de un file-like sin perder su posición."""
+    if hasattr(source, "getvalue"):
+        return source.getvalue()
+    pos = source.tell()
+    source.seek(0)
+    data = source.read()
+    source.seek(pos)
+    return data
+
+
+class ExcelCache:
+    """Caché LRU en disco, limitada por tamaño, de Excel parseados.
+
+    La clave es el hash del contenido del archivo, así que un archivo modificado
+    nunca reutiliza una entrada vieja. Sin pyarrow la caché queda desactivada y
+    se lee directamente el Excel.
+    """
+
+    def __init__(self, cache_dir: str = ".cache/excel", max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.enabled = HAS_PYARROW
+        if self.enabled:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.cache_dir, f"{digest}-v{CACHE_VERSION}.feather")
+
+    def read_excel(self, source, clean: Optional[Callable[[pd.DataFrame], pd.DataFrame]] = None) -> pd.DataFrame:
+        """Lee un Excel desde la caché o lo parsea, limpia y guarda."""
+        if not self.enabled:
+            df = pd.read_excel(source)
+            return clean(df) if clean else df
+
+        if isinstance(source, (str, os.PathLike)):
+            digest = file_digest(source)
+        else:
+            data = _read_bytes(source)
+            digest = hashlib.sha256(data).hexdigest()
+            source = BytesIO(data)
+
+        path = self._path(digest)
+        if os.path.exists(path):
+            try:
+                df = pd.read_feather(path)
+                os.utime(path)  # marca de uso para el LRU
+                return df
+            except Exception:
+                os.remove(path)
+
+        df = pd.read_excel(source)
+        if clean:
+            df = clean(df)
+        self._store(path, df)
+        return df
+
+    def _store(self, path: str, df: pd.DataFrame):
+        """Escribe la entrada de forma atómica y aplica el límite de tamaño."""
+        # Nombre único por llamada: los hilos de un mismo proceso comparten el pid
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            df.reset_index(drop=True).to_feather(tmp)
+            os.replace(tmp, path)
+        except Exception:
+            # Columnas con tipos mezclados no se pueden guardar en Arrow: no se cachea
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict()
+
+    def evict(self):
+        """Elimina las entradas usadas hace más tiempo hasta respetar max_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".feather"):
+                continue
+            full = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(full)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, full))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, full in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(full)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        """Vacía la caché."""
+        if not self.enabled:
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".feather"):
+                os.remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,168 @@
+"""
+Exportación de la liquidación en formatos columnares para otros sistemas
+Parquet particionado por segmento y mes, CSV comprimido o stream Arrow IPC, con un manifiesto de control
+"""
+
+import json
+import os
+import re
+import shutil
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+from urllib.parse import quote
+
+import pandas as pd
+
+from cache import HAS_PYARROW, file_digest
+
+FORMATS = ("parquet", "csv.gz", "arrow")
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# Columnas por las que se particiona el Parquet; el mes sale de la fecha de cierre
+SEGMENT_COLUMN = "SEGMENTO"
+MONTH_COLUMN = "MES"
+DATE_COLUMN = "FECHA_DE_CIERRE_FINAL"
+# Valor de partición para claves nulas (el que reconocen Hive, Spark y pyarrow)
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+ARROW_BATCH_ROWS = 64 * 1024
+# gzip sin fecha en la cabecera: el mismo DataFrame da el mismo checksum
+CSV_COMPRESSION = {"method": "gzip", "compresslevel": 6, "mtime": 0}
+
+
+def table_name(name: str) -> str:
+    """Nombre de archivo para una hoja: "Consumo Pivot" -> "consumo_pivot"."""
+    return re.sub(r"[^0-9a-z]+", "_", name.strip().lower()).strip("_")
+
+
+def partition_columns(df: pd.DataFrame) -> List[str]:
+    """Particiones del Parquet de un DataFrame: SEGMENTO si existe y el mes de cierre."""
+    columns = [SEGMENT_COLUMN] if SEGMENT_COLUMN in df.columns else []
+    return columns + ([MONTH_COLUMN] if DATE_COLUMN in df.columns else [])
+
+
+def partition_keys(df: pd.DataFrame) -> Dict[str, pd.Series]:
+    """Valores de partición de cada fila; el mes es "AAAA-MM" de la fecha de cierre."""
+    keys = {}
+    for col in partition_columns(df):
+        if col == MONTH_COLUMN:
+            keys[col] = pd.to_datetime(df[DATE_COLUMN], errors="coerce").dt.strftime("%Y-%m")
+        else:
+            keys[col] = df[col]
+    return keys
+
+
+def _partition_dir(names: List[str], values: Tuple) -> str:
+    parts = []
+    for name, value in zip(names, values):
+        value = NULL_PARTITION if pd.isna(value) else quote(str(value), safe="")
+        parts.append(f"{name}={value}")
+    return os.path.join(*parts)
+
+
+def _file_entry(root: str, path: str, rows: int) -> Dict:
+    return {"ruta": os.path.relpath(path, root).replace(os.sep, "/"), "filas": int(rows),
+            "bytes": os.path.getsize(path), "sha256": file_digest(path)}
+
+
+def _require_pyarrow(fmt: str):
+    if not HAS_PYARROW:
+        raise ImportError(f"❌ El formato {fmt} requiere pyarrow (pip install pyarrow)")
+
+
+def _write_parquet(df: pd.DataFrame, root: str, path: str) -> List[Dict]:
+    """Parquet con particiones estilo Hive (SEGMENTO=.../MES=...).
+
+    Las columnas de partición van en la ruta y no dentro de los archivos; dentro
+    de cada partición las filas conservan su orden.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    keys = partition_keys(df)
+    if not keys:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path + ".parquet")
+        return [_file_entry(root, path + ".parquet", len(df))]
+
+    # Particiones de una corrida anterior que ya no existan quedarían en el dataset
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    data = df.drop(columns=[c for c in keys if c in df.columns])
+    groups = pd.DataFrame(keys).groupby(list(keys), observed=True, sort=True, dropna=False).indices
+    entries = []
+    for values, positions in groups.items():
+        values = values if isinstance(values, tuple) else (values,)
+        file_path = os.path.join(path, _partition_dir(list(keys), values), "part-0.parquet")
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+        pq.write_table(pa.Table.from_pandas(data.iloc[positions], preserve_index=False), file_path)
+        entries.append(_file_entry(root, file_path, len(positions)))
+    return entries
+
+
+def _write_csv(df: pd.DataFrame, root: str, path: str) -> List[Dict]:
+    file_path = path + ".csv.gz"
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    df.to_csv(file_path, index=False, compression=CSV_COMPRESSION)
+    return [_file_entry(root, file_path, len(df))]
+
+
+def _write_arrow(df: pd.DataFrame, root: str, path: str) -> List[Dict]:
+    """Stream Arrow IPC (.arrows) escrito por lotes."""
+    import pyarrow as pa
+
+    file_path = path + ".arrows"
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    with pa.OSFile(file_path, "wb") as sink, pa.ipc.new_stream(sink, table.schema) as writer:
+        for batch in table.to_batches(max_chunksize=ARROW_BATCH_ROWS):
+            writer.write_batch(batch)
+    return [_file_entry(root, file_path, len(df))]
+
+
+WRITERS = {"parquet": _write_parquet, "csv.gz": _write_csv, "arrow": _write_arrow}
+
+
+def write_tables(output_dir: str, tables: Iterable[Tuple[str, pd.DataFrame]], fmt: str = "parquet") -> str:
+    """Escribe cada (nombre relativo, DataFrame) en `output_dir` y devuelve la ruta del manifiesto.
+
+    El manifiesto lista por tabla sus filas y columnas, y por archivo su ruta
+    relativa, filas, tamaño y SHA-256, para que quien lo consuma pueda
+    verificar que recibió la salida completa.
+    """
+    if fmt not in WRITERS:
+        raise ValueError(f"❌ Formato de salida desconocido: {fmt} (opciones: {', '.join(FORMATS)})")
+    if fmt != "csv.gz":
+        _require_pyarrow(fmt)
+
+    manifest = {"version": MANIFEST_VERSION, "formato": fmt, "creado": datetime.now().isoformat(timespec="seconds"),
+                "tablas": {}}
+    for name, df in tables:
+        files = WRITERS[fmt](df, output_dir, os.path.join(output_dir, *name.split("/")))
+        manifest["tablas"][name] = {
+            "filas": int(len(df)), "columnas": [str(c) for c in df.columns], "archivos": files,
+        }
+        if fmt == "parquet" and partition_columns(df):
+            manifest["tablas"][name]["particiones"] = partition_columns(df)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    return manifest_path
+
+
+def verify_manifest(manifest_path: str) -> List[str]:
+    """Archivos del manifiesto que faltan o cuyo checksum no coincide."""
+    root = os.path.dirname(manifest_path)
+    with open(manifest_path, encoding="utf-8") as f:
+        manifest = json.load(f)
+    problems = []
+    for name, table in manifest["tablas"].items():
+        for entry in table["archivos"]:
+            path = os.path.join(root, *entry["ruta"].split("/"))
+            if not os.path.exists(path):
+                problems.append(f"{name}: falta {entry['ruta']}")
+            elif file_digest(path) != entry["sha256"]:
+                problems.append(f"{name}: checksum distinto en {entry['ruta']}")
+    return problems
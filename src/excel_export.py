@@ -0,0 +1,153 @@
+"""
+Exportación rápida de DataFrames grandes a Excel
+Escribe fila a fila con xlsxwriter en modo constant_memory y parte las hojas que superan el límite de Excel
+"""
+
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import (
+    CategoricalDtype, is_bool_dtype, is_datetime64_any_dtype, is_numeric_dtype, is_string_dtype,
+)
+
+# Filas por hoja que admite Excel (incluye la fila de encabezados)
+MAX_EXCEL_ROWS = 1_048_576
+# Largo máximo del nombre de una hoja
+MAX_SHEET_NAME = 31
+# Filas que se convierten a objetos de Python de una vez al escribir
+WRITE_CHUNK_ROWS = 50_000
+# Filas repartidas a lo largo del DataFrame con las que se estima el ancho de las columnas
+WIDTH_SAMPLE_ROWS = 1_000
+MAX_COLUMN_WIDTH = 50
+DATETIME_FORMAT = "yyyy-mm-dd hh:mm:ss"
+
+# Encabezado por defecto, parecido al que pone pandas con to_excel
+DEFAULT_HEADER_FORMAT = {"bold": True, "border": 1, "align": "center", "valign": "top"}
+
+WORKBOOK_OPTIONS = {
+    "constant_memory": True,
+    # Los textos se escriben tal cual: sin convertir "=..." en fórmulas ni URLs en hipervínculos
+    "strings_to_formulas": False,
+    "strings_to_urls": False,
+    "nan_inf_to_errors": True,
+}
+
+
+def sheet_parts(name: str, n_rows: int, max_rows: int = MAX_EXCEL_ROWS) -> List[Tuple[str, int, int]]:
+    """(nombre de hoja, fila inicial, fila final) de cada hoja en que se parte un DataFrame.
+
+    Cada hoja lleva `max_rows - 1` filas de datos; desde la segunda el nombre
+    termina en " (2)", " (3)", ... recortado a los 31 caracteres de Excel.
+    """
+    per_sheet = max_rows - 1
+    parts = []
+    for i, start in enumerate(range(0, max(n_rows, 1), per_sheet)):
+        suffix = "" if i == 0 else f" ({i + 1})"
+        parts.append((name[:MAX_SHEET_NAME - len(suffix)] + suffix, start, min(start + per_sheet, n_rows)))
+    return parts
+
+
+def _width_sample(df: pd.DataFrame) -> pd.DataFrame:
+    """Filas espaciadas uniformemente (la primera incluida) para estimar anchos."""
+    if len(df) <= WIDTH_SAMPLE_ROWS:
+        return df
+    return df.iloc[np.linspace(0, len(df) - 1, WIDTH_SAMPLE_ROWS).astype(np.int64)]
+
+
+def estimate_widths(df: pd.DataFrame) -> List[int]:
+    """Ancho de cada columna según su tipo o una muestra de sus valores.
+
+    Las fechas tienen ancho fijo y las categóricas se miden por sus categorías,
+    así que solo las columnas de texto libre y números dependen de la muestra.
+    """
+    sample = _width_sample(df)
+    widths = []
+    for i, col in enumerate(df.columns):
+        dtype = df.iloc[:, i].dtype
+        if is_datetime64_any_dtype(dtype):
+            length = len(DATETIME_FORMAT)
+        elif isinstance(dtype, CategoricalDtype):
+            categories = dtype.categories
+            length = int(categories.astype(str).str.len().max()) if len(categories) else 0
+        else:
+            values = sample.iloc[:, i].dropna()
+            length = int(values.astype(str).str.len().max()) if len(values) else 0
+        widths.append(min(max(length, len(str(col))) + 2, MAX_COLUMN_WIDTH))
+    return widths
+
+
+def _column_writer(worksheet, series: pd.Series, date_format) -> Tuple[Callable, Callable]:
+    """Método de escritura de la hoja para la columna y conversión de un bloque a lista.
+
+    La lista tiene None en los nulos, que se dejan como celdas vacías.
+    """
+    dtype = series.dtype
+    kind = dtype.categories.dtype if isinstance(dtype, CategoricalDtype) else dtype
+
+    def to_list(block: pd.Series) -> list:
+        values = block.astype(object)
+        return values.where(block.notna(), None).tolist()
+
+    if is_datetime64_any_dtype(kind):
+        def to_datetimes(block: pd.Series) -> list:
+            if isinstance(block.dtype, CategoricalDtype):
+                block = block.astype(kind)
+            if getattr(block.dt, "tz", None) is not None:
+                block = block.dt.tz_localize(None)
+            return to_list(block)
+
+        def write_datetime(row, col, value):
+            return worksheet.write_datetime(row, col, value, date_format)
+        return write_datetime, to_datetimes
+    if is_bool_dtype(kind):
+        return worksheet.write_boolean, to_list
+    if is_numeric_dtype(kind):
+        return worksheet.write_number, to_list
+    if is_string_dtype(kind) and kind != object:
+        return worksheet.write_string, to_list
+    # Columnas object: pueden mezclar tipos, write elige por valor
+    return worksheet.write, to_list
+
+
+def _write_sheet(workbook, name: str, df: pd.DataFrame, header_format, date_format,
+                 widths: List[int]) -> None:
+    """Escribe df completo en una hoja nueva, una fila detrás de otra."""
+    worksheet = workbook.add_worksheet(name)
+    for i, (col, width) in enumerate(zip(df.columns, widths)):
+        worksheet.set_column(i, i, width)
+        worksheet.write_string(0, i, str(col), header_format)
+
+    writers = [_column_writer(worksheet, df.iloc[:, i], date_format) for i in range(df.shape[1])]
+    methods = [write for write, _ in writers]
+    for start in range(0, len(df), WRITE_CHUNK_ROWS):
+        block = df.iloc[start:start + WRITE_CHUNK_ROWS]
+        columns = [to_list(block.iloc[:, i]) for i, (_, to_list) in enumerate(writers)]
+        for row, values in enumerate(zip(*columns), start=start + 1):
+            for col, (write, value) in enumerate(zip(methods, values)):
+                if value is not None:
+                    write(row, col, value)
+
+
+def write_workbook(target, sheets: Iterable[Tuple[str, pd.DataFrame]],
+                   header_format: Optional[Dict] = None, max_rows: int = MAX_EXCEL_ROWS) -> None:
+    """Escribe cada (nombre, DataFrame) como hoja de un libro nuevo en `target`.
+
+    `target` es una ruta o un archivo binario (BytesIO). Las hojas se escriben
+    en modo constant_memory: solo la fila en curso queda en memoria, por lo que
+    las filas tienen que escribirse en orden. Los DataFrames que no caben en una
+    hoja se reparten en varias con el mismo nombre y un número al final.
+    """
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(target, WORKBOOK_OPTIONS)
+    try:
+        header = workbook.add_format(header_format or DEFAULT_HEADER_FORMAT)
+        date_format = workbook.add_format({"num_format": DATETIME_FORMAT})
+        for name, df in sheets:
+            widths = estimate_widths(df)
+            for sheet_name, start, stop in sheet_parts(name, len(df), max_rows):
+                _write_sheet(workbook, sheet_name, df.iloc[start:stop], header, date_format, widths)
+    finally:
+        workbook.close()
+
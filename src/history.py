@@ -0,0 +1,235 @@
+"""
+Histórico de liquidaciones en SQLite
+Guarda cada liquidación con su periodo y permite consultar tendencias de varios meses sin releer los Excel
+"""
+
+import os
+import sqlite3
+from contextlib import closing, contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence
+
+import pandas as pd
+
+HISTORY_VERSION = 1
+# Fuera de data/ (versionada): la base y sus archivos -wal/-shm quedan en .cache/, ignorada por git
+DEFAULT_HISTORY_PATH = ".cache/historico.sqlite"
+
+# Columnas de la liquidación que se guardan (las de los dashboards y la facturación)
+HISTORY_COLUMNS = {
+    "PET_ATIS": "TEXT", "FECHA_DE_CIERRE_FINAL": "TEXT", "NOMBRE_TECNICO": "TEXT", "CIUDAD": "TEXT",
+    "DEPARTAMENTO": "TEXT", "TIPO_DE_ORDEN": "TEXT", "SUBTIPO_DE_ORDEN": "TEXT", "MEDIO_DE_ACCESO": "TEXT",
+    "SEGMENTO": "TEXT", "ATRIBUTO": "TEXT", "CANTIDAD": "REAL", "BAREMOS": "REAL", "VALOR CLASE": "REAL",
+    "FACTURA": "REAL",
+}
+# Columnas indexadas para filtrar el detalle
+INDEXED_COLUMNS = ["NOMBRE_TECNICO", "CIUDAD", "PET_ATIS", "FECHA_DE_CIERRE_FINAL"]
+# Agrupaciones permitidas en las tendencias
+TREND_GROUPS = ["NOMBRE_TECNICO", "CIUDAD", "DEPARTAMENTO", "SEGMENTO", "ATRIBUTO"]
+
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+INSERT_CHUNK_ROWS = 50_000
+# Caché de páginas al agregar (KiB): los índices de texto son lo más caro de mantener
+APPEND_CACHE_KB = 64 * 1024
+
+
+def _quote(column: str) -> str:
+    return '"' + column.replace('"', '""') + '"'
+
+
+def infer_period(final_df: pd.DataFrame) -> str:
+    """Mes (AAAA-MM) con más órdenes cerradas en la liquidación."""
+    fechas = pd.to_datetime(final_df["FECHA_DE_CIERRE_FINAL"], errors="coerce").dropna()
+    if fechas.empty:
+        raise ValueError("❌ No se puede deducir el periodo: la liquidación no tiene fechas de cierre")
+    return fechas.dt.strftime("%Y-%m").mode().iloc[0]
+
+
+class HistoryStore:
+    """Base SQLite con una fila por liquidación y el detalle de todas ellas.
+
+    Cada liquidación se identifica por (periodo, origen): volver a guardar el
+    mismo mes del mismo origen reemplaza la versión anterior en vez de duplicar.
+    Las fechas se guardan como texto ISO, así que los filtros por rango usan
+    el índice. La base está en modo WAL: el dashboard puede leer mientras la
+    línea de comandos agrega un mes.
+    """
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            self._create_schema(conn)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        """Conexión nueva por operación (sqlite3 no comparte conexiones entre hilos)."""
+        with closing(sqlite3.connect(self.path, timeout=60)) as conn:
+            with conn:
+                yield conn
+
+    def _create_schema(self, conn: sqlite3.Connection):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS liquidaciones (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                periodo TEXT NOT NULL,
+                origen TEXT NOT NULL DEFAULT '',
+                creado TEXT NOT NULL,
+                filas INTEGER NOT NULL,
+                total_baremos REAL,
+                total_factura REAL,
+                version INTEGER NOT NULL,
+                UNIQUE (periodo, origen)
+            )""")
+        columns = ", ".join(f"{_quote(c)} {t}" for c, t in HISTORY_COLUMNS.items())
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS detalle (
+                liquidacion_id INTEGER NOT NULL REFERENCES liquidaciones(id) ON DELETE CASCADE,
+                {columns}
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_detalle_liquidacion ON detalle (liquidacion_id)")
+        for col in INDEXED_COLUMNS:
+            name = "idx_detalle_" + col.lower().replace(" ", "_")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name} ON detalle ({_quote(col)})")
+
+    def _rows(self, final_df: pd.DataFrame) -> pd.DataFrame:
+        """Columnas del histórico en tipos de SQLite (texto, números y None en los nulos)."""
+        frame = pd.DataFrame(index=final_df.index)
+        for col, sql_type in HISTORY_COLUMNS.items():
+            if col not in final_df.columns:
+                frame[col] = None
+                continue
+            values = final_df[col]
+            if col == "FECHA_DE_CIERRE_FINAL":
+                values = pd.to_datetime(values, errors="coerce").dt.strftime(DATE_FORMAT)
+            elif sql_type == "TEXT":
+                values = values.astype(str)
+            else:
+                values = pd.to_numeric(values, errors="coerce")
+            frame[col] = values.astype(object).where(values.notna(), None)
+        return frame
+
+    def append(self, final_df: pd.DataFrame, periodo: Optional[str] = None, origen: str = "") -> int:
+        """Guarda una liquidación y devuelve su id.
+
+        Sin `periodo` se usa el mes con más cierres. Si ya existía una
+        liquidación del mismo periodo y origen, se reemplaza.
+        """
+        if final_df.empty:
+            raise ValueError("❌ No se puede guardar una liquidación vacía en el histórico")
+        periodo = periodo or infer_period(final_df)
+        rows = self._rows(final_df)
+        total_factura = float(final_df["FACTURA"].sum()) if "FACTURA" in final_df.columns else None
+
+        placeholders = ", ".join("?" for _ in range(len(HISTORY_COLUMNS) + 1))
+        insert = f"INSERT INTO detalle VALUES ({placeholders})"
+        with self._connect() as conn:
+            conn.execute(f"PRAGMA cache_size=-{APPEND_CACHE_KB}")
+            self._delete(conn, periodo, origen)
+            cursor = conn.execute(
+                "INSERT INTO liquidaciones (periodo, origen, creado, filas, total_baremos, total_factura, version) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (periodo, origen, datetime.now().isoformat(timespec="seconds"), len(final_df),
+                 float(final_df["BAREMOS"].sum()), total_factura, HISTORY_VERSION))
+            liquidacion_id = cursor.lastrowid
+            for start in range(0, len(rows), INSERT_CHUNK_ROWS):
+                chunk = rows.iloc[start:start + INSERT_CHUNK_ROWS]
+                conn.executemany(insert, ((liquidacion_id, *values)
+                                          for values in chunk.itertuples(index=False, name=None)))
+        return liquidacion_id
+
+    def _delete(self, conn: sqlite3.Connection, periodo: str, origen: str):
+        row = conn.execute("SELECT id FROM liquidaciones WHERE periodo = ? AND origen = ?",
+                           (periodo, origen)).fetchone()
+        if row is not None:
+            conn.execute("DELETE FROM detalle WHERE liquidacion_id = ?", row)
+            conn.execute("DELETE FROM liquidaciones WHERE id = ?", row)
+
+    def delete(self, periodo: str, origen: str = ""):
+        """Borra una liquidación guardada."""
+        with self._connect() as conn:
+            self._delete(conn, periodo, origen)
+
+    def periods(self) -> pd.DataFrame:
+        """Liquidaciones guardadas, de la más reciente a la más antigua."""
+        with self._connect() as conn:
+            return pd.read_sql_query(
+                "SELECT id, periodo, origen, creado, filas, total_baremos, total_factura "
+                "FROM liquidaciones ORDER BY periodo DESC, origen", conn)
+
+    def distinct(self, column: str) -> List[str]:
+        """Valores distintos de una columna indexada (para los filtros del dashboard)."""
+        if column not in INDEXED_COLUMNS:
+            raise ValueError(f"❌ Solo se listan columnas indexadas: {INDEXED_COLUMNS}")
+        with self._connect() as conn:
+            rows = conn.execute(f"SELECT DISTINCT {_quote(column)} FROM detalle "
+                                f"WHERE {_quote(column)} IS NOT NULL ORDER BY 1").fetchall()
+        return [r[0] for r in rows]
+
+    @staticmethod
+    def _where(tecnico=None, ciudad=None, pet_atis=None, desde=None, hasta=None,
+               periodos: Optional[Sequence[str]] = None):
+        """Cláusula WHERE y parámetros de los filtros; las fechas son inclusivas por día."""
+        clauses, params = [], []
+        for col, value in (("NOMBRE_TECNICO", tecnico), ("CIUDAD", ciudad), ("PET_ATIS", pet_atis)):
+            if value is None:
+                continue
+            values = [value] if isinstance(value, str) else list(value)
+            clauses.append(f"d.{_quote(col)} IN ({', '.join('?' for _ in values)})")
+            params += [str(v) for v in values]
+        if desde is not None:
+            clauses.append('d."FECHA_DE_CIERRE_FINAL" >= ?')
+            params.append(pd.Timestamp(desde).normalize().strftime(DATE_FORMAT))
+        if hasta is not None:
+            clauses.append('d."FECHA_DE_CIERRE_FINAL" < ?')
+            params.append((pd.Timestamp(hasta).normalize() + pd.Timedelta(days=1)).strftime(DATE_FORMAT))
+        if periodos is not None:
+            clauses.append(f"l.periodo IN ({', '.join('?' for _ in periodos)})")
+            params += list(periodos)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, columns: Optional[Sequence[str]] = None, **filters) -> pd.DataFrame:
+        """Detalle guardado que cumple los filtros, con el periodo y origen de cada fila.
+
+        Filtros: tecnico, ciudad, pet_atis (valor o lista), desde/hasta (fechas
+        de cierre inclusivas) y periodos (lista de "AAAA-MM").
+        """
+        columns = list(columns or HISTORY_COLUMNS)
+        unknown = [c for c in columns if c not in HISTORY_COLUMNS]
+        if unknown:
+            raise KeyError(f"❌ Columnas que no están en el histórico: {unknown}")
+        where, params = self._where(**filters)
+        select = ", ".join(f"d.{_quote(c)}" for c in columns)
+        with self._connect() as conn:
+            df = pd.read_sql_query(
+                f"SELECT l.periodo AS PERIODO, l.origen AS ORIGEN, {select} "
+                f"FROM detalle d JOIN liquidaciones l ON l.id = d.liquidacion_id{where}", conn, params=params)
+        if "FECHA_DE_CIERRE_FINAL" in df.columns:
+            df["FECHA_DE_CIERRE_FINAL"] = pd.to_datetime(df["FECHA_DE_CIERRE_FINAL"])
+        return df
+
+    def monthly_trend(self, by: Optional[str] = None, **filters) -> pd.DataFrame:
+        """BAREMOS, FACTURA, filas y órdenes por mes de cierre (y por `by` si se indica).
+
+        La agregación la hace SQLite, así que solo viaja una fila por mes y grupo.
+        """
+        if by is not None and by not in TREND_GROUPS:
+            raise ValueError(f"❌ Agrupación no soportada: {by} (opciones: {TREND_GROUPS})")
+        where, params = self._where(**filters)
+        group = f", d.{_quote(by)}" if by else ""
+        select_by = f", d.{_quote(by)} AS {_quote(by)}" if by else ""
+        sql = (f'SELECT substr(d."FECHA_DE_CIERRE_FINAL", 1, 7) AS MES{select_by}, '
+               'SUM(d."BAREMOS") AS BAREMOS, SUM(d."FACTURA") AS FACTURA, COUNT(*) AS FILAS, '
+               'COUNT(DISTINCT d."PET_ATIS") AS ORDENES '
+               f"FROM detalle d JOIN liquidaciones l ON l.id = d.liquidacion_id{where} "
+               f"GROUP BY MES{group} ORDER BY MES{group}")
+        with self._connect() as conn:
+            return pd.read_sql_query(sql, conn, params=params)
+
+    def summary(self) -> Dict[str, int]:
+        with self._connect() as conn:
+            liquidaciones, filas = conn.execute("SELECT COUNT(*), COALESCE(SUM(filas), 0) FROM liquidaciones").fetchone()
+        return {"liquidaciones": liquidaciones, "filas": filas}
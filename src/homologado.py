@@ -0,0 +1,99 @@
+"""
+Tabla de homologación compilada
+Asigna el código HOMOLOGADO a cada movimiento de consumo por posición, sin hacer merges por texto
+"""
+
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+# Claves del material en el consumo y en Homologado.xlsx
+HOMOLOGADO_KEYS = ["DESCRIPCION", "DESC_TIPO_EQUIPO"]
+# Códigos que marcan un material como excluido de la liquidación (igual que dejarlo vacío)
+EXCLUDED_CODES = ["NA"]
+# Resultado de lookup para materiales que no están en la tabla o que están excluidos
+UNMAPPED, EXCLUDED = -1, -2
+UNMAPPED_COLUMNS = HOMOLOGADO_KEYS + ["FILAS", "CANTIDAD"]
+
+
+def _key_codes(values: pd.Series, index: pd.Index) -> np.ndarray:
+    """Posición de cada valor en `index` (-1 si no está); los nulos coinciden con nulos.
+
+    Se factoriza primero para buscar cada valor distinto una sola vez.
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return index.get_indexer(uniques)[codes]
+
+
+class HomologadoMap:
+    """Homologado indexado por códigos enteros de descripción y tipo de equipo.
+
+    `table[descripcion, tipo]` es la posición del código en `codes`, EXCLUDED si
+    el material está vacío o en "NA", o UNMAPPED si no aparece. La tabla lleva
+    una fila y una columna de más al final para que las claves desconocidas
+    (-1) caigan en UNMAPPED.
+
+    Las filas repetidas de un mismo material se unifican: las vacías o "NA" no
+    cuentan si hay otra con código, y dos códigos distintos son un error.
+    """
+
+    def __init__(self, homologado: pd.DataFrame):
+        missing = [c for c in HOMOLOGADO_KEYS + ["HOMOLOGADO"] if c not in homologado.columns]
+        if missing:
+            raise KeyError(f"❌ Faltan columnas en homologado: {missing}")
+
+        codes = homologado["HOMOLOGADO"]
+        codes = codes.where(~codes.isin(EXCLUDED_CODES))
+        self.descripciones = pd.Index(homologado["DESCRIPCION"].unique())
+        self.tipos = pd.Index(homologado["DESC_TIPO_EQUIPO"].unique())
+        keys = pd.DataFrame({
+            "descripcion": _key_codes(homologado["DESCRIPCION"], self.descripciones),
+            "tipo": _key_codes(homologado["DESC_TIPO_EQUIPO"], self.tipos),
+            "codigo": codes,
+        })
+
+        # Un código por material: los distintos no vacíos tienen que ser uno solo
+        distinct = keys.dropna(subset=["codigo"]).drop_duplicates()
+        conflicts = distinct.duplicated(["descripcion", "tipo"], keep=False)
+        if conflicts.any():
+            rows = distinct[conflicts].head(10)
+            dup = [{"DESCRIPCION": self.descripciones[d], "DESC_TIPO_EQUIPO": self.tipos[t], "HOMOLOGADO": c}
+                   for d, t, c in rows.itertuples(index=False)]
+            raise ValueError(f"❌ Homologado con códigos distintos para el mismo material: {dup}")
+
+        code_values, self.codes = pd.factorize(distinct["codigo"], sort=True)
+        self.codes = pd.Index(self.codes, name="HOMOLOGADO")
+        self.table = np.full((len(self.descripciones) + 1, len(self.tipos) + 1), UNMAPPED, dtype=np.int64)
+        self.table[keys["descripcion"].to_numpy(), keys["tipo"].to_numpy()] = EXCLUDED
+        self.table[distinct["descripcion"].to_numpy(), distinct["tipo"].to_numpy()] = code_values
+
+    def lookup(self, consumo: pd.DataFrame) -> np.ndarray:
+        """Código de cada movimiento: posición en `codes`, EXCLUDED o UNMAPPED."""
+        return self.table[_key_codes(consumo["DESCRIPCION"], self.descripciones),
+                          _key_codes(consumo["DESC_TIPO_EQUIPO"], self.tipos)]
+
+    def homologado(self, positions: np.ndarray) -> pd.Categorical:
+        """Columna HOMOLOGADO para las posiciones dadas (nulo si no tienen código)."""
+        return pd.Categorical.from_codes(np.where(positions >= 0, positions, -1), categories=self.codes)
+
+    @staticmethod
+    def unmapped(consumo: pd.DataFrame, positions: np.ndarray) -> pd.DataFrame:
+        """Materiales del consumo que no están en la tabla, con sus movimientos y cantidad."""
+        missing = consumo.loc[positions == UNMAPPED, HOMOLOGADO_KEYS + ["CANTIDAD"]]
+        report = missing.groupby(HOMOLOGADO_KEYS, dropna=False, observed=True, sort=False).agg(
+            FILAS=("CANTIDAD", "size"), CANTIDAD=("CANTIDAD", "sum"))
+        return report.reset_index()
+
+
+def combine_unmapped(parts: List[pd.DataFrame]) -> pd.DataFrame:
+    """Une los reportes de materiales sin homologar de varios bloques, de más a menos movimientos."""
+    parts = [p for p in parts if not p.empty]
+    if not parts:
+        return pd.DataFrame(columns=UNMAPPED_COLUMNS)
+    report = pd.concat(parts, ignore_index=True)
+    if len(parts) > 1:
+        report = report.groupby(HOMOLOGADO_KEYS, dropna=False, observed=True, sort=False)[["FILAS", "CANTIDAD"]] \
+            .sum().reset_index()
+    return report.sort_values(["FILAS", "CANTIDAD"] + HOMOLOGADO_KEYS, ascending=[False, False, True, True],
+                              kind="stable").reset_index(drop=True)
@@ -0,0 +1,89 @@
+"""
+Estado persistente para liquidaciones incrementales
+Guarda los resultados por PET_ATIS de corridas anteriores del mismo período
+"""
+
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+STATE_VERSION = 1
+
+
+def order_fingerprints(cierres: pd.DataFrame) -> pd.Series:
+    """Huella de cada orden: hash de todas sus filas en cierres, indexado por PET_ATIS."""
+    row_hash = pd.util.hash_pandas_object(cierres, index=False).to_numpy()
+    # La suma módulo 2**64 no depende del orden de las filas de la orden
+    return pd.Series(row_hash, index=cierres["PET_ATIS"].to_numpy()).groupby(level=0).sum()
+
+
+def _rules_repr(segment_rules: Dict[str, List[Dict]]) -> bytes:
+    """Representación canónica de las reglas (independiente del orden de las claves)."""
+    return repr(sorted((seg, [sorted((k, repr(v)) for k, v in r.items()) for r in rules])
+                       for seg, rules in segment_rules.items())).encode()
+
+
+def rules_digest(segment_rules: Dict[str, List[Dict]]) -> str:
+    """Hash de las reglas de segmento; cambia con cualquier edición de una regla."""
+    return hashlib.sha256(_rules_repr(segment_rules)).hexdigest()
+
+
+def context_digest(segment_rules: Dict[str, List[Dict]], baremo: pd.DataFrame) -> str:
+    """Hash de lo que afecta a todas las órdenes: reglas y tabla de baremo."""
+    h = hashlib.sha256()
+    h.update(_rules_repr(segment_rules))
+    h.update(repr(list(baremo.columns)).encode())
+    h.update(pd.util.hash_pandas_object(baremo, index=False).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+class IncrementalStore:
+    """Directorio con la liquidación acumulada de un período y las huellas de sus órdenes."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def load(self, context: str) -> Optional[Tuple[pd.Series, pd.DataFrame]]:
+        """Devuelve (huellas, liquidación) guardadas, o None si no hay estado válido para el contexto."""
+        try:
+            with open(self._file("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if meta.get("version") != STATE_VERSION or meta.get("context") != context:
+            return None
+        try:
+            fingerprints = pd.read_pickle(self._file("fingerprints.pkl"))
+            final_df = pd.read_pickle(self._file("liquidacion.pkl"))
+        except FileNotFoundError:
+            return None
+        return fingerprints, final_df
+
+    def save(self, context: str, fingerprints: pd.Series, final_df: pd.DataFrame):
+        """Guarda el estado; meta.json se escribe al final para que un corte deje el estado inválido."""
+        os.makedirs(self.path, exist_ok=True)
+        meta = self._file("meta.json")
+        if os.path.exists(meta):
+            os.remove(meta)
+        fingerprints.to_pickle(self._file("fingerprints.pkl"))
+        final_df.to_pickle(self._file("liquidacion.pkl"))
+        with open(meta, "w", encoding="utf-8") as f:
+            json.dump({"version": STATE_VERSION, "context": context,
+                       "ordenes": int(len(fingerprints)), "filas": int(len(final_df))}, f)
+
+
+def changed_orders(current: pd.Series, previous: Optional[pd.Series]) -> np.ndarray:
+    """PET_ATIS nuevos o cuya huella cambió respecto a la corrida anterior."""
+    if previous is None:
+        return current.index.to_numpy()
+    known = current.index.isin(previous.index)
+    same = np.zeros(len(current), dtype=bool)
+    same[known] = previous.loc[current.index[known]].to_numpy() == current.to_numpy()[known]
+    return current.index[~same].to_numpy()
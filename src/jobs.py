@@ -0,0 +1,219 @@
+"""
+Trabajos de liquidación en segundo plano
+Ejecuta el procesamiento en un pool de hilos, publica el avance por etapa y permite cancelarlo
+"""
+
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from profiling import StageProfiler
+
+# Estados de un trabajo
+PENDING, RUNNING, DONE, CANCELLED, FAILED = "en_cola", "ejecutando", "completado", "cancelado", "error"
+FINISHED = (DONE, CANCELLED, FAILED)
+
+# Eventos guardados por trabajo (los más viejos se descartan)
+MAX_EVENTS = 500
+# Trabajos terminados que se conservan hasta que su sesión los recoge (collect); el límite
+# solo alcanza a los de sesiones que se cerraron sin recogerlos
+MAX_FINISHED_JOBS = 20
+
+# Avance acumulado al terminar cada etapa; los segmentos reparten el tramo SEGMENTS_PROGRESS
+LOAD_PROGRESS = {"_process_cierres": 0.30, "_process_consumo": 0.35, "process_consumo_stream": 0.35,
+                 "_merge_data": 0.40, "load_data": 0.40}
+READ_PROGRESS = 0.075  # por cada archivo leído (cierres, baremo, homologado, consumo)
+SEGMENTS_PROGRESS = (0.40, 0.95)
+
+
+class JobCancelled(Exception):
+    """El trabajo se canceló; se lanza en el siguiente límite de etapa."""
+
+
+class Job:
+    """Estado de un trabajo: avance, eventos, resultado y pedido de cancelación.
+
+    El hilo que procesa escribe con `emit`; la interfaz lee `progress`,
+    `message` y `events_since` en cada refresco.
+    """
+
+    def __init__(self, description: str = "", segments: Sequence[str] = ()):
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.segments = list(segments)
+        self.status = PENDING
+        self.progress = 0.0
+        self.message = "En cola"
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.traceback: Optional[str] = None
+        self.created = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.future = None
+        self._events = deque(maxlen=MAX_EVENTS)
+        self._event_count = 0
+        self._segments_done = 0
+        self._files_read = 0
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+
+    @property
+    def done(self) -> bool:
+        return self.status in FINISHED
+
+    @property
+    def elapsed(self) -> float:
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    def cancel(self):
+        """Pide cancelar; si el trabajo no empezó, no llega a ejecutarse."""
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self._finish(CANCELLED, "Cancelado antes de empezar")
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise JobCancelled(self.id)
+
+    def emit(self, stage: str, phase: str, rows: Optional[int] = None, seconds: Optional[float] = None):
+        """Registra un evento de etapa ("inicio" o "fin") y actualiza el avance."""
+        event = {"t": time.time(), "stage": stage, "phase": phase, "rows": rows, "seconds": seconds}
+        with self._lock:
+            self._events.append(event)
+            self._event_count += 1
+            if phase == "fin":
+                self._advance(stage, rows)
+
+    def _advance(self, stage: str, rows: Optional[int]):
+        name, _, label = stage.partition(":")
+        if name == "read_excel":
+            self._files_read += 1
+            self.progress = max(self.progress, min(self._files_read * READ_PROGRESS, 0.30))
+            if rows is not None:
+                self.message = f"📊 Archivo {self._files_read} leído: {rows:,} filas"
+        elif name == "consumo_bloque" and rows is not None:
+            self.message = f"📊 Bloque de consumo procesado: {rows:,} filas"
+        elif name in LOAD_PROGRESS:
+            self.progress = max(self.progress, LOAD_PROGRESS[name])
+            if name == "_merge_data":
+                self.message = "🔗 Datos cruzados, aplicando reglas de segmentación..."
+        elif name == "process_segment":
+            self._segments_done += 1
+            start, end = SEGMENTS_PROGRESS
+            total = max(len(self.segments), self._segments_done)
+            self.progress = max(self.progress, start + (end - start) * self._segments_done / total)
+            self.message = f"⚡ Segmento {label} listo ({self._segments_done}/{total})"
+        elif name == "process_all_segments":
+            self.progress = max(self.progress, SEGMENTS_PROGRESS[1])
+            self.message = "✅ Consolidando resultados..."
+
+    def events_since(self, index: int = 0) -> List[Dict]:
+        """Eventos a partir del número `index` (los descartados por MAX_EVENTS se pierden)."""
+        with self._lock:
+            skip = max(0, index - (self._event_count - len(self._events)))
+            return list(self._events)[skip:]
+
+    def _finish(self, status: str, message: str):
+        with self._lock:
+            if self.done:
+                return
+            self.status = status
+            self.message = message
+            self.finished = time.time()
+            if status == DONE:
+                self.progress = 1.0
+
+
+class ProgressProfiler(StageProfiler):
+    """Perfilador que publica cada etapa como evento de un trabajo.
+
+    Al entrar a cada etapa (incluidas las reglas) revisa si el trabajo se
+    canceló, así la cancelación corta el procesamiento en el siguiente paso.
+    """
+
+    def __init__(self, job: Job):
+        super().__init__(track_memory=False)
+        self.job = job
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None, **attrs):
+        self.job.check_cancelled()
+        self.job.emit(name, "inicio", rows=rows_in)
+        with super().stage(name, rows_in=rows_in, **attrs) as record:
+            yield record
+        self.job.emit(name, "fin", rows=record.get("rows_out"), seconds=record.get("seconds"))
+
+
+class JobManager:
+    """Pool de hilos compartido por todas las sesiones, con los trabajos por id.
+
+    `fn(job, *args)` se ejecuta en el pool; lo que devuelve queda en job.result.
+    """
+
+    def __init__(self, max_workers: int = 2):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="liquidacion")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable[..., Any], *args, description: str = "",
+               segments: Sequence[str] = ()) -> Job:
+        job = Job(description, segments)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        job.future = self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id: Optional[str]) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def collect(self, job_id: Optional[str]) -> Optional[Job]:
+        """Retira un trabajo terminado del gestor para que solo su sesión retenga el resultado."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.done:
+                return None
+            del self._jobs[job_id]
+        return job
+
+    def active(self) -> List[Job]:
+        with self._lock:
+            return [job for job in self._jobs.values() if not job.done]
+
+    def _run(self, job: Job, fn: Callable[..., Any], args):
+        if job.done:
+            return
+        job.status = RUNNING
+        job.started = time.time()
+        job.message = "📊 Cargando y validando datos..."
+        try:
+            job.check_cancelled()
+            job.result = fn(job, *args)
+            job._finish(DONE, "✅ Procesamiento completado")
+        except JobCancelled:
+            job._finish(CANCELLED, "⏹️ Procesamiento cancelado")
+        except Exception as e:
+            job.error = str(e)
+            job.traceback = traceback.format_exc()
+            job._finish(FAILED, f"❌ {type(e).__name__}: {e}")
+
+    def _prune(self):
+        """Descarta los trabajos terminados más viejos por encima de MAX_FINISHED_JOBS."""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def shutdown(self, cancel: bool = True):
+        if cancel:
+            for job in self.active():
+                job.cancel()
+        self._executor.shutdown(wait=False)
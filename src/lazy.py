@@ -0,0 +1,38 @@
+"""
+Importación diferida de módulos pesados
+Plotly y Streamlit solo se cargan la primera vez que se usan
+"""
+
+import importlib
+from types import ModuleType
+
+
+class LazyModule:
+    """Sustituto de un módulo que lo importa al acceder al primer atributo."""
+
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __repr__(self) -> str:
+        estado = "cargado" if self._module is not None else "sin cargar"
+        return f"<LazyModule {self._name} ({estado})>"
+
+
+def lazy_attr(module: str, attr: str):
+    """Función que importa `module` y llama a `module.attr` en su primer uso."""
+    lazy = LazyModule(module)
+
+    def _call(*args, **kwargs):
+        return getattr(lazy, attr)(*args, **kwargs)
+
+    _call.__name__ = attr
+    return _call
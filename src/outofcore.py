@@ -0,0 +1,226 @@
+"""
+Procesamiento fuera de memoria para liquidaciones que no caben en RAM
+Reparte las órdenes por hash de PET_ATIS o por DEPARTAMENTO y guarda en disco las entradas y resultados de cada partición
+"""
+
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_float_dtype
+
+from cache import HAS_PYARROW
+from schema import CategorySchema, concat_categorical
+
+PARTITION_BY = ("hash", "DEPARTAMENTO")
+# Particiones en que se reparte la entrada con partition_by="hash"
+HASH_BUCKETS = 64
+DEFAULT_MEMORY_BUDGET_MB = 4096
+# Pico de memoria del procesamiento de una unidad respecto del tamaño en memoria
+# de sus cierres y consumo filtrado: ~3x medido con benchmarks/synthetic.py, más margen
+PROCESSING_FACTOR = 4.0
+# Partición de las órdenes de consumo sin cierre en el modo DEPARTAMENTO
+UNMATCHED_BUCKET = -1
+# Partición de las filas sin PET_ATIS en el modo DEPARTAMENTO (cierres y consumo juntos, como con el hash)
+NULL_KEY_BUCKET = -2
+
+
+def order_key(pet_atis: pd.Series) -> pd.Series:
+    """PET_ATIS como texto sin espacios, igual que en _merge_data.
+
+    Un bloque con nulos lee los números como float (123.0); se pasan a entero
+    para que la orden caiga en la misma partición en cierres y en consumo.
+    """
+    if is_float_dtype(pet_atis.dtype):
+        integral = pet_atis.dropna()
+        if (integral == np.floor(integral)).all():
+            pet_atis = pet_atis.astype("Int64")
+    return pet_atis.astype(str).str.strip()
+
+
+def hash_buckets(keys: pd.Series, buckets: int) -> np.ndarray:
+    """Partición de cada orden por hash estable de su PET_ATIS."""
+    return (pd.util.hash_pandas_object(keys, index=False).to_numpy() % np.uint64(buckets)).astype(np.int64)
+
+
+class DepartmentRouter:
+    """Asigna cada orden a la partición del departamento de su primera fila en cierres.
+
+    Las filas repetidas de una orden siguen a la primera aunque cambien de
+    departamento, el consumo sin cierre va a UNMATCHED_BUCKET y las filas sin
+    PET_ATIS de las dos tablas van a NULL_KEY_BUCKET.
+    """
+
+    def __init__(self):
+        self.departments: Dict[str, int] = {}
+        self.orders = pd.Series(dtype=np.int64)
+
+    def route_cierres(self, chunk: pd.DataFrame, keys: pd.Series) -> np.ndarray:
+        departments = chunk["DEPARTAMENTO"].astype(str) if "DEPARTAMENTO" in chunk.columns else \
+            pd.Series("", index=chunk.index)
+        for dep in departments.unique():
+            self.departments.setdefault(dep, len(self.departments))
+        buckets = departments.map(self.departments).to_numpy(dtype=np.int64)
+        # Dentro del bloque, las filas de una orden siguen a la primera
+        buckets = pd.Series(buckets).groupby(keys.to_numpy(), sort=False, dropna=False).transform("first").to_numpy()
+
+        known = keys.map(self.orders)
+        buckets = np.where(known.notna(), known.fillna(0).to_numpy(dtype=np.int64), buckets)
+        null = keys.isna().to_numpy()
+        buckets = np.where(null, NULL_KEY_BUCKET, buckets)
+        new = pd.Series(buckets[~null], index=keys.to_numpy()[~null])
+        new = new[~new.index.duplicated() & ~new.index.isin(self.orders.index)]
+        self.orders = pd.concat([self.orders, new]) if len(self.orders) else new
+        return buckets
+
+    def route_consumo(self, keys: pd.Series) -> np.ndarray:
+        buckets = keys.map(self.orders).fillna(UNMATCHED_BUCKET).to_numpy(dtype=np.int64)
+        return np.where(keys.isna().to_numpy(), NULL_KEY_BUCKET, buckets)
+
+
+class SpillStore:
+    """Archivos Parquet por tabla y partición en una carpeta temporal.
+
+    Lleva la cuenta de los bytes en memoria de lo escrito en cada partición para
+    agrupar particiones en unidades que quepan en el presupuesto de memoria.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        if not HAS_PYARROW:
+            raise ImportError("❌ El modo fuera de memoria requiere pyarrow (pip install pyarrow)")
+        self.owned = directory is None
+        self.directory = directory or tempfile.mkdtemp(prefix="liquidacion_spill_")
+        os.makedirs(self.directory, exist_ok=True)
+        self.files: Dict[Tuple[str, int], List[str]] = defaultdict(list)
+        self.memory: Dict[int, int] = defaultdict(int)
+
+    def write(self, table: str, bucket: int, df: pd.DataFrame):
+        path = os.path.join(self.directory, table, f"b{bucket:+06d}-{len(self.files[table, bucket]):06d}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path, index=False)
+        self.files[table, bucket].append(path)
+        self.memory[bucket] += int(df.memory_usage(deep=True).sum())
+
+    def write_partitioned(self, table: str, df: pd.DataFrame, buckets: np.ndarray):
+        # dropna=False: una partición nula falla en int() en vez de perder sus filas sin avisar
+        for bucket, positions in pd.Series(buckets).groupby(buckets, sort=True, dropna=False).indices.items():
+            self.write(table, int(bucket), df.iloc[positions])
+
+    def read(self, table: str, buckets: Iterable[int]) -> List[pd.DataFrame]:
+        return [pd.read_parquet(path) for b in buckets for path in self.files.get((table, b), [])]
+
+    def discard(self, table: str, buckets: Iterable[int]):
+        for b in buckets:
+            for path in self.files.pop((table, b), []):
+                os.remove(path)
+
+    def buckets(self) -> List[int]:
+        return sorted(self.memory)
+
+    def cleanup(self):
+        if self.owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def plan_units(memory: Dict[int, int], budget_bytes: int,
+               factor: float = PROCESSING_FACTOR) -> List[List[int]]:
+    """Agrupa particiones consecutivas mientras su pico estimado quepa en el presupuesto.
+
+    Una partición que sola ya lo supera forma su propia unidad.
+    """
+    units, current, size = [], [], 0
+    for bucket in sorted(memory):
+        estimate = memory[bucket] * factor
+        if current and size + estimate > budget_bytes:
+            units.append(current)
+            current, size = [], 0
+        current.append(bucket)
+        size += estimate
+    if current:
+        units.append(current)
+    return units
+
+
+class PartitionedResult:
+    """Resultados por unidad guardados en disco, con lectura en el orden del camino en memoria.
+
+    Tablas: "final" (liquidación con FACTURA), "cierres" (cierres cruzados) y
+    "consumo" (pivot de consumo).
+    """
+
+    def __init__(self, directory: str, segment_rules: Dict[str, List[Dict]], filter_segment,
+                 schema: CategorySchema, owned: bool = False):
+        self.directory = directory
+        self.owned = owned
+        self.segment_rules = segment_rules
+        self.filter_segment = filter_segment
+        self.schema = schema
+        self.files: Dict[str, List[str]] = defaultdict(list)
+        self.rows: Dict[str, int] = defaultdict(int)
+        # Materiales del consumo que no están en el homologado (homologado.combine_unmapped)
+        self.unmapped = pd.DataFrame()
+
+    def write(self, table: str, unit: int, df: pd.DataFrame):
+        path = os.path.join(self.directory, "resultado", table, f"u{unit:05d}.parquet")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path, index=False)
+        self.files[table].append(path)
+        self.rows[table] += len(df)
+
+    def iter_parts(self, table: str):
+        """DataFrame de cada unidad, sin juntar todo en memoria."""
+        for path in self.files.get(table, []):
+            yield pd.read_parquet(path)
+
+    def cleanup(self):
+        """Borra la carpeta si era temporal (sin spill_dir)."""
+        if self.owned:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _concat(self, table: str) -> pd.DataFrame:
+        parts = list(self.iter_parts(table))
+        if not parts:
+            return pd.DataFrame()
+        # Cada unidad solo trae sus categorías; con el esquema de la corrida quedan las de todas
+        return self.schema.apply(concat_categorical(parts, ignore_index=True))
+
+    def load_cierres(self) -> pd.DataFrame:
+        cierres = self._concat("cierres")
+        if cierres.empty:
+            return cierres
+        cierres = cierres.sort_values(["TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "PET_ATIS"], kind="stable")
+        return cierres.reset_index(drop=True)
+
+    def load_consumo(self, pivot_index: Sequence[str]) -> pd.DataFrame:
+        consumo = self._concat("consumo")
+        if consumo.empty:
+            return consumo
+        return consumo.sort_values(list(pivot_index), kind="stable").reset_index(drop=True)
+
+    def load_final(self) -> pd.DataFrame:
+        """Liquidación completa en el orden de process_all_segments.
+
+        Ese orden es: segmento, regla del segmento, tipo, subtipo y PET_ATIS.
+        Las filas repetidas de una orden están siempre en la misma unidad, así
+        que el orden estable entre ellas se conserva.
+        """
+        final = self._concat("final")
+        if final.empty:
+            return final
+        segment_rank = np.full(len(final), len(self.segment_rules), dtype=np.int64)
+        rule_rank = np.zeros(len(final), dtype=np.int64)
+        atributo = final["ATRIBUTO"].astype(str)
+        for i, (seg_name, rules) in enumerate(self.segment_rules.items()):
+            mask = self.filter_segment(final, seg_name).index
+            segment_rank[mask] = i
+            ranks = {r["col"].replace("%", ""): j for j, r in enumerate(rules)}
+            rule_rank[mask] = atributo.loc[mask].map(ranks).to_numpy()
+        keys = pd.DataFrame({"_segmento": segment_rank, "_regla": rule_rank,
+                             "TIPO_DE_ORDEN": final["TIPO_DE_ORDEN"], "SUBTIPO_DE_ORDEN": final["SUBTIPO_DE_ORDEN"],
+                             "PET_ATIS": final["PET_ATIS"]})
+        order = keys.sort_values(list(keys.columns), kind="stable").index
+        return final.iloc[order].reset_index(drop=True)
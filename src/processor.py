@@ -5,62 +5,131 @@ Basado en el código original de liquidación de técnicos
 
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Tuple, Any
+from pandas.api.types import is_datetime64_any_dtype
+from typing import Dict, List, Tuple, Any, Optional
+import copy
 import os
 
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from baremo import BaremoIndex
+from cache import ExcelCache
+from columnar_export import table_name, write_tables
+from excel_export import write_workbook
+from homologado import HomologadoMap, combine_unmapped
+from incremental import IncrementalStore, changed_orders, context_digest, order_fingerprints
+from outofcore import (DEFAULT_MEMORY_BUDGET_MB, HASH_BUCKETS, PARTITION_BY, DepartmentRouter, PartitionedResult,
+                       SpillStore, hash_buckets, order_key, plan_units)
+from profiling import NULL_PROFILER, profiled
+from readers import iter_table_chunks
+from rules import RuleGraph, resolve_backend
+from schema import CategorySchema, concat_categorical, count_memory_report, downcast_counts
+
 # Diccionario de reglas por segmento
+# Cada regla vale `value` si se cumple `cond` y 0 en otro caso. Las columnas con
+# espacios, "/" o "%" van entre comillas invertidas; una columna ausente vale 0.
 SEGMENT_RULES = {
     "ALTAS_FIBRA": [
-        {"col": "%CASA/EDIFICIO", "formula": lambda r: 1 if r.get("CASA/EDIFICIO", 0) == 1 else 0},
-        {"col": "%SMARTTV_CONECT", "formula": lambda r: 1 if r.get("SMARTTV_CONECT", 0) == 1 and r.get("A_Smart_TV_cableado") == "Si" and r.get("CABLE_UTP_W", 0) > 0 else 0},
-        {"col": "%BASEPORTADD WIRELESS", "formula": lambda r: r.get("BASEPORT", 0) if r.get("BASEPORTADD WIRELESS", 0) == 1 and r.get("CABLE_UTP_W", 0)/max(r.get("DECO_IPTV", 1), 1) <= 20.9 else 0},
-        {"col": "%BASEPORTADD CONNECT", "formula": lambda r: r.get("BASEPORT", 0) if r.get("BASEPORTADD CONNECT", 0) == 1 and r.get("CABLE_UTP_W", 0)/max(r.get("DECO_IPTV", 1), 1) > 20.9 else 0},
-        {"col": "%CONNECT", "formula": lambda r: 1 if r.get("CONNECT", 0) == 1 and r.get("CABLE_UTP_W", 0) > 0 else 0},
-        {"col": "%WIRELESS", "formula": lambda r: 1 if r.get("WIRELESS", 0) == 1 and r.get("CABLE_UTP_W", 0) == 0 and r.get("MODEM", 0) == 0 and (r.get("DECO_IPTV", 0) >= 1 or r.get("DECO_HD", 0) >= 1) else 0},
-        {"col": "%DECOADD", "formula": lambda r: (r.get("DECO_HD", 0) - r.get("WIRELESS", 0)) if r.get("DECOADD", 0) == 1 and r.get("DECO_HD", 0) > 0 else 0},
-        {"col": "%DECOIPTVADD_INAL", "formula": lambda r: (r.get("DECO_IPTV", 0) - r.get("%WIRELESS", 0)) if r.get("DECOIPTVADD_INAL", 0) == 1 and r.get("CABLE_UTP_W", 0) == 0 and r.get("DECO_IPTV", 0) > 0 else 0},
-        {"col": "%DECOIPTVADD_CONECT", "formula": lambda r: (r.get("DECO_HD", 0)+r.get("DECO_IPTV", 0)-r.get("%CONNECT", 0)-r.get("%WIRELESS", 0)-r.get("%DECOIPTVADD_INAL", 0)-r.get("%DECOADD", 0)) if r.get("DECOIPTVADD_CONECT", 0) == 1 and r.get("CABLE_UTP_W", 0) > 0 else 0},
-        {"col": "%CONFIG_MODEM", "formula": lambda r: 1 if r.get("CONFIG_MODEM", 0) == 1 and r.get("MODEM", 0) == 0 else 0},
+        {"col": "%CASA/EDIFICIO", "cond": "`CASA/EDIFICIO` == 1", "value": 1},
+        {"col": "%SMARTTV_CONECT", "cond": "SMARTTV_CONECT == 1 and A_Smart_TV_cableado == 'Si' and CABLE_UTP_W > 0", "value": 1},
+        {"col": "%BASEPORTADD WIRELESS", "cond": "`BASEPORTADD WIRELESS` == 1 and CABLE_UTP_W / max(DECO_IPTV, 1) <= 20.9", "value": "BASEPORT"},
+        {"col": "%BASEPORTADD CONNECT", "cond": "`BASEPORTADD CONNECT` == 1 and CABLE_UTP_W / max(DECO_IPTV, 1) > 20.9", "value": "BASEPORT"},
+        {"col": "%CONNECT", "cond": "CONNECT == 1 and CABLE_UTP_W > 0", "value": 1},
+        {"col": "%WIRELESS", "cond": "WIRELESS == 1 and CABLE_UTP_W == 0 and MODEM == 0 and (DECO_IPTV >= 1 or DECO_HD >= 1)", "value": 1},
+        {"col": "%DECOADD", "cond": "DECOADD == 1 and DECO_HD > 0", "value": "DECO_HD - WIRELESS"},
+        {"col": "%DECOIPTVADD_INAL", "cond": "DECOIPTVADD_INAL == 1 and CABLE_UTP_W == 0 and DECO_IPTV > 0", "value": "DECO_IPTV - `%WIRELESS`"},
+        {"col": "%DECOIPTVADD_CONECT", "cond": "DECOIPTVADD_CONECT == 1 and CABLE_UTP_W > 0", "value": "DECO_HD + DECO_IPTV - `%CONNECT` - `%WIRELESS` - `%DECOIPTVADD_INAL` - `%DECOADD`"},
+        {"col": "%CONFIG_MODEM", "cond": "CONFIG_MODEM == 1 and MODEM == 0", "value": 1},
     ],
     "POSVENTAS_FIBRA": [
-        {"col": "%CASA/EDIFICIO", "formula": lambda r: 1 if r.get("CASA/EDIFICIO", 0) == 1 else 0},
-        {"col": "%BASEPORTADD WIRELESS", "formula": lambda r: r.get("BASEPORT", 0) if r.get("BASEPORTADD WIRELESS", 0) == 1 and r.get("CABLE_UTP_W", 0)/max(r.get("DECO_IPTV", 1), 1) <= 20.9 else 0},
-        {"col": "%BASEPORTADD CONNECT", "formula": lambda r: r.get("BASEPORT", 0) if r.get("BASEPORTADD CONNECT", 0) == 1 and r.get("CABLE_UTP_W", 0)/max(r.get("DECO_IPTV", 1), 1) > 20.9 else 0},
-        {"col": "%DECOIPTVADD_INAL", "formula": lambda r: r.get("DECO_IPTV", 0) if r.get("DECOIPTVADD_INAL", 0) == 1 and r.get("CABLE_UTP_W", 0) == 0 else 0},
-        {"col": "%DECOIPTVADD_CONECT", "formula": lambda r: (r.get("DECO_IPTV", 0)-r.get("%DECOIPTVADD_INAL", 0)) if r.get("DECOIPTVADD_CONECT", 0) == 1 and r.get("CABLE_UTP_W", 0) > 0 else 0},
-        {"col": "%FIRSTDECODTH_FO_VERTICAL", "formula": lambda r: 1 if r.get("FIRSTDECODTH_FO_VERTICAL", 0) == 1 and r.get("ANTENA", 0) == 0 and r.get("DECO_HD", 0) >= 1 and r.get("CASA/EDIFICIO", 0) == 0 else 0},
-        {"col": "%TRASLADO INTERNO", "formula": lambda r: 1 if r.get("TRASLADO INTERNO", 0) == 1 and r.get("MODEM", 0) == 0 else 0},
-        {"col": "%REPOSICION MODEM BA", "formula": lambda r: 1 if r.get("REPOSICION MODEM BA", 0) == 1 and r.get("MODEM", 0) == 1 else 0},
-        {"col": "%REPONER CTROL REMOTO", "formula": lambda r: 1 if r.get("REPONER CTROL REMOTO", 0) == 1 and sum([r.get(k, 0) for k in ["ALAMBRE_EXT","ANTENA","ALAMBRE_INT","DECO_HD","DECO_IPTV","MODEM","BASEPORT","CABLE_UTP_W"]]) == 0 else 0},
-        {"col": "%REUBICAR DECO IPTV CONNECT", "formula": lambda r: 1 if r.get("REUBICAR DECO IPTV CONNECT", 0) == 1 and (r.get("BASEPORT", 0)+r.get("MODEM", 0)+r.get("DECO_IPTV", 0)) == 0 and r.get("CABLE_UTP_W", 0) > 0 else 0},
-        {"col": "%REPARACION INTERNA", "formula": lambda r: 1 if r.get("REPARACION INTERNA", 0) == 1 else 0},
-        {"col": "%REPONER DECO IPTV WIRELESS", "formula": lambda r: 1 if r.get("REPONER DECO IPTV WIRELESS", 0) == 1 and r.get("DECO_IPTV", 0) > 0 else 0},
+        {"col": "%CASA/EDIFICIO", "cond": "`CASA/EDIFICIO` == 1", "value": 1},
+        {"col": "%BASEPORTADD WIRELESS", "cond": "`BASEPORTADD WIRELESS` == 1 and CABLE_UTP_W / max(DECO_IPTV, 1) <= 20.9", "value": "BASEPORT"},
+        {"col": "%BASEPORTADD CONNECT", "cond": "`BASEPORTADD CONNECT` == 1 and CABLE_UTP_W / max(DECO_IPTV, 1) > 20.9", "value": "BASEPORT"},
+        {"col": "%DECOIPTVADD_INAL", "cond": "DECOIPTVADD_INAL == 1 and CABLE_UTP_W == 0", "value": "DECO_IPTV"},
+        {"col": "%DECOIPTVADD_CONECT", "cond": "DECOIPTVADD_CONECT == 1 and CABLE_UTP_W > 0", "value": "DECO_IPTV - `%DECOIPTVADD_INAL`"},
+        {"col": "%FIRSTDECODTH_FO_VERTICAL", "cond": "FIRSTDECODTH_FO_VERTICAL == 1 and ANTENA == 0 and DECO_HD >= 1 and `CASA/EDIFICIO` == 0", "value": 1},
+        {"col": "%TRASLADO INTERNO", "cond": "`TRASLADO INTERNO` == 1 and MODEM == 0", "value": 1},
+        {"col": "%REPOSICION MODEM BA", "cond": "`REPOSICION MODEM BA` == 1 and MODEM == 1", "value": 1},
+        {"col": "%REPONER CTROL REMOTO", "cond": "`REPONER CTROL REMOTO` == 1 and ALAMBRE_EXT + ANTENA + ALAMBRE_INT + DECO_HD + DECO_IPTV + MODEM + BASEPORT + CABLE_UTP_W == 0", "value": 1},
+        {"col": "%REUBICAR DECO IPTV CONNECT", "cond": "`REUBICAR DECO IPTV CONNECT` == 1 and BASEPORT + MODEM + DECO_IPTV == 0 and CABLE_UTP_W > 0", "value": 1},
+        {"col": "%REPARACION INTERNA", "cond": "`REPARACION INTERNA` == 1", "value": 1},
+        {"col": "%REPONER DECO IPTV WIRELESS", "cond": "`REPONER DECO IPTV WIRELESS` == 1 and DECO_IPTV > 0", "value": 1},
     ],
     "ALTAS_COBRE": [
-        {"col": "%ACOMETIDA", "formula": lambda r: 1 if r.get("ACOMETIDA", 0) == 1 and r.get("ALAMBRE_EXT", 0) >= 150 else 0},
-        {"col": "%CAJA", "formula": lambda r: 1 if r.get("CAJA", 0) == 1 and r.get("ALAMBRE_EXT", 0) > 0 else 0},
-        {"col": "%DECOADD", "formula": lambda r: r.get("DECO_HD", 0)-1 if r.get("DECOADD", 0) == 1 else 0},
-        {"col": "%NA", "formula": lambda r: (r.get("DECO_HD", 0)-r.get("%DECOADD", 0)) if r.get("NA", 0) == 1 else 0},
-        {"col": "%STRIP", "formula": lambda r: 1 if r.get("STRIP", 0) == 1 and r.get("ALAMBRE_EXT", 0) == 0 else 0},
+        {"col": "%ACOMETIDA", "cond": "ACOMETIDA == 1 and ALAMBRE_EXT >= 150", "value": 1},
+        {"col": "%CAJA", "cond": "CAJA == 1 and ALAMBRE_EXT > 0", "value": 1},
+        {"col": "%DECOADD", "cond": "DECOADD == 1", "value": "DECO_HD - 1"},
+        {"col": "%NA", "cond": "NA == 1", "value": "DECO_HD - `%DECOADD`"},
+        {"col": "%STRIP", "cond": "STRIP == 1 and ALAMBRE_EXT == 0", "value": 1},
     ],
     "POSVENTAS_COBRE": [
-        {"col": "%CAJA", "formula": lambda r: 1 if r.get("CAJA", 0) == 1 and r.get("ALAMBRE_EXT", 0) > 0 else 0},
-        {"col": "%DECOADD", "formula": lambda r: r.get("DECO_HD", 0)-1 if r.get("DECOADD", 0) == 1 else 0},
-        {"col": "%STRIP", "formula": lambda r: 1 if r.get("STRIP", 0) == 1 and r.get("ALAMBRE_EXT", 0) == 0 else 0},
-        {"col": "%IP_D", "formula": lambda r: 2 if r.get("IP_D", 0) == 1 else 0},
-        {"col": "%IP_T", "formula": lambda r: 2 if r.get("IP_T", 0) == 1 else 0},
-        {"col": "%STRIP VERTICAL", "formula": lambda r: 1 if r.get("STRIP VERTICAL", 0) == 1 and r.get("ANTENA", 0) == 0 else 0},
-        {"col": "%TRASLADO INTERNO BA", "formula": lambda r: 1 if r.get("TRASLADO INTERNO BA", 0) == 1 and r.get("MODEM", 0) == 0 else 0},
-        {"col": "%TRASLADO INTERNO TV", "formula": lambda r: 1 if r.get("TRASLADO INTERNO TV", 0) == 1 and r.get("DECO_HD", 0) > 0 else 0},
-        {"col": "%REPOSICION MODEM BA", "formula": lambda r: 1 if r.get("REPOSICION MODEM BA", 0) == 1 and r.get("MODEM", 0) == 1 else 0},
-        {"col": "%REPONER CTROL REMOTO", "formula": lambda r: 1 if r.get("REPONER CTROL REMOTO", 0) == 1 and sum([r.get(k, 0) for k in ["ALAMBRE_EXT","DECO_HD","MODEM","CABLE_UTP_W"]]) == 0 else 0},
+        {"col": "%CAJA", "cond": "CAJA == 1 and ALAMBRE_EXT > 0", "value": 1},
+        {"col": "%DECOADD", "cond": "DECOADD == 1", "value": "DECO_HD - 1"},
+        {"col": "%STRIP", "cond": "STRIP == 1 and ALAMBRE_EXT == 0", "value": 1},
+        {"col": "%IP_D", "cond": "IP_D == 1", "value": 2},
+        {"col": "%IP_T", "cond": "IP_T == 1", "value": 2},
+        {"col": "%STRIP VERTICAL", "cond": "`STRIP VERTICAL` == 1 and ANTENA == 0", "value": 1},
+        {"col": "%TRASLADO INTERNO BA", "cond": "`TRASLADO INTERNO BA` == 1 and MODEM == 0", "value": 1},
+        {"col": "%TRASLADO INTERNO TV", "cond": "`TRASLADO INTERNO TV` == 1 and DECO_HD > 0", "value": 1},
+        {"col": "%REPOSICION MODEM BA", "cond": "`REPOSICION MODEM BA` == 1 and MODEM == 1", "value": 1},
+        {"col": "%REPONER CTROL REMOTO", "cond": "`REPONER CTROL REMOTO` == 1 and ALAMBRE_EXT + DECO_HD + MODEM + CABLE_UTP_W == 0", "value": 1},
     ]
 }
 
+# Columnas de consumo que se conservan y claves del pivot por orden
+CONSUMO_KEEP_COLS = [
+    "ACTUACION", "PET_ATIS", "CODIGO", "DESCRIPCION", "SERIAL", "FECHA_DE_CIERRE_FINAL",
+    "EXTERNAL_ID", "CANTIDAD", "FAMILIA", "TIPO_DE_ORDEN", "DEPARTAMENTO", "SUBTIPO_DE_ORDEN",
+    "TIPO", "MODELO", "TIPO_INGRESO_SAP", "DESC_TIPO_EQUIPO", "XA_ACCESS_TECHNOLOGY"
+]
+CIERRES_KEEP_COLS = [
+    "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "PET_ATIS",
+    "CIUDAD", "DEPARTAMENTO", "XA_ACTUACION", "XA_ACCESS_TECHNOLOGY",
+    "EXTERNAL_ID", "FECHA_DE_CIERRE_FINAL", "NOMBRE_TECNICO", "A_SMART_TV_CABLEADO"
+]
+CONSUMO_PIVOT_INDEX = ["PET_ATIS", "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "XA_ACCESS_TECHNOLOGY"]
+# Columnas que agrega add_derived_columns a la liquidación consolidada
+DERIVED_COLUMNS = ["SEGMENTO", "DIA_CIERRE"]
+EQUIPO_COLS = ["ANTENA", "DECO_HD", "DECO_IPTV", "MODEM", "BASEPORT", "CABLE_UTP_W"]
+
 class LiquidacionProcessor:
-    def __init__(self):
+    def __init__(self, rule_workers: int = 1, cache: Optional[ExcelCache] = None,
+                 segment_workers: int = 1, segment_executor: str = "thread",
+                 consumo_chunksize: Optional[int] = None, profiler=None, rule_backend: str = "numpy"):
+        if segment_executor not in ("thread", "process"):
+            raise ValueError(f"❌ segment_executor debe ser 'thread' o 'process', no {segment_executor!r}")
+        # Backend de las reglas: "numexpr" (o "auto") fusiona cada regla en una expresión multihilo;
+        # sin numexpr instalado se usa NumPy
+        self.rule_backend = resolve_backend(rule_backend)
         self.segment_rules = SEGMENT_RULES
-        
+        self.rule_workers = rule_workers
+        self.segment_workers = segment_workers
+        self.segment_executor = segment_executor
+        self.consumo_chunksize = consumo_chunksize
+        self.cache = cache
+        # Instrumentación por etapas (StageProfiler); desactivada por defecto
+        self.profiler = profiler or NULL_PROFILER
+        # Validar reglas al cargar: duplicados, ciclos y orden
+        self._rule_graphs = {}
+        self._baremo_index = None
+        self._homologado_map = None
+        for seg_name, rules in self.segment_rules.items():
+            self._get_rule_graph(rules, seg_name)
+        # Columnas de texto como categóricas; ATRIBUTO parte de los conceptos de todas las reglas
+        self.schema = CategorySchema({"ATRIBUTO": [r["col"].replace("%", "") for rules in self.segment_rules.values()
+                                                   for r in rules]})
+        
+    def with_profiler(self, profiler) -> "LiquidacionProcessor":
+        """Copia que comparte reglas compiladas y caché pero registra en otro perfilador.
+        
+        El esquema de categorías se copia para que dos corridas simultáneas no
+        agreguen categorías sobre el mismo objeto.
+        """
+        clone = copy.copy(self)
+        clone.profiler = profiler or NULL_PROFILER
+        clone.schema = copy.deepcopy(self.schema)
+        return clone
+    
     def clean_columns(self, df: pd.DataFrame) -> pd.DataFrame:
         """Limpia nombres de columnas: quita espacios y convierte a mayúsculas."""
         df.columns = df.columns.str.strip().str.upper()
@@ -72,25 +141,32 @@ class LiquidacionProcessor:
         if missing:
             raise KeyError(f"❌ Faltan columnas en {df_name}: {missing}")
     
+    @profiled("load_data")
     def load_data(self, cierres_file, consumo_file, baremo_path: str = "data/BaremoOrden.xlsx", 
                   homologado_path: str = "data/Homologado.xlsx") -> Dict[str, pd.DataFrame]:
-        """Carga y procesa todos los archivos necesarios."""
+        """Carga y procesa todos los archivos necesarios.
         
-        # Leer archivos
-        cierres = pd.read_excel(cierres_file)
-        consumo = pd.read_excel(consumo_file)
-        baremo = pd.read_excel(baremo_path)
-        homologado = pd.read_excel(homologado_path)
+        `baremo_path` y `homologado_path` aceptan también las tablas ya leídas
+        (ver load_references).
+        """
         
-        # Limpiar nombres de columnas
-        for df in [cierres, consumo, baremo, homologado]:
-            self.clean_columns(df)
+        # Leer archivos (con nombres de columnas limpios)
+        cierres = self.read_excel(cierres_file)
+        baremo = baremo_path if isinstance(baremo_path, pd.DataFrame) else self.read_excel(baremo_path)
+        homologado = homologado_path if isinstance(homologado_path, pd.DataFrame) else \
+            self.read_excel(homologado_path)
         
         # Procesar cierres
         cierres = self._process_cierres(cierres)
         
-        # Procesar consumo
-        consumo_final = self._process_consumo(consumo, homologado)
+        # Procesar consumo (por bloques si está configurado)
+        unmapped = []
+        if self.consumo_chunksize:
+            consumo_final = self.process_consumo_stream(consumo_file, homologado, self.consumo_chunksize,
+                                                        unmapped=unmapped)
+        else:
+            consumo = self.read_excel(consumo_file)
+            consumo_final = self._process_consumo(consumo, homologado, unmapped=unmapped)
         
         # Merge datos
         cierres = self._merge_data(cierres, consumo_final, baremo)
@@ -99,19 +175,36 @@ class LiquidacionProcessor:
             "cierres": cierres,
             "consumo": consumo_final,
             "baremo": baremo,
-            "homologado": homologado
+            "homologado": homologado,
+            "sin_homologar": combine_unmapped(unmapped)
         }
     
+    def load_references(self, baremo_path: str = "data/BaremoOrden.xlsx",
+                        homologado_path: str = "data/Homologado.xlsx") -> Dict[str, pd.DataFrame]:
+        """Lee baremo y homologado y compila sus índices en este procesador.
+        
+        Pasando las tablas devueltas a load_data, las copias de with_profiler
+        reutilizan los índices ya compilados en vez de reconstruirlos.
+        """
+        baremo = self.read_excel(baremo_path)
+        homologado = self.read_excel(homologado_path)
+        self._get_baremo_index(baremo)
+        self._get_homologado_map(homologado)
+        return {"baremo": baremo, "homologado": homologado}
+    
+    @profiled("read_excel")
+    def read_excel(self, source) -> pd.DataFrame:
+        """Lee un Excel y limpia sus columnas, usando la caché si está configurada."""
+        if self.cache is not None:
+            return self.cache.read_excel(source, clean=self.clean_columns)
+        return self.clean_columns(pd.read_excel(source))
+    
+    @profiled("_process_cierres")
     def _process_cierres(self, cierres: pd.DataFrame) -> pd.DataFrame:
         """Procesa el DataFrame de cierres."""
         
         # Filtrar columnas
-        keep_cols = [
-            "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "PET_ATIS",
-            "CIUDAD", "DEPARTAMENTO", "XA_ACTUACION", "XA_ACCESS_TECHNOLOGY",
-            "EXTERNAL_ID", "FECHA_DE_CIERRE_FINAL", "NOMBRE_TECNICO", "A_SMART_TV_CABLEADO"
-        ]
-        cierres = cierres[[c for c in keep_cols if c in cierres.columns]]
+        cierres = cierres[[c for c in CIERRES_KEEP_COLS if c in cierres.columns]]
         
         # Renombrar columnas
         cierres.rename(columns={
@@ -125,13 +218,28 @@ class LiquidacionProcessor:
         else:
             cierres["A_SMART_TV_CABLEADO"] = cierres["A_SMART_TV_CABLEADO"].fillna("No")
         
+        # Fecha de cierre como fecha (los Excel con texto se parsean una sola vez aquí)
+        if "FECHA_DE_CIERRE_FINAL" in cierres.columns and not is_datetime64_any_dtype(cierres["FECHA_DE_CIERRE_FINAL"]):
+            cierres["FECHA_DE_CIERRE_FINAL"] = pd.to_datetime(cierres["FECHA_DE_CIERRE_FINAL"], errors="coerce")
+        
         # Validar columnas críticas
         self.validate_columns(cierres, ["MEDIO_DE_ACCESO", "PET_ATIS", "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN"], "cierres")
         
-        return cierres
+        return self.schema.apply(cierres)
     
-    def _process_consumo(self, consumo: pd.DataFrame, homologado: pd.DataFrame) -> pd.DataFrame:
+    @profiled("_process_consumo")
+    def _process_consumo(self, consumo: pd.DataFrame, homologado: pd.DataFrame,
+                         unmapped: Optional[List[pd.DataFrame]] = None) -> pd.DataFrame:
         """Procesa el DataFrame de consumo."""
+        return self._pivot_consumo(self._filter_consumo(consumo, homologado, unmapped))
+    
+    def _filter_consumo(self, consumo: pd.DataFrame, homologado: pd.DataFrame,
+                        unmapped: Optional[List[pd.DataFrame]] = None) -> pd.DataFrame:
+        """Filtra las transacciones válidas y les asigna su código homologado.
+        
+        Los materiales que no están en el homologado se descartan; con `unmapped`
+        se agrega a esa lista su reporte (ver combine_unmapped).
+        """
         
         # Filtrar consumo válido
         consumo = consumo[(consumo["TIPO_DE_ORDEN"] != "AVERIA") & (
@@ -141,154 +249,453 @@ class LiquidacionProcessor:
         )]
         
         # Filtrar columnas
-        keep_cols = [
-            "ACTUACION", "PET_ATIS", "CODIGO", "DESCRIPCION", "SERIAL", "FECHA_DE_CIERRE_FINAL",
-            "EXTERNAL_ID", "CANTIDAD", "FAMILIA", "TIPO_DE_ORDEN", "DEPARTAMENTO", "SUBTIPO_DE_ORDEN",
-            "TIPO", "MODELO", "TIPO_INGRESO_SAP", "DESC_TIPO_EQUIPO", "XA_ACCESS_TECHNOLOGY"
-        ]
-        consumo = consumo[[c for c in keep_cols if c in consumo.columns]]
-        
-        # Merge con homologado
-        consumo = consumo.merge(homologado, on=["DESCRIPCION", "DESC_TIPO_EQUIPO"], how="left")
-        consumo = consumo[consumo["HOMOLOGADO"].notna() & (consumo["HOMOLOGADO"] != "NA")]
+        consumo = consumo[[c for c in CONSUMO_KEEP_COLS if c in consumo.columns]]
+        
+        # Código homologado por posición (sin merge: un material repetido no duplica filas)
+        mapping = self._get_homologado_map(homologado)
+        positions = mapping.lookup(consumo)
+        if unmapped is not None:
+            unmapped.append(mapping.unmapped(consumo, positions))
+        keep = positions >= 0
+        consumo = consumo[keep].copy()
+        consumo["HOMOLOGADO"] = mapping.homologado(positions[keep])
+        return self.schema.apply(consumo)
+    
+    def _pivot_consumo(self, consumo: pd.DataFrame) -> pd.DataFrame:
+        """Suma CANTIDAD por orden y código homologado en formato ancho."""
         
         # Crear pivot
-        consumo["Combinada"] = consumo["HOMOLOGADO"] + "_"
         pivot = consumo.pivot_table(
-            index=["PET_ATIS", "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "XA_ACCESS_TECHNOLOGY"],
-            columns="Combinada",
+            index=CONSUMO_PIVOT_INDEX,
+            columns="HOMOLOGADO",
             values="CANTIDAD",
             aggfunc="sum",
-            fill_value=0
-        ).reset_index()
-        
-        # Agregar columnas faltantes
-        expected_cols = ["ANTENA_", "DECO_HD_", "DECO_IPTV_", "MODEM_", "BASEPORT_", "CABLE_UTP_W_"]
-        for col in expected_cols:
-            if col not in pivot.columns:
-                pivot[col] = 0
-        
-        # Renombrar columnas
-        rename_map = {col: col.rstrip("_") for col in expected_cols}
-        pivot.rename(columns=rename_map, inplace=True)
+            fill_value=0,
+            observed=True
+        )
         
-        # Selección final
-        final_cols = ["PET_ATIS", "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "XA_ACCESS_TECHNOLOGY"] + list(rename_map.values())
-        return pivot[final_cols]
+        # Solo los equipos que usan las reglas; los que no aparecen quedan en 0
+        pivot = pivot.reindex(columns=EQUIPO_COLS, fill_value=0)
+        return downcast_counts(pivot.rename_axis(columns=None).reset_index(), EQUIPO_COLS)
+    
+    @profiled("process_consumo_stream")
+    def process_consumo_stream(self, consumo_file, homologado: pd.DataFrame, chunksize: int = 100_000,
+                               unmapped: Optional[List[pd.DataFrame]] = None) -> pd.DataFrame:
+        """Procesa el consumo por bloques, sin cargar el archivo completo.
+        
+        Cada bloque se filtra y homologa, y se acumula la suma de CANTIDAD por
+        orden y código, así que la memoria depende del número de órdenes y no del
+        número de movimientos. El resultado es el mismo que el de _process_consumo.
+        """
+        group_cols = CONSUMO_PIVOT_INDEX + ["HOMOLOGADO"]
+        columns = CONSUMO_KEEP_COLS + ["TIPO_TRANSACCION"]
+        
+        compacted = []
+        partials = []
+        partial_rows = 0
+        for chunk in iter_table_chunks(consumo_file, chunksize, columns=columns):
+            with self.profiler.stage("consumo_bloque", rows_in=len(chunk)) as record:
+                chunk = self._filter_consumo(chunk, homologado, unmapped)
+                record["rows_out"] = len(chunk)
+            if chunk.empty:
+                continue
+            partials.append(chunk.groupby(group_cols, sort=False, observed=True)["CANTIDAD"].sum().reset_index())
+            partial_rows += len(partials[-1])
+            # Compactar cuando lo pendiente supera al acumulado (crecimiento geométrico): cada fila
+            # se reagrupa O(log bloques) veces y no una vez por bloque
+            if partial_rows > max(chunksize, len(compacted[0]) if compacted else 0):
+                compacted = [concat_categorical(compacted + partials, ignore_index=True)
+                             .groupby(group_cols, sort=False, observed=True)["CANTIDAD"].sum().reset_index()]
+                partials = []
+                partial_rows = 0
+        
+        partials = compacted + partials
+        if partials:
+            aggregated = concat_categorical(partials, ignore_index=True)
+        else:
+            aggregated = pd.DataFrame(columns=group_cols + ["CANTIDAD"])
+        return self._pivot_consumo(aggregated)
+    
+    @profiled("_merge_data")
+    def _merge_data(self, cierres: pd.DataFrame, consumo_final: pd.DataFrame, baremo: pd.DataFrame,
+                    concepts: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """Combina cierres, consumo y baremo en una fila por orden con el conteo de cada concepto.
+        
+        `concepts` es la máscara de conceptos del baremo que llevan columna; por
+        defecto los que tiene alguna de estas órdenes.
+        """
+        
+        # PET_ATIS como texto con la misma clave en los dos lados (un nulo no vuelve float los números)
+        cierres["PET_ATIS"] = order_key(cierres["PET_ATIS"])
+        consumo_final["PET_ATIS"] = order_key(consumo_final["PET_ATIS"])
+        
+        # Una fila por orden; el resto del proceso trabaja con posiciones enteras
+        orders = cierres if cierres["PET_ATIS"].is_unique else cierres.drop_duplicates()
+        orders = orders.reset_index(drop=True)
+        
+        # Equipos consumidos por orden (las órdenes sin consumo quedan en 0)
+        equipos = consumo_final.groupby("PET_ATIS", sort=False)[EQUIPO_COLS].sum()
+        equipos_pos = equipos.index.get_indexer(orders["PET_ATIS"])
+        equipos_values = np.vstack([equipos.to_numpy(dtype=float), np.zeros((1, len(EQUIPO_COLS)))])
+        
+        # Conceptos del baremo para la combinación tipo/subtipo/medio de cada orden
+        index = self._get_baremo_index(baremo)
+        flags = index.concept_flags(index.combo_codes(orders))
+        present = flags.any(axis=0) if concepts is None else concepts
+        
+        merged = pd.concat([
+            orders,
+            downcast_counts(pd.DataFrame(equipos_values[equipos_pos], columns=EQUIPO_COLS), EQUIPO_COLS),
+            pd.DataFrame(flags[:, present], columns=index.concepts[present]),
+        ], axis=1)
+        merged = merged.sort_values(["TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "PET_ATIS"], kind="stable")
+        return merged.reset_index(drop=True)
     
-    def _merge_data(self, cierres: pd.DataFrame, consumo_final: pd.DataFrame, baremo: pd.DataFrame) -> pd.DataFrame:
-        """Combina todos los DataFrames."""
-        
-        # Asegurar tipo string para PET_ATIS
-        cierres["PET_ATIS"] = cierres["PET_ATIS"].astype(str).str.strip()
-        consumo_final["PET_ATIS"] = consumo_final["PET_ATIS"].astype(str).str.strip()
-        
-        # Merge con consumo
-        cols_to_add = ["PET_ATIS"] + [c for c in consumo_final.columns if c not in [
-            "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "PET_ATIS", "CIUDAD", "DEPARTAMENTO",
-            "ACTUACION", "MEDIO_DE_ACCESO", "EXTERNAL_ID", "FECHA_DE_CIERRE_FINAL", 
-            "NOMBRE_TECNICO", "A_SMART_TV_CABLEADO"
-        ]]
-        cierres = cierres.merge(consumo_final[cols_to_add], on="PET_ATIS", how="left")
-        
-        # Merge con baremo
-        cierres = cierres.merge(baremo, left_on=["TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "MEDIO_DE_ACCESO"],
-                               right_on=["TIPOORDENFINAL", "SUBTIPOORDENFINAL", "MEDIO DE ACCESO"], how="left")
-        
-        # Pivot final
-        cierres = cierres.pivot_table(
-            index=["TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "PET_ATIS", "CIUDAD", "DEPARTAMENTO",
-                   "ACTUACION", "MEDIO_DE_ACCESO", "EXTERNAL_ID", "FECHA_DE_CIERRE_FINAL", 
-                   "NOMBRE_TECNICO", "A_SMART_TV_CABLEADO", "ANTENA", "DECO_HD", "DECO_IPTV", 
-                   "MODEM", "BASEPORT", "CABLE_UTP_W"],
-            columns="CONCEPTO",
-            aggfunc="size",
-            fill_value=0
-        ).reset_index()
-        
-        return cierres
+    def _get_homologado_map(self, homologado: pd.DataFrame) -> HomologadoMap:
+        """Compila (una sola vez por tabla) el homologado validado."""
+        cached = self._homologado_map
+        if cached is None or cached[0] is not homologado:
+            cached = self._homologado_map = (homologado, HomologadoMap(homologado))
+        return cached[1]
     
+    def _get_baremo_index(self, baremo: pd.DataFrame) -> BaremoIndex:
+        """Construye (una sola vez por tabla) el índice de baremo."""
+        cached = self._baremo_index
+        if cached is None or cached[0] is not baremo:
+            cached = self._baremo_index = (baremo, BaremoIndex(baremo))
+        return cached[1]
+    
+    @profiled("apply_segment_rules")
     def apply_segment_rules(self, df: pd.DataFrame, rules: List[Dict]) -> pd.DataFrame:
         """Aplica las reglas de segmento a un DataFrame."""
         df = df.copy()
-        for rule in rules:
-            col = rule["col"]
-            df[col] = df.apply(rule["formula"], axis=1)
-        return df
+        graph = self._get_rule_graph(rules)
+        if self.rule_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.rule_workers) as executor:
+                return graph.evaluate(df, executor=executor, profiler=self.profiler)
+        return graph.evaluate(df, profiler=self.profiler)
+
+    def _get_rule_graph(self, rules: List[Dict], segment_name: str = "") -> RuleGraph:
+        """Construye (una sola vez) el grafo de dependencias de las reglas de un segmento."""
+        key = id(rules)
+        cached = self._rule_graphs.get(key)
+        if cached is None or cached[0] is not rules:
+            cached = (rules, RuleGraph(rules, segment_name, self.rule_backend))
+            self._rule_graphs[key] = cached
+        return cached[1]
+
+    def update_segment_rule(self, seg_df: pd.DataFrame, segment_name: str, rule: Dict) -> pd.DataFrame:
+        """Reemplaza una regla del segmento y recalcula solo las columnas afectadas.
+
+        seg_df debe ser la salida de apply_segment_rules para ese segmento.
+        """
+        graph = self._get_rule_graph(self.segment_rules[segment_name], segment_name).with_rule(rule)
+        new_rules = [r.rule for r in graph.rules]
+        self.segment_rules = {**self.segment_rules, segment_name: new_rules}
+        self._rule_graphs[id(new_rules)] = (new_rules, graph)
+        return graph.evaluate(seg_df.copy(), only=graph.downstream(rule["col"]))
+    
+    def filter_segment(self, cierres: pd.DataFrame, segment_name: str) -> pd.DataFrame:
+        """Filtra las órdenes del segmento según medio de acceso y tipo de orden."""
+        medio = "FIBRA" if "FIBRA" in segment_name else "COBRE"
+        tipo = "ALTA" if "ALTAS" in segment_name else "POSVENTA"
+        return cierres[(cierres["MEDIO_DE_ACCESO"] == medio) & (cierres["TIPO_DE_ORDEN"] == tipo)]
     
+    @profiled("process_segment", label="segment_name")
     def process_segment(self, cierres: pd.DataFrame, segment_name: str, rules: List[Dict], 
                        baremo: pd.DataFrame) -> pd.DataFrame:
         """Procesa un segmento específico."""
         
-        # Determinar medio y tipo
-        medio = "FIBRA" if "FIBRA" in segment_name else "COBRE"
-        tipo = "ALTA" if "ALTAS" in segment_name else "POSVENTA"
-        
         # Filtrar
-        seg_df = cierres[(cierres["MEDIO_DE_ACCESO"] == medio) & (cierres["TIPO_DE_ORDEN"] == tipo)].copy()
+        seg_df = self.filter_segment(cierres, segment_name)
         if seg_df.empty:
             return seg_df
         
         # Aplicar reglas
         seg_df = self.apply_segment_rules(seg_df, rules)
         
-        # Unpivot columnas con %
+        # Solo las parejas (orden, atributo) con cantidad positiva, en el orden de un melt
         cols_unpivot = [c for c in seg_df.columns if c.startswith("%")]
-        melted = seg_df.melt(
-            id_vars=[c for c in seg_df.columns if c not in cols_unpivot],
-            value_vars=cols_unpivot,
-            var_name="ATRIBUTO", 
-            value_name="CANTIDAD"
-        )
-        melted["ATRIBUTO"] = melted["ATRIBUTO"].str.replace("%", "")
-        
-        # Join con baremo
-        merged = melted.merge(
-            baremo,
-            left_on=["MEDIO_DE_ACCESO", "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "ATRIBUTO"],
-            right_on=["MEDIO DE ACCESO", "TIPOORDENFINAL", "SUBTIPOORDENFINAL", "CONCEPTO"],
-            how="left"
-        )
-        merged["BAREMOS"] = merged["PUNTOS"].fillna(0) * merged["CANTIDAD"]
-        
-        return merged[merged["CANTIDAD"] > 0]
+        atributos = [c.replace("%", "") for c in cols_unpivot]
+        quantities = seg_df[cols_unpivot].to_numpy()
+        rule_pos, order_pos = np.nonzero(quantities.T > 0)
+        
+        # Atributos de la orden solo para las filas emitidas
+        melted = seg_df.drop(columns=cols_unpivot).iloc[order_pos]
+        melted.index = rule_pos * len(seg_df) + order_pos
+        self.schema.apply(pd.DataFrame({"ATRIBUTO": atributos}), ["ATRIBUTO"])
+        dtype = self.schema.dtype("ATRIBUTO")
+        melted["ATRIBUTO"] = pd.Categorical.from_codes(dtype.categories.get_indexer(atributos)[rule_pos], dtype=dtype)
+        melted["CANTIDAD"] = quantities[order_pos, rule_pos]
+        downcast_counts(melted, ["CANTIDAD"])
+        
+        # Fila de baremo por posición: combinación de la orden × concepto de la regla
+        index = self._get_baremo_index(baremo)
+        concept = index.concept_codes(atributos)
+        positions = index.lookup(index.combo_codes(seg_df)[order_pos], concept[rule_pos])
+        
+        # Columnas del baremo junto a cada fila (mismos sufijos que un merge)
+        rows = index.rows(positions).set_axis(melted.index)
+        overlap = melted.columns.intersection(rows.columns)
+        merged = pd.concat([melted.rename(columns={c: f"{c}_x" for c in overlap}),
+                            rows.rename(columns={c: f"{c}_y" for c in overlap})], axis=1)
+        merged["BAREMOS"] = np.nan_to_num(index.puntos[positions]) * merged["CANTIDAD"]
+        
+        return merged
     
-    def process_all_segments(self, data: Dict[str, pd.DataFrame]) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
-        """Procesa todos los segmentos y retorna el resultado final."""
+    @profiled("process_all_segments")
+    def process_all_segments(self, data: Dict[str, pd.DataFrame],
+                             workers: Optional[int] = None) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
+        """Procesa todos los segmentos y retorna el resultado final.
+        
+        Con workers > 1 los segmentos se procesan en paralelo; el resultado y su
+        orden son los mismos que en la ejecución secuencial.
+        """
         
         cierres = data["cierres"]
         baremo = data["baremo"]
+        workers = self.segment_workers if workers is None else workers
         
         segments = []
         segment_dfs = []
         
-        for seg_name, rules in self.segment_rules.items():
-            df_segment = self.process_segment(cierres, seg_name, rules, baremo)
+        if workers > 1:
+            results = self._process_segments_parallel(cierres, baremo, workers)
+        else:
+            results = [self.process_segment(cierres, seg_name, rules, baremo)
+                       for seg_name, rules in self.segment_rules.items()]
+        
+        for seg_name, df_segment in zip(self.segment_rules, results):
             if not df_segment.empty:
                 segments.append(df_segment)
                 segment_dfs.append((seg_name, df_segment))
         
         if segments:
-            final_df = pd.concat(segments, ignore_index=True)
-            final_df["FACTURA"] = final_df["BAREMOS"] * final_df["VALOR CLASE"]
-            return final_df, segment_dfs
+            return self.consolidate_segments(segments), segment_dfs
         else:
             return pd.DataFrame(), []
     
-    def export_to_excel(self, final_df: pd.DataFrame, segment_dfs: List[Tuple[str, pd.DataFrame]], 
-                       additional_dfs: Dict[str, pd.DataFrame], filename: str = "Liquidacion.xlsx") -> str:
-        """Exporta todos los DataFrames a Excel."""
+    def consolidate_segments(self, segments: List[pd.DataFrame]) -> pd.DataFrame:
+        """Une los resultados de los segmentos en la liquidación final con FACTURA y columnas derivadas."""
+        final_df = concat_categorical(segments, ignore_index=True)
+        final_df["FACTURA"] = final_df["BAREMOS"] * final_df["VALOR CLASE"]
+        return self.add_derived_columns(final_df)
+    
+    def add_derived_columns(self, final_df: pd.DataFrame) -> pd.DataFrame:
+        """Agrega las columnas que usa el dashboard para no recalcularlas en cada gráfico.
+        
+        SEGMENTO: MEDIO_DE_ACCESO_TIPO_DE_ORDEN como categórica (se arma sobre las
+        combinaciones distintas, no fila por fila). DIA_CIERRE: fecha de cierre
+        truncada al día.
+        """
+        if final_df.empty:
+            return final_df
+        
+        codes, combos = pd.MultiIndex.from_frame(final_df[["MEDIO_DE_ACCESO", "TIPO_DE_ORDEN"]]).factorize()
+        labels = pd.Index([f"{medio}_{tipo}" for medio, tipo in combos])
+        final_df["SEGMENTO"] = pd.Categorical.from_codes(codes, categories=labels)
+        self.schema.apply(final_df, ["SEGMENTO"])
+        final_df["DIA_CIERRE"] = final_df["FECHA_DE_CIERRE_FINAL"].dt.normalize()
+        return final_df
+    
+    def memory_report(self, data: Dict[str, pd.DataFrame], final_df: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """Memoria de cierres, consumo y liquidación con los conteos en 64 bits y reducidos.
+        
+        Cuenta como conteos los equipos, CANTIDAD y las columnas de concepto del baremo.
+        """
+        concepts = list(self._get_baremo_index(data["baremo"]).concepts)
+        # Los conceptos que también son columnas del baremo llevan el sufijo _x en la liquidación
+        columns = EQUIPO_COLS + ["CANTIDAD"] + concepts + [f"{c}_x" for c in concepts]
+        frames = {"cierres": data.get("cierres"), "consumo": data.get("consumo"), "liquidacion": final_df}
+        return count_memory_report(frames, columns)
+    
+    def split_segments(self, final_df: pd.DataFrame) -> List[Tuple[str, pd.DataFrame]]:
+        """Separa una liquidación consolidada en sus segmentos (sin FACTURA ni columnas derivadas)."""
+        segment_dfs = []
+        if final_df.empty:
+            return segment_dfs
+        for seg_name in self.segment_rules:
+            df_segment = self.filter_segment(final_df, seg_name).drop(columns=["FACTURA", *DERIVED_COLUMNS],
+                                                                      errors="ignore")
+            if not df_segment.empty:
+                segment_dfs.append((seg_name, df_segment))
+        return segment_dfs
+    
+    @profiled("process_incremental")
+    def process_incremental(self, data: Dict[str, pd.DataFrame], store: IncrementalStore,
+                            full: bool = False) -> Tuple[pd.DataFrame, List[pd.DataFrame]]:
+        """Procesa solo las órdenes nuevas o modificadas desde la corrida anterior.
+        
+        Las órdenes se comparan por PET_ATIS y una huella de sus filas en cierres;
+        las que desaparecieron del archivo se eliminan del acumulado. Si cambian las
+        reglas o el baremo, o con full=True, se reconstruye todo el período.
+        """
+        cierres = data["cierres"]
+        fingerprints = order_fingerprints(cierres)
+        context = context_digest(self.segment_rules, data["baremo"])
+        previous = None if full else store.load(context)
         
-        with pd.ExcelWriter(filename, engine="xlsxwriter") as writer:
-            # Hoja principal
-            final_df.to_excel(writer, sheet_name="Liquidacion Final", index=False)
-            
-            # Hojas adicionales
-            for name, df in additional_dfs.items():
-                df.to_excel(writer, sheet_name=name, index=False)
+        if previous is None:
+            final_df, _ = self.process_all_segments(data)
+        else:
+            prev_fingerprints, prev_final = previous
+            changed = changed_orders(fingerprints, prev_fingerprints)
+            new_final, _ = self.process_all_segments({**data, "cierres": cierres[cierres["PET_ATIS"].isin(changed)]})
             
-            # Segmentos
-            for seg_name, df in segment_dfs:
-                df.to_excel(writer, sheet_name=seg_name, index=False)
+            # Conservar resultados de órdenes sin cambios que siguen en cierres
+            unchanged = fingerprints.index[~fingerprints.index.isin(changed)]
+            kept = prev_final[prev_final["PET_ATIS"].isin(unchanged)] if not prev_final.empty else prev_final
+            parts = [df for df in (kept, new_final) if not df.empty]
+            final_df = concat_categorical(parts, ignore_index=True) if parts else pd.DataFrame()
+            # El estado de corridas anteriores puede no traer las columnas derivadas
+            final_df = self.add_derived_columns(final_df)
+        
+        store.save(context, fingerprints, final_df)
+        return final_df, self.split_segments(final_df)
+    
+    @profiled("process_out_of_core")
+    def process_out_of_core(self, cierres_file, consumo_file, baremo_path: str = "data/BaremoOrden.xlsx",
+                            homologado_path: str = "data/Homologado.xlsx",
+                            memory_budget_mb: int = DEFAULT_MEMORY_BUDGET_MB, partition_by: str = "hash",
+                            spill_dir: Optional[str] = None, chunksize: int = 100_000) -> PartitionedResult:
+        """Procesa la liquidación por particiones de órdenes, sin tener todo en memoria.
+        
+        Cierres y consumo se leen por bloques y se reparten en disco por hash de
+        PET_ATIS o por DEPARTAMENTO; luego las particiones se agrupan en unidades
+        que caben en `memory_budget_mb` y cada unidad pasa por el mismo proceso que
+        load_data + process_all_segments. Todas las filas de una orden quedan en la
+        misma unidad, así que el resultado es el del camino en memoria; se lee con
+        los load_* del PartitionedResult devuelto (en `spill_dir`, o en una carpeta
+        temporal que se borra con su cleanup()).
+        """
+        if partition_by not in PARTITION_BY:
+            raise ValueError(f"❌ partition_by debe ser uno de {PARTITION_BY}, no {partition_by!r}")
+        baremo = self.read_excel(baremo_path)
+        homologado = self.read_excel(homologado_path)
+        index = self._get_baremo_index(baremo)
+        spill = SpillStore(spill_dir)
+        router = DepartmentRouter() if partition_by == "DEPARTAMENTO" else None
+        
+        # Repartir cierres; las combinaciones tipo/subtipo/medio definen los conceptos con columna
+        combos = []
+        for chunk in iter_table_chunks(cierres_file, chunksize, columns=CIERRES_KEEP_COLS):
+            with self.profiler.stage("particion_cierres", rows_in=len(chunk)):
+                chunk["PET_ATIS"] = order_key(chunk["PET_ATIS"])
+                buckets = router.route_cierres(chunk, chunk["PET_ATIS"]) if router else \
+                    hash_buckets(chunk["PET_ATIS"], HASH_BUCKETS)
+                combos.append(chunk[["TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "XA_ACCESS_TECHNOLOGY"]].drop_duplicates())
+                spill.write_partitioned("cierres", chunk, buckets)
+        
+        # Repartir el consumo ya filtrado y homologado con la misma clave
+        columns = CONSUMO_KEEP_COLS + ["TIPO_TRANSACCION"]
+        unmapped = []
+        for chunk in iter_table_chunks(consumo_file, chunksize, columns=columns):
+            with self.profiler.stage("particion_consumo", rows_in=len(chunk)) as record:
+                chunk = self._filter_consumo(chunk, homologado, unmapped)
+                record["rows_out"] = len(chunk)
+                if chunk.empty:
+                    continue
+                chunk["PET_ATIS"] = order_key(chunk["PET_ATIS"])
+                buckets = router.route_consumo(chunk["PET_ATIS"]) if router else \
+                    hash_buckets(chunk["PET_ATIS"], HASH_BUCKETS)
+                spill.write_partitioned("consumo", chunk, buckets)
+        
+        # Mismas columnas de conceptos en todas las unidades que en una sola corrida
+        combos = pd.concat(combos, ignore_index=True).drop_duplicates() if combos else \
+            pd.DataFrame(columns=["TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "XA_ACCESS_TECHNOLOGY"])
+        combos = combos.rename(columns={"XA_ACCESS_TECHNOLOGY": "MEDIO_DE_ACCESO"})
+        concepts = index.concept_flags(index.combo_codes(combos)).any(axis=0)
+        
+        result = PartitionedResult(spill.directory, self.segment_rules, self.filter_segment, self.schema,
+                                   owned=spill.owned)
+        result.unmapped = combine_unmapped(unmapped)
+        units = plan_units(spill.memory, memory_budget_mb * 1024 ** 2)
+        for i, unit in enumerate(units):
+            with self.profiler.stage(f"unidad:{i + 1}/{len(units)}"):
+                self._process_unit(spill, unit, i, result, baremo, concepts)
+        return result
+    
+    def _process_unit(self, spill: SpillStore, unit: List[int], number: int, result: PartitionedResult,
+                      baremo: pd.DataFrame, concepts: np.ndarray):
+        """Procesa las particiones de una unidad y guarda sus resultados en disco."""
+        parts = spill.read("consumo", unit)
+        if parts:
+            consumo = self._pivot_consumo(concat_categorical(parts, ignore_index=True))
+        else:
+            consumo = pd.DataFrame(columns=CONSUMO_PIVOT_INDEX + EQUIPO_COLS)
+        
+        parts = spill.read("cierres", unit)
+        if parts:
+            cierres = self._process_cierres(pd.concat(parts, ignore_index=True))
+            merged = self._merge_data(cierres, consumo, baremo, concepts=concepts)
+            final_df, _ = self.process_all_segments({"cierres": merged, "baremo": baremo})
+            result.write("cierres", number, merged)
+            if not final_df.empty:
+                result.write("final", number, final_df)
+        if not consumo.empty:
+            result.write("consumo", number, consumo)
+        
+        spill.discard("cierres", unit)
+        spill.discard("consumo", unit)
+    
+    def _process_segments_parallel(self, cierres: pd.DataFrame, baremo: pd.DataFrame,
+                                   workers: int) -> List[pd.DataFrame]:
+        """Ejecuta process_segment para cada segmento en un pool, en el orden de segment_rules."""
+        items = list(self.segment_rules.items())
+        use_processes = self.segment_executor == "process" and not any(
+            self._get_rule_graph(rules).has_legacy for _, rules in items
+        )
+        
+        if not use_processes:
+            # Las reglas vectorizadas liberan el GIL en NumPy: basta con hilos y no se copia nada
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(self.process_segment, cierres, seg_name, rules, baremo)
+                           for seg_name, rules in items]
+                return [f.result() for f in futures]
+        
+        # A cada proceso solo se le envían las filas de su segmento y las filas de baremo necesarias
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for seg_name, rules in items:
+                seg_cierres = self.filter_segment(cierres, seg_name)
+                seg_baremo = baremo[baremo["MEDIO DE ACCESO"].isin(seg_cierres["MEDIO_DE_ACCESO"].unique())]
+                futures.append(executor.submit(_process_segment_job, seg_cierres, seg_name, rules, seg_baremo,
+                                               self.schema, self.rule_backend))
+            return [f.result() for f in futures]
+    
+    @profiled("export_to_excel")
+    def export_to_excel(self, final_df: pd.DataFrame, segment_dfs: List[Tuple[str, pd.DataFrame]], 
+                       additional_dfs: Dict[str, pd.DataFrame], filename: str = "Liquidacion.xlsx") -> str:
+        """Exporta todos los DataFrames a Excel.
+
+        Escribe en modo constant_memory, fila a fila; las hojas con más filas de
+        las que admite Excel se parten en "Nombre", "Nombre (2)", ...
+        """
+        sheets = [("Liquidacion Final", final_df), *additional_dfs.items(), *segment_dfs]
+        write_workbook(filename, sheets)
         
-        return filename
\ No newline at end of file
+        return filename
+
+    @profiled("export_columnar")
+    def export_columnar(self, final_df: pd.DataFrame, segment_dfs: List[Tuple[str, pd.DataFrame]],
+                        additional_dfs: Dict[str, pd.DataFrame], output_dir: str,
+                        fmt: str = "parquet") -> str:
+        """Exporta las mismas tablas que el Excel en un formato columnar.
+
+        fmt es "parquet" (particionado por SEGMENTO y mes de cierre), "csv.gz" o
+        "arrow" (stream IPC). Devuelve la ruta del manifest.json con filas y
+        checksums de cada archivo.
+        """
+        tables = [("liquidacion_final", final_df)]
+        tables += [(table_name(name), df) for name, df in additional_dfs.items()]
+        tables += [(f"segmentos/{table_name(seg_name)}", df) for seg_name, df in segment_dfs]
+        return write_tables(output_dir, tables, fmt)
+
+
+def _process_segment_job(cierres: pd.DataFrame, segment_name: str, rules: List[Dict],
+                         baremo: pd.DataFrame, schema: CategorySchema, rule_backend: str = "numpy") -> pd.DataFrame:
+    """Punto de entrada de los procesos del pool de segmentos."""
+    processor = LiquidacionProcessor(rule_backend=rule_backend)
+    processor.segment_rules = {segment_name: rules}
+    processor.schema = schema
+    return processor.process_segment(cierres, segment_name, rules, baremo)
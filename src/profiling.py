@@ -0,0 +1,154 @@
+"""
+Instrumentación por etapas del procesamiento de liquidaciones
+Registra tiempo, filas de entrada/salida y variación de memoria de cada etapa y regla
+"""
+
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, List, Optional
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss_bytes() -> int:
+    """Memoria residente actual del proceso (pico si /proc no está disponible)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class NullProfiler:
+    """Perfilador desactivado: no mide nada y no reserva memoria por etapa."""
+
+    enabled = False
+    _NULL = nullcontext({})
+
+    def stage(self, name: str, rows_in: Optional[int] = None, **attrs):
+        return self._NULL
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class StageProfiler:
+    """Perfilador por etapas, anidable y seguro entre hilos.
+
+    Uso:
+        with profiler.stage("_merge_data", rows_in=len(df)) as rec:
+            ...
+            rec["rows_out"] = len(result)
+    """
+
+    enabled = True
+
+    def __init__(self, track_memory: bool = True):
+        self.track_memory = track_memory
+        self.records: List[Dict] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None, **attrs):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        record = {"stage": name, "rows_in": rows_in, "rows_out": None, "depth": len(stack),
+                  "parent": stack[-1] if stack else None, "thread": threading.get_ident(), **attrs}
+        stack.append(name)
+        rss_before = current_rss_bytes() if self.track_memory else 0
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+            record["start"] = start - self._origin
+            record["seconds"] = end - start
+            if self.track_memory:
+                record["memory_delta_mb"] = (current_rss_bytes() - rss_before) / 1024 / 1024
+            with self._lock:
+                self.records.append(record)
+
+    def report(self) -> pd.DataFrame:
+        """Tabla con una fila por etapa, en orden de inicio."""
+        if not self.records:
+            return pd.DataFrame(columns=["stage", "parent", "depth", "seconds", "rows_in", "rows_out",
+                                         "memory_delta_mb"])
+        df = pd.DataFrame(self.records).sort_values("start", kind="stable").reset_index(drop=True)
+        cols = ["stage", "parent", "depth", "seconds", "rows_in", "rows_out", "memory_delta_mb"]
+        return df[[c for c in cols if c in df.columns] + [c for c in df.columns if c not in cols]]
+
+    def to_trace(self) -> Dict:
+        """Eventos en formato Chrome Trace (chrome://tracing, Perfetto, speedscope)."""
+        events = []
+        for rec in self.records:
+            args = {k: v for k, v in rec.items()
+                    if k not in ("stage", "start", "seconds", "thread", "depth", "parent") and v is not None}
+            events.append({
+                "name": rec["stage"], "ph": "X", "pid": os.getpid(), "tid": rec["thread"],
+                "ts": rec["start"] * 1e6, "dur": rec["seconds"] * 1e6, "args": args,
+            })
+        return {"traceEvents": sorted(events, key=lambda e: e["ts"]), "displayTimeUnit": "ms"}
+
+    def write_trace(self, path: str) -> str:
+        """Guarda la traza en JSON y devuelve la ruta."""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_trace(), f, default=str)
+        return path
+
+
+def count_rows(obj) -> Optional[int]:
+    """Filas de un resultado: DataFrame, tupla (df, ...) o dict de load_data."""
+    if isinstance(obj, pd.DataFrame):
+        return len(obj)
+    if isinstance(obj, tuple) and obj:
+        return count_rows(obj[0])
+    if isinstance(obj, dict) and "cierres" in obj:
+        return count_rows(obj["cierres"])
+    return None
+
+
+def profiled(stage: str, label: Optional[str] = None) -> Callable:
+    """Decorador de métodos que registra la llamada como etapa en self.profiler.
+
+    Con `label` el valor de ese argumento se agrega al nombre (p. ej. el segmento).
+    Si el perfilador está desactivado se llama al método directamente.
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            profiler = self.profiler
+            if not profiler.enabled:
+                return method(self, *args, **kwargs)
+
+            bound = signature.bind(self, *args, **kwargs)
+            name = stage if label is None else f"{stage}:{bound.arguments.get(label)}"
+            first = args[0] if args else None
+            with profiler.stage(name, rows_in=count_rows(first)) as record:
+                result = method(self, *args, **kwargs)
+                record["rows_out"] = count_rows(result)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,85 @@
+"""
+Lectura por bloques de archivos tabulares grandes
+Permite recorrer exportes de Excel, CSV o Parquet sin materializarlos completos
+"""
+
+import os
+from typing import Iterable, Iterator, List, Optional
+
+import pandas as pd
+
+
+def _source_name(source) -> str:
+    """Nombre del archivo (ruta o atributo .name de un archivo subido)."""
+    if isinstance(source, (str, os.PathLike)):
+        return str(source).lower()
+    return str(getattr(source, "name", "")).lower()
+
+
+def _clean_name(name) -> str:
+    return str(name).strip().upper()
+
+
+def iter_table_chunks(source, chunksize: int = 100_000,
+                      columns: Optional[Iterable[str]] = None) -> Iterator[pd.DataFrame]:
+    """Recorre un archivo en bloques de `chunksize` filas con columnas limpias.
+
+    El formato se deduce de la extensión: .csv/.csv.gz, .parquet o Excel (.xlsx).
+    Con `columns` solo se conservan esas columnas (nombres ya limpios).
+    """
+    name = _source_name(source)
+    wanted = None if columns is None else {_clean_name(c) for c in columns}
+
+    if name.endswith((".csv", ".csv.gz", ".txt")):
+        chunks = _iter_csv(source, chunksize, wanted)
+    elif name.endswith((".parquet", ".pq")):
+        chunks = _iter_parquet(source, chunksize, wanted)
+    else:
+        chunks = _iter_excel(source, chunksize, wanted)
+
+    for chunk in chunks:
+        chunk.columns = [_clean_name(c) for c in chunk.columns]
+        yield chunk
+
+
+def _iter_csv(source, chunksize: int, wanted) -> Iterator[pd.DataFrame]:
+    usecols = None if wanted is None else (lambda c: _clean_name(c) in wanted)
+    with pd.read_csv(source, chunksize=chunksize, usecols=usecols) as reader:
+        for chunk in reader:
+            yield chunk
+
+
+def _iter_parquet(source, chunksize: int, wanted) -> Iterator[pd.DataFrame]:
+    import pyarrow.parquet as pq
+
+    parquet = pq.ParquetFile(source)
+    cols = None
+    if wanted is not None:
+        cols = [c for c in parquet.schema_arrow.names if _clean_name(c) in wanted]
+    for batch in parquet.iter_batches(batch_size=chunksize, columns=cols):
+        yield batch.to_pandas()
+
+
+def _iter_excel(source, chunksize: int, wanted) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    # Modo solo lectura: openpyxl recorre la hoja sin cargarla completa
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        keep = [i for i, c in enumerate(header) if c is not None and (wanted is None or _clean_name(c) in wanted)]
+        names = [header[i] for i in keep]
+
+        block: List[tuple] = []
+        for row in rows:
+            block.append(tuple(row[i] if i < len(row) else None for i in keep))
+            if len(block) >= chunksize:
+                yield pd.DataFrame.from_records(block, columns=names)
+                block = []
+        if block:
+            yield pd.DataFrame.from_records(block, columns=names)
+    finally:
+        workbook.close()
@@ -0,0 +1,474 @@
+"""
+Motor de reglas vectorizado para la liquidación
+Compila las reglas declarativas de SEGMENT_RULES a operaciones de columnas NumPy
+(o a una sola expresión numexpr) y ordena su evaluación según las dependencias entre reglas
+"""
+
+import ast
+import importlib.util
+import re
+from concurrent.futures import Executor
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from profiling import NULL_PROFILER
+
+HAS_NUMEXPR = importlib.util.find_spec("numexpr") is not None
+# "auto" y "numexpr" usan numexpr si está instalado; sin numexpr todo se evalúa con NumPy.
+# numexpr gana con varios núcleos; en un solo núcleo las reglas simples van más rápido en NumPy
+RULE_BACKENDS = ("auto", "numpy", "numexpr")
+
+# Nombres de columna con espacios, "/" o "%" se escriben entre comillas invertidas
+_QUOTED_NAME = re.compile(r"`([^`]+)`")
+
+_BIN_OPS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+}
+
+_NE_BIN_OPS = {ast.Add: "+", ast.Sub: "-", ast.Mult: "*", ast.Div: "/"}
+_NE_CMP_OPS = {ast.Eq: "==", ast.NotEq: "!=", ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">="}
+
+_CMP_OPS = {
+    ast.Eq: np.equal,
+    ast.NotEq: np.not_equal,
+    ast.Lt: np.less,
+    ast.LtE: np.less_equal,
+    ast.Gt: np.greater,
+    ast.GtE: np.greater_equal,
+}
+
+
+class CompiledExpression:
+    """Expresión compilada: función sobre un DataFrame y columnas que lee."""
+
+    def __init__(self, source: str, fn: Callable, inputs: FrozenSet[str]):
+        self.source = source
+        self.fn = fn
+        self.inputs = inputs
+
+    def __call__(self, df: pd.DataFrame, computed: Optional[Dict[str, np.ndarray]] = None):
+        return self.fn(_ColumnReader(df, computed))
+
+
+class _ColumnReader:
+    """Acceso a columnas con el mismo default que r.get(col, 0)."""
+
+    def __init__(self, df: pd.DataFrame, computed: Optional[Dict[str, np.ndarray]] = None):
+        self.df = df
+        self.n = len(df)
+        self.computed = computed or {}
+
+    def get(self, name: str) -> np.ndarray:
+        if name in self.computed:
+            return self.computed[name]
+        if name not in self.df.columns:
+            return np.zeros(self.n, dtype=np.int64)
+        col = self.df[name]
+        if isinstance(col.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_numeric_dtype(col.dtype):
+            return col.to_numpy(dtype="float64", na_value=np.nan)
+        values = col.to_numpy()
+        # Los conteos reducidos (uint8, ...) se leen como int64: "DECO_HD - 1" en uint8 daría 255
+        if values.dtype.kind in "ub" or (values.dtype.kind == "i" and values.dtype.itemsize < 8):
+            return values.astype(np.int64)
+        return values
+
+
+def _compare(op, left, right):
+    # Comparar texto contra columnas numéricas debe dar False, igual que en Python
+    if isinstance(right, str) or isinstance(left, str):
+        left = np.asarray(left, dtype=object)
+        right = np.asarray(right, dtype=object)
+    return np.asarray(op(left, right), dtype=bool)
+
+
+def _py_max(a, b):
+    # Igual que max() de Python: se queda con el primero salvo que el segundo sea mayor
+    return np.where(np.greater(b, a), b, a)
+
+
+def _compile_node(node: ast.AST, names: Dict[str, str], inputs: set) -> Callable:
+    """Traduce un nodo del AST a una función sobre un _ColumnReader."""
+
+    if isinstance(node, ast.Constant):
+        if not isinstance(node.value, (int, float, str)) or isinstance(node.value, bool):
+            raise ValueError(f"Constante no soportada en regla: {node.value!r}")
+        value = node.value
+        return lambda reader: value
+
+    if isinstance(node, ast.Name):
+        col = names.get(node.id, node.id)
+        inputs.add(col)
+        return lambda reader: reader.get(col)
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BIN_OPS:
+        op = _BIN_OPS[type(node.op)]
+        left = _compile_node(node.left, names, inputs)
+        right = _compile_node(node.right, names, inputs)
+        return lambda reader: op(left(reader), right(reader))
+
+    if isinstance(node, ast.UnaryOp):
+        operand = _compile_node(node.operand, names, inputs)
+        if isinstance(node.op, ast.USub):
+            return lambda reader: np.negative(operand(reader))
+        if isinstance(node.op, ast.Not):
+            return lambda reader: np.logical_not(operand(reader))
+
+    if isinstance(node, ast.BoolOp):
+        parts = [_compile_node(v, names, inputs) for v in node.values]
+        op = np.logical_and if isinstance(node.op, ast.And) else np.logical_or
+
+        def _bool_op(reader):
+            result = np.asarray(parts[0](reader), dtype=bool)
+            for part in parts[1:]:
+                result = op(result, np.asarray(part(reader), dtype=bool))
+            return result
+        return _bool_op
+
+    if isinstance(node, ast.Compare) and all(type(o) in _CMP_OPS for o in node.ops):
+        operands = [_compile_node(node.left, names, inputs)] + [
+            _compile_node(c, names, inputs) for c in node.comparators
+        ]
+        ops = [_CMP_OPS[type(o)] for o in node.ops]
+
+        def _chained(reader):
+            values = [f(reader) for f in operands]
+            result = _compare(ops[0], values[0], values[1])
+            for i, op in enumerate(ops[1:], start=1):
+                result = result & _compare(op, values[i], values[i + 1])
+            return result
+        return _chained
+
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "max"
+            and len(node.args) == 2 and not node.keywords):
+        a = _compile_node(node.args[0], names, inputs)
+        b = _compile_node(node.args[1], names, inputs)
+        return lambda reader: _py_max(a(reader), b(reader))
+
+    raise ValueError(f"Expresión no soportada en regla: {ast.dump(node)}")
+
+
+def _parse(source: str):
+    """AST de una expresión de regla y el nombre real de cada columna entre comillas invertidas."""
+    names = {}
+
+    def _placeholder(match):
+        key = f"__c{len(names)}"
+        names[key] = match.group(1)
+        return key
+
+    text = _QUOTED_NAME.sub(_placeholder, source)
+    try:
+        tree = ast.parse(text.strip(), mode="eval")
+    except SyntaxError as e:
+        raise ValueError(f"❌ Expresión de regla inválida: {source!r} ({e.msg})") from None
+    return tree.body, names
+
+
+@lru_cache(maxsize=None)
+def compile_expression(source: str) -> CompiledExpression:
+    """Compila una expresión de regla (columnas, constantes, aritmética, comparaciones, and/or, max)."""
+    node, names = _parse(source)
+    inputs = set()
+    fn = _compile_node(node, names, inputs)
+    return CompiledExpression(source, fn, frozenset(inputs))
+
+
+def _is_boolean(node: ast.AST) -> bool:
+    return isinstance(node, (ast.Compare, ast.BoolOp)) or (
+        isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not))
+
+
+class _NumexprTranslator:
+    """Traduce el AST de una regla a texto de numexpr.
+
+    Las columnas pasan a variables v0, v1, ... Las comparaciones con texto, que
+    numexpr no hace sobre columnas de pandas, se calculan antes con NumPy y
+    entran como variables booleanas s0, s1, ...
+    """
+
+    def __init__(self, names: Dict[str, str]):
+        self.names = names
+        self.columns: Dict[str, str] = {}
+        self.precomputed: Dict[str, Callable] = {}
+
+    def boolean(self, node: ast.AST) -> str:
+        # and/or/not de NumPy convierten cada parte a bool (distinto de cero)
+        text = self.translate(node)
+        return text if _is_boolean(node) else f"({text} != 0)"
+
+    def translate(self, node: ast.AST) -> str:
+        if isinstance(node, ast.Constant):
+            if not isinstance(node.value, (int, float)) or isinstance(node.value, bool):
+                raise ValueError(f"Constante no soportada en numexpr: {node.value!r}")
+            return repr(node.value)
+
+        if isinstance(node, ast.Name):
+            col = self.names.get(node.id, node.id)
+            return self.columns.setdefault(col, f"v{len(self.columns)}")
+
+        if isinstance(node, ast.BinOp) and type(node.op) in _NE_BIN_OPS:
+            return f"({self.translate(node.left)} {_NE_BIN_OPS[type(node.op)]} {self.translate(node.right)})"
+
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            return f"(-{self.translate(node.operand)})"
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            return f"(~{self.boolean(node.operand)})"
+
+        if isinstance(node, ast.BoolOp):
+            op = " & " if isinstance(node.op, ast.And) else " | "
+            return "(" + op.join(self.boolean(v) for v in node.values) + ")"
+
+        if isinstance(node, ast.Compare) and all(type(o) in _NE_CMP_OPS for o in node.ops):
+            operands = [node.left] + list(node.comparators)
+            if any(isinstance(o, ast.Constant) and isinstance(o.value, str) for o in operands):
+                var = f"s{len(self.precomputed)}"
+                self.precomputed[var] = _compile_node(node, self.names, set())
+                return var
+            texts = [self.translate(o) for o in operands]
+            parts = [f"({texts[i]} {_NE_CMP_OPS[type(op)]} {texts[i + 1]})" for i, op in enumerate(node.ops)]
+            return parts[0] if len(parts) == 1 else "(" + " & ".join(parts) + ")"
+
+        if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "max"
+                and len(node.args) == 2 and not node.keywords):
+            a, b = self.translate(node.args[0]), self.translate(node.args[1])
+            return f"where({b} > {a}, {b}, {a})"
+
+        raise ValueError(f"Expresión no soportada en numexpr: {ast.dump(node)}")
+
+
+class FusedRule:
+    """`value if cond else 0` como una sola expresión numexpr.
+
+    numexpr evalúa la expresión por bloques y en varios hilos, sin un arreglo
+    temporal por cada operación intermedia.
+    """
+
+    def __init__(self, cond: Optional[str], value: str):
+        value_node, value_names = _parse(value)
+        translator = _NumexprTranslator(value_names)
+        value_text = translator.translate(value_node)
+        self.cond_source = None
+        if cond:
+            cond_node, translator.names = _parse(cond)
+            self.cond_source = translator.boolean(cond_node)
+            self.source = f"where({self.cond_source}, {value_text}, 0)"
+        else:
+            self.source = value_text
+        self.columns = translator.columns
+        self.precomputed = translator.precomputed
+
+    def __call__(self, df: pd.DataFrame, computed: Optional[Dict[str, np.ndarray]] = None) -> np.ndarray:
+        import numexpr
+
+        reader = _ColumnReader(df, computed)
+        local = {var: reader.get(col) for col, var in self.columns.items()}
+        local.update({var: np.asarray(fn(reader), dtype=bool) for var, fn in self.precomputed.items()})
+        result = np.asarray(numexpr.evaluate(self.source, local_dict=local))
+        if result.ndim == 0:
+            result = np.full(len(df), result.item())
+        # Como CompiledRule.evaluate: el entero 0 cuando ninguna fila cumple (con columnas float
+        # el where daría 0.0); la condición solo se vuelve a evaluar en ese caso
+        if result.dtype.kind == "f" and self.cond_source is not None and not result.any():
+            cond = np.asarray(numexpr.evaluate(self.cond_source, local_dict=local))
+            if not cond.any():
+                return np.zeros(len(df), dtype=np.int64)
+        # Las constantes enteras de numexpr son int32; NumPy daría int64
+        return result.astype(np.int64) if result.dtype.kind == "i" else result
+
+
+def resolve_backend(backend: str) -> str:
+    """Backend efectivo: "numexpr" solo si está pedido (o en "auto") y numexpr está instalado."""
+    if backend not in RULE_BACKENDS:
+        raise ValueError(f"❌ rule_backend debe ser uno de {RULE_BACKENDS}, no {backend!r}")
+    return "numexpr" if backend in ("auto", "numexpr") and HAS_NUMEXPR else "numpy"
+
+
+class CompiledRule:
+    """Regla compilada: `value if cond else 0`, evaluada sobre columnas completas."""
+
+    def __init__(self, rule: Dict, backend: str = "numpy"):
+        self.col = rule["col"]
+        self.rule = rule
+        self.formula = rule.get("formula")
+        self.fused = None
+        if self.formula is not None:
+            # Regla legacy con lambda por fila: no se conocen sus entradas
+            self.cond = None
+            self.value = None
+            self.inputs = None
+            return
+
+        value = rule.get("value", 1)
+        self.cond = compile_expression(rule["cond"]) if rule.get("cond") else None
+        self.value = compile_expression(str(value))
+        inputs = set(self.value.inputs)
+        if self.cond is not None:
+            inputs |= self.cond.inputs
+        self.inputs = frozenset(inputs)
+        if resolve_backend(backend) == "numexpr" and self.inputs:
+            try:
+                self.fused = FusedRule(rule.get("cond"), str(value))
+            except ValueError:
+                # Algo que numexpr no expresa: la regla se queda en NumPy
+                self.fused = None
+
+    def evaluate(self, df: pd.DataFrame, computed: Optional[Dict[str, np.ndarray]] = None) -> np.ndarray:
+        """Calcula la columna de la regla para todas las filas de df.
+
+        `computed` contiene columnas de reglas ya evaluadas que aún no están en df.
+        """
+        if self.formula is not None:
+            return df.apply(self.formula, axis=1)
+        if self.fused is not None:
+            try:
+                return self.fused(df, computed)
+            except (TypeError, NotImplementedError):
+                # Columnas de un tipo que numexpr no admite (texto, objetos): se evalúa con NumPy
+                pass
+
+        n = len(df)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = np.asarray(self.value(df, computed))
+            if value.ndim == 0:
+                value = np.full(n, value.item())
+            if self.cond is None:
+                return value
+            cond = np.asarray(self.cond(df, computed), dtype=bool)
+            if cond.ndim == 0:
+                cond = np.full(n, bool(cond))
+
+        # La versión por filas devuelve el entero 0 cuando ninguna fila cumple
+        if not cond.any():
+            return np.zeros(n, dtype=np.int64)
+        return np.where(cond, value, 0)
+
+
+def compile_rules(rules: List[Dict], backend: str = "numpy") -> List[CompiledRule]:
+    """Compila una lista de reglas de segmento."""
+    return [CompiledRule(rule, backend) for rule in rules]
+
+
+class RuleGraph:
+    """Grafo de dependencias entre las reglas de un segmento.
+
+    Una regla depende de otra cuando lee su columna de salida. El grafo se valida
+    al construirse (salidas duplicadas, ciclos y reglas que leen columnas que se
+    definen más adelante en la lista) y agrupa las reglas en lotes independientes.
+    """
+
+    def __init__(self, rules: List[Dict], segment_name: str = "", backend: str = "numpy"):
+        self.segment_name = segment_name
+        self.backend = backend
+        self.rules = compile_rules(rules, backend)
+        self.by_col = {}
+        for rule in self.rules:
+            if rule.col in self.by_col:
+                raise ValueError(f"❌ Regla duplicada en {segment_name}: {rule.col}")
+            self.by_col[rule.col] = rule
+
+        self.has_legacy = any(rule.inputs is None for rule in self.rules)
+        self.deps = self._build_deps()
+        self.batches = self._build_batches()
+
+    def _build_deps(self) -> Dict[str, Set[str]]:
+        """Calcula, para cada regla, las reglas del segmento que lee."""
+        position = {rule.col: i for i, rule in enumerate(self.rules)}
+        deps = {}
+        for i, rule in enumerate(self.rules):
+            if rule.inputs is None:
+                # Una lambda puede leer cualquier columna previa
+                deps[rule.col] = {r.col for r in self.rules[:i]}
+                continue
+            deps[rule.col] = {col for col in rule.inputs if col in self.by_col}
+            for col in deps[rule.col]:
+                if col == rule.col:
+                    raise ValueError(f"❌ Ciclo en reglas de {self.segment_name}: {rule.col} se lee a sí misma")
+                if position[col] > i:
+                    raise ValueError(
+                        f"❌ Orden inválido en reglas de {self.segment_name}: "
+                        f"{rule.col} lee {col}, que se define después"
+                    )
+        return deps
+
+    def _build_batches(self) -> List[List[CompiledRule]]:
+        """Ordena topológicamente las reglas en lotes sin dependencias entre sí."""
+        level = {}
+        pending = [rule.col for rule in self.rules]
+        while pending:
+            ready = [col for col in pending if all(d in level for d in self.deps[col])]
+            if not ready:
+                raise ValueError(f"❌ Ciclo en reglas de {self.segment_name}: {pending}")
+            for col in ready:
+                level[col] = max((level[d] + 1 for d in self.deps[col]), default=0)
+            pending = [col for col in pending if col not in level]
+
+        batches = [[] for _ in range(max(level.values(), default=-1) + 1)]
+        for rule in self.rules:
+            batches[level[rule.col]].append(rule)
+        return batches
+
+    def downstream(self, col: str) -> Set[str]:
+        """Columnas que deben recalcularse si cambia la regla `col` (incluida)."""
+        affected = {col}
+        for rule in self.rules:
+            if self.deps[rule.col] & affected:
+                affected.add(rule.col)
+        return affected
+
+    def with_rule(self, rule: Dict) -> "RuleGraph":
+        """Nuevo grafo con `rule` reemplazando a la regla de la misma columna (o añadida al final)."""
+        rules = [r.rule for r in self.rules]
+        for i, r in enumerate(rules):
+            if r["col"] == rule["col"]:
+                rules[i] = rule
+                break
+        else:
+            rules.append(rule)
+        return RuleGraph(rules, self.segment_name, self.backend)
+
+    def _evaluate_rule(self, rule: CompiledRule, df: pd.DataFrame, computed: Dict[str, np.ndarray],
+                       profiler) -> np.ndarray:
+        if not profiler.enabled:
+            return rule.evaluate(df, computed)
+        with profiler.stage(f"regla:{self.segment_name}:{rule.col}", rows_in=len(df)) as record:
+            result = rule.evaluate(df, computed)
+            record["rows_out"] = int(np.count_nonzero(np.asarray(result) > 0))
+        return result
+
+    def evaluate(self, df: pd.DataFrame, only: Optional[Iterable[str]] = None,
+                 executor: Optional[Executor] = None, profiler=NULL_PROFILER) -> pd.DataFrame:
+        """Evalúa las reglas sobre df (en sitio) por lotes, respetando las dependencias.
+
+        Con `only` se recalculan solo esas columnas; el resto de columnas % se lee de df.
+        Con `executor` las reglas de un mismo lote se evalúan en paralelo. Con
+        `profiler` se registra cada regla como una etapa (filas de salida = filas con valor > 0).
+        """
+        if self.has_legacy:
+            # Las lambdas necesitan ver df con todas las columnas previas
+            for rule in self.rules:
+                if only is None or rule.col in only:
+                    df[rule.col] = self._evaluate_rule(rule, df, None, profiler)
+            return df
+
+        only = None if only is None else set(only)
+        computed = {}
+        for batch in self.batches:
+            batch = [rule for rule in batch if only is None or rule.col in only]
+            if executor is not None and len(batch) > 1:
+                results = list(executor.map(lambda r: self._evaluate_rule(r, df, computed, profiler), batch))
+            else:
+                results = [self._evaluate_rule(rule, df, computed, profiler) for rule in batch]
+            for rule, result in zip(batch, results):
+                computed[rule.col] = result
+
+        # Asignar en el orden de la lista para conservar el orden de columnas
+        for rule in self.rules:
+            if rule.col in computed:
+                df[rule.col] = computed[rule.col]
+        return df
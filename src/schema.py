@@ -0,0 +1,136 @@
+"""
+Esquema de tipos para las columnas de texto repetitivas y las de conteo
+Convierte el texto a categóricas con un conjunto de categorías compartido por toda la corrida
+y los conteos al entero sin signo más chico que los guarda
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import CategoricalDtype, is_numeric_dtype
+
+# Columnas de texto con pocos valores distintos respecto al número de filas
+CATEGORICAL_COLUMNS = [
+    "TIPO_DE_ORDEN", "SUBTIPO_DE_ORDEN", "MEDIO_DE_ACCESO", "CIUDAD", "DEPARTAMENTO",
+    "NOMBRE_TECNICO", "ATRIBUTO", "HOMOLOGADO", "SEGMENTO",
+]
+
+
+def _sorted_union(*values: Iterable) -> pd.Index:
+    """Unión ordenada y sin nulos de varios conjuntos de valores."""
+    parts = [pd.Index(v) for v in values]
+    union = parts[0] if len(parts) == 1 else parts[0].append(parts[1:])
+    return union.dropna().unique().sort_values()
+
+
+class CategorySchema:
+    """Categorías por columna, compartidas por todos los DataFrames de una corrida.
+
+    Las categorías se mantienen ordenadas (las agrupaciones salen en el mismo
+    orden que con texto) y solo crecen: aplicar el esquema a un DataFrame con
+    valores nuevos los agrega en vez de convertirlos en nulos.
+    """
+
+    def __init__(self, categories: Optional[Dict[str, Sequence]] = None):
+        self.categories = {col: _sorted_union(values) for col, values in (categories or {}).items()}
+
+    def dtype(self, col: str) -> CategoricalDtype:
+        return CategoricalDtype(self.categories.get(col, pd.Index([])))
+
+    def apply(self, df: pd.DataFrame, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Convierte las columnas del esquema presentes en df a su tipo categórico."""
+        for col in columns or CATEGORICAL_COLUMNS:
+            if col not in df.columns:
+                continue
+            values = df[col].cat.categories if isinstance(df[col].dtype, CategoricalDtype) else df[col].unique()
+            current = self.categories.get(col)
+            if current is None or not pd.Index(values).dropna().isin(current).all():
+                self.categories[col] = _sorted_union(values) if current is None else _sorted_union(current, values)
+            dtype = self.dtype(col)
+            if not isinstance(df[col].dtype, CategoricalDtype):
+                df[col] = df[col].astype(dtype)
+            elif not df[col].cat.categories.equals(dtype.categories):
+                # astype no reordena categorías que solo difieren en el orden
+                df[col] = df[col].cat.set_categories(dtype.categories)
+        return df
+
+
+def concat_categorical(frames: List[pd.DataFrame], **kwargs) -> pd.DataFrame:
+    """pd.concat que une las categorías distintas en vez de volver las columnas a texto."""
+    frames = list(frames)
+    columns = {c for df in frames for c in df.columns if isinstance(df[c].dtype, CategoricalDtype)}
+    for col in columns:
+        dtypes = [df[col].dtype for df in frames if col in df.columns]
+        if all(d == dtypes[0] for d in dtypes):
+            continue
+        dtype = CategoricalDtype(_sorted_union(*(
+            df[col].cat.categories if isinstance(df[col].dtype, CategoricalDtype) else df[col].unique()
+            for df in frames if col in df.columns
+        )))
+        frames = [df.assign(**{col: df[col].astype(dtype)}) if col in df.columns else df for df in frames]
+    return pd.concat(frames, **kwargs)
+
+
+# Enteros sin signo de menor a mayor; los conteos y marcas de concepto caben casi siempre en uint8
+UNSIGNED_DTYPES = [np.uint8, np.uint16, np.uint32, np.uint64]
+NULLABLE_UNSIGNED = {np.uint8: pd.UInt8Dtype(), np.uint16: pd.UInt16Dtype(),
+                     np.uint32: pd.UInt32Dtype(), np.uint64: pd.UInt64Dtype()}
+
+
+def unsigned_dtype(values: np.ndarray):
+    """Entero sin signo más chico que guarda `values` sin perder nada, o None.
+
+    Sirve solo si todos los valores no nulos son enteros y no negativos; con
+    nulos devuelve el tipo nullable de pandas (UInt8, UInt16, ...).
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == "b":
+        return np.dtype(np.uint8)
+    if values.dtype.kind not in "iuf":
+        return None
+    valid = values[~np.isnan(values)] if values.dtype.kind == "f" else values
+    if values.dtype.kind == "f" and not (np.isfinite(valid).all() and (valid == np.floor(valid)).all()):
+        return None
+    if len(valid) and valid.min() < 0:
+        return None
+    top = valid.max() if len(valid) else 0
+    dtype = next(d for d in UNSIGNED_DTYPES if top <= np.iinfo(d).max)
+    return NULLABLE_UNSIGNED[dtype] if len(valid) < len(values) else np.dtype(dtype)
+
+
+def downcast_counts(df: pd.DataFrame, columns: Iterable[str]) -> pd.DataFrame:
+    """Pasa las columnas de conteo presentes en df al entero sin signo más chico posible.
+
+    Las columnas con decimales o negativos se dejan como están. Modifica df.
+    """
+    for col in columns:
+        if col not in df.columns or not is_numeric_dtype(df[col].dtype):
+            continue
+        values = df[col].to_numpy(dtype="float64", na_value=np.nan) \
+            if isinstance(df[col].dtype, pd.api.extensions.ExtensionDtype) else df[col].to_numpy()
+        dtype = unsigned_dtype(values)
+        if dtype is not None and dtype != df[col].dtype:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def count_memory_report(frames: Dict[str, pd.DataFrame], columns: Iterable[str]) -> pd.DataFrame:
+    """Memoria de cada DataFrame con las columnas de conteo en 64 bits y como están.
+
+    "antes_mb" cuenta cada columna de `columns` presente como float64/int64 (8
+    bytes por fila), que es como salían antes de reducirlas.
+    """
+    columns = list(columns)
+    rows = []
+    for name, df in frames.items():
+        if df is None or df.empty:
+            continue
+        usage = df.memory_usage(deep=True, index=True)
+        counts = [c for c in columns if c in df.columns]
+        before = usage.sum() - usage[counts].sum() + 8 * len(df) * len(counts)
+        rows.append({"tabla": name, "filas": len(df), "columnas_conteo": len(counts),
+                     "antes_mb": before / 1024 ** 2, "despues_mb": usage.sum() / 1024 ** 2})
+    report = pd.DataFrame(rows, columns=["tabla", "filas", "columnas_conteo", "antes_mb", "despues_mb"])
+    report["ahorro_pct"] = (1 - report["despues_mb"] / report["antes_mb"]) * 100
+    return report
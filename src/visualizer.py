@@ -3,13 +3,25 @@ Módulo de visualización para la aplicación de liquidaciones
 Contiene todas las funciones de gráficos y análisis visual
 """
 
+from __future__ import annotations
+
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
-import plotly.figure_factory as ff
-from plotly.subplots import make_subplots
-import streamlit as st
-from typing import Dict, List, Tuple
+from typing import Dict, List, Tuple, TYPE_CHECKING
+
+from aggregates import get_aggregates
+from lazy import LazyModule, lazy_attr
+
+# Plotly y Streamlit se importan al dibujar el primer gráfico
+if TYPE_CHECKING:
+    import plotly.express as px
+    import plotly.graph_objects as go
+    import streamlit as st
+    from plotly.subplots import make_subplots
+else:
+    px = LazyModule("plotly.express")
+    go = LazyModule("plotly.graph_objects")
+    st = LazyModule("streamlit")
+    make_subplots = lazy_attr("plotly.subplots", "make_subplots")
 
 class LiquidacionVisualizer:
     def __init__(self):
@@ -27,13 +39,7 @@ class LiquidacionVisualizer:
                 "tecnicos_unicos": 0
             }
         
-        return {
-            "total_ordenes": len(df),
-            "total_baremos": df["BAREMOS"].sum(),
-            "total_factura": df["FACTURA"].sum() if "FACTURA" in df.columns else 0.0,
-            "promedio_baremos": df["BAREMOS"].mean(),
-            "tecnicos_unicos": df["NOMBRE_TECNICO"].nunique() if "NOMBRE_TECNICO" in df.columns else 0
-        }
+        return dict(get_aggregates(df).summary_metrics)
     
     def display_metrics_cards(self, metrics: Dict[str, float]):
         """Muestra las métricas en tarjetas de Streamlit."""
@@ -60,11 +66,8 @@ class LiquidacionVisualizer:
             return go.Figure().add_annotation(text="No hay datos disponibles", 
                                             xref="paper", yref="paper", x=0.5, y=0.5)
         
-        # Determinar segmento basado en MEDIO_DE_ACCESO y TIPO_DE_ORDEN
-        df_temp = df.copy()
-        df_temp['SEGMENTO'] = df_temp['MEDIO_DE_ACCESO'] + '_' + df_temp['TIPO_DE_ORDEN']
-        
-        segment_data = df_temp.groupby('SEGMENTO')['BAREMOS'].sum().reset_index()
+        # Segmento basado en MEDIO_DE_ACCESO y TIPO_DE_ORDEN
+        segment_data = get_aggregates(df).by_segment.rename(columns={'Total_Baremos': 'BAREMOS'})
         
         fig = px.bar(
             segment_data, 
@@ -90,12 +93,10 @@ class LiquidacionVisualizer:
             return go.Figure().add_annotation(text="No hay datos de técnicos disponibles", 
                                             xref="paper", yref="paper", x=0.5, y=0.5)
         
-        tech_data = df.groupby('NOMBRE_TECNICO').agg({
-            'BAREMOS': 'sum',
-            'FACTURA': 'sum' if 'FACTURA' in df.columns else 'count'
-        }).reset_index()
-        
-        tech_data = tech_data.nlargest(top_n, 'BAREMOS')
+        # El ranking ya viene ordenado: solo se toma la cabeza
+        tech_data = get_aggregates(df).technician_ranking.head(top_n).rename(columns={
+            'Total_Baremos': 'BAREMOS', 'Total_Factura': 'FACTURA'
+        })
         
         fig = px.bar(
             tech_data,
@@ -122,8 +123,7 @@ class LiquidacionVisualizer:
             return go.Figure().add_annotation(text="No hay datos de ciudad disponibles", 
                                             xref="paper", yref="paper", x=0.5, y=0.5)
         
-        city_data = df.groupby('CIUDAD')['BAREMOS'].sum().reset_index()
-        city_data = city_data.nlargest(15, 'BAREMOS')
+        city_data = get_aggregates(df).by_city.head(15)
         
         fig = px.pie(
             city_data,
@@ -143,13 +143,7 @@ class LiquidacionVisualizer:
             return go.Figure().add_annotation(text="No hay datos de fecha disponibles", 
                                             xref="paper", yref="paper", x=0.5, y=0.5)
         
-        df_temp = df.copy()
-        df_temp['FECHA_DE_CIERRE_FINAL'] = pd.to_datetime(df_temp['FECHA_DE_CIERRE_FINAL'])
-        
-        daily_data = df_temp.groupby(df_temp['FECHA_DE_CIERRE_FINAL'].dt.date).agg({
-            'BAREMOS': 'sum',
-            'PET_ATIS': 'count'
-        }).reset_index()
+        daily_data = get_aggregates(df).by_day
         
         fig = make_subplots(specs=[[{"secondary_y": True}]])
         
@@ -193,12 +187,7 @@ class LiquidacionVisualizer:
             return go.Figure().add_annotation(text="No hay datos de atributos disponibles", 
                                             xref="paper", yref="paper", x=0.5, y=0.5)
         
-        concept_data = df.groupby('ATRIBUTO').agg({
-            'CANTIDAD': 'sum',
-            'BAREMOS': 'sum'
-        }).reset_index()
-        
-        concept_data = concept_data.nlargest(15, 'BAREMOS')
+        concept_data = get_aggregates(df).by_concept.nlargest(15, 'BAREMOS')
         
         fig = px.scatter(
             concept_data,
@@ -226,16 +215,7 @@ class LiquidacionVisualizer:
             return go.Figure().add_annotation(text="No hay datos suficientes para el heatmap", 
                                             xref="paper", yref="paper", x=0.5, y=0.5)
         
-        df_temp = df.copy()
-        df_temp['SEGMENTO'] = df_temp['MEDIO_DE_ACCESO'] + '_' + df_temp['TIPO_DE_ORDEN']
-        
-        heatmap_data = df_temp.pivot_table(
-            index='CIUDAD',
-            columns='SEGMENTO',
-            values='BAREMOS',
-            aggfunc='sum',
-            fill_value=0
-        )
+        heatmap_data = get_aggregates(df).city_segment
         
         # Limitar a top 10 ciudades por baremos
         city_totals = heatmap_data.sum(axis=1).nlargest(10)
@@ -259,20 +239,12 @@ class LiquidacionVisualizer:
         if df.empty or "NOMBRE_TECNICO" not in df.columns:
             return pd.DataFrame()
         
-        summary = df.groupby('NOMBRE_TECNICO').agg({
-            'BAREMOS': ['sum', 'mean', 'count'],
-            'FACTURA': 'sum' if 'FACTURA' in df.columns else 'count',
-            'CIUDAD': 'nunique'
-        }).round(2)
-        
-        # Aplanar columnas multi-nivel
-        summary.columns = ['Total_Baremos', 'Promedio_Baremos', 'Num_Ordenes', 'Total_Factura', 'Ciudades_Atendidas']
-        summary = summary.reset_index()
+        summary = get_aggregates(df).technician_ranking.round(2)
         
         # Calcular eficiencia (baremos por orden)
         summary['Eficiencia'] = (summary['Total_Baremos'] / summary['Num_Ordenes']).round(2)
         
-        return summary.sort_values('Total_Baremos', ascending=False)
+        return summary
     
     def create_segment_comparison(self, df: pd.DataFrame) -> go.Figure:
         """Comparación detallada entre segmentos."""
@@ -280,16 +252,7 @@ class LiquidacionVisualizer:
             return go.Figure().add_annotation(text="No hay datos para comparar segmentos", 
                                             xref="paper", yref="paper", x=0.5, y=0.5)
         
-        df_temp = df.copy()
-        df_temp['SEGMENTO'] = df_temp['MEDIO_DE_ACCESO'] + '_' + df_temp['TIPO_DE_ORDEN']
-        
-        segment_stats = df_temp.groupby('SEGMENTO').agg({
-            'BAREMOS': ['sum', 'mean', 'count'],
-            'FACTURA': 'sum' if 'FACTURA' in df_temp.columns else 'count'
-        }).round(2)
-        
-        segment_stats.columns = ['Total_Baremos', 'Promedio_Baremos', 'Num_Ordenes', 'Total_Factura']
-        segment_stats = segment_stats.reset_index()
+        segment_stats = get_aggregates(df).by_segment.round(2).drop(columns='Ciudades_Atendidas', errors='ignore')
         
         fig = make_subplots(
             rows=2, cols=2,
@@ -331,6 +294,31 @@ class LiquidacionVisualizer:
         
         return fig
     
+    def create_history_trend(self, trend: pd.DataFrame, by: str = None, value: str = "BAREMOS") -> go.Figure:
+        """Evolución mensual desde el histórico (HistoryStore.monthly_trend), una línea por grupo."""
+        if trend.empty:
+            return go.Figure().add_annotation(text="No hay liquidaciones en el histórico", 
+                                            xref="paper", yref="paper", x=0.5, y=0.5)
+        
+        fig = px.line(
+            trend,
+            x='MES',
+            y=value,
+            color=by,
+            markers=True,
+            title=f'Evolución Mensual de {value.title()}',
+            color_discrete_sequence=self.color_palette
+        )
+        
+        fig.update_layout(
+            xaxis_title="Mes",
+            yaxis_title=value.title(),
+            height=450,
+            font=dict(size=12)
+        )
+        
+        return fig
+    
     def display_data_table(self, df: pd.DataFrame, title: str = "Datos Detallados", max_rows: int = 1000):
         """Muestra tabla de datos con filtros."""
         st.subheader(title)